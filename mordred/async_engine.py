@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import asyncio
+import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mordred.metrics import CYCLE_DURATION, TASK_DURATION, TASK_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEngine():
+    """ Execute rounds of tasks as coroutines in a single event loop
+
+    Each round is the list of tasks of a backend (or the global tasks),
+    executed serially like in a TasksManager thread, but all the rounds
+    share the same event loop. The tasks doing HTTP requests run them
+    concurrently with Task.execute_async; the blocking work (and the
+    enrichment, which could use its own process pool) goes to an executor.
+    """
+
+    def __init__(self, max_workers=10, task_timeout=0):
+        """
+        :param max_workers: max number of blocking calls executed in parallel
+        :param task_timeout: seconds executing a task before abandoning it, 0 no limit
+        """
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max(1, max_workers))
+        self.task_timeout = task_timeout
+        self.abandoned_tasks = {}  # task -> future of its abandoned execution
+        self.rounds = []  # (tasks, timer, global_task)
+        self.events = []  # wakeup event for each round, created in the loop
+        self.autorefreshes = set()  # autorefresh coroutines running out of the rounds
+        self.stopper = None
+
+    def add_round(self, tasks, timer=0, global_task=False):
+        """ Add the tasks to be executed in the same round
+
+        :param tasks: tasks executed serially in the round
+        :param timer: seconds to wait before each execution of the round
+        :param global_task: the tasks are not related to a backend
+        """
+        self.rounds.append((tasks, timer, global_task))
+
+    def wakeup(self, reason, global_tasks=False, repos_diff=None, autorefresh=False):
+        """ Make the rounds waiting for their timer execute now
+
+        It is called from other threads, so the events are set in the loop.
+        With a repos_diff, only the rounds of the changed backends are woken up.
+        With autorefresh, only the autorefresh of the tasks of the backend
+        rounds is executed now, the rounds keep waiting for their timer.
+        """
+        if not self.loop.is_running():
+            return
+        logger.debug("Async engine woken up: %s", reason)
+        self.loop.call_soon_threadsafe(self.__wakeup, global_tasks, repos_diff, autorefresh)
+
+    def __wakeup(self, global_tasks, repos_diff, autorefresh):
+        for ((tasks, _, global_task), event) in zip(self.rounds, self.events):
+            if global_task and (autorefresh or not global_tasks):
+                continue
+            if autorefresh:
+                future = self.loop.create_task(self.__autorefresh(tasks))
+                self.autorefreshes.add(future)
+                future.add_done_callback(self.autorefreshes.discard)
+                continue
+            section = getattr(tasks[0], 'backend_section', None) if tasks else None
+            if repos_diff is not None and section and not repos_diff.is_changed(section):
+                continue
+            event.set()
+
+    async def __autorefresh(self, tasks):
+        for task in tasks:
+            if not hasattr(task, 'autorefresh'):
+                continue
+            try:
+                await self.loop.run_in_executor(self.executor, task.autorefresh)
+            except Exception as ex:
+                logger.error("Exception in async engine autorefresh %s", ex)
+
+    def stop(self):
+        """ Stop the rounds once their current execution finishes """
+        self.loop.call_soon_threadsafe(self.__stop)
+
+    def __stop(self):
+        self.stopper.set()
+        for event in self.events:
+            event.set()
+
+    async def __wait(self, timer, event):
+        try:
+            await asyncio.wait_for(event.wait(), timer)
+        except asyncio.TimeoutError:
+            pass
+        event.clear()
+
+    async def __execute_task(self, task, section):
+        """ Execute a task, abandoning it if it exceeds the task_timeout
+
+        An abandoned task keeps running (its blocking calls can not be
+        stopped) but the round goes on with the next tasks. It is not
+        executed again until it finishes.
+        """
+        timeout = self.task_timeout
+        if timeout <= 0:
+            await task.execute_async(self.loop, self.executor)
+            return
+
+        task_name = type(task).__name__
+        if task in self.abandoned_tasks:
+            if not self.abandoned_tasks[task].done():
+                logger.warning("[%s] %s abandoned before is still running, skipping it",
+                               section, task_name)
+                return
+            del self.abandoned_tasks[task]
+
+        future = asyncio.ensure_future(task.execute_async(self.loop, self.executor),
+                                       loop=self.loop)
+        (done, _) = await asyncio.wait([future], timeout=timeout)
+        if not done:
+            TASK_TIMEOUTS.inc(section=section, task=task_name)
+            logger.error("[%s] %s abandoned after %i s", section, task_name, timeout)
+
+            def finished(future):
+                # the errors of the abandoned execution are just logged
+                if not future.cancelled() and future.exception():
+                    logger.error("[%s] Abandoned %s failed: %s", section, task_name,
+                                 future.exception())
+            future.add_done_callback(finished)
+            self.abandoned_tasks[task] = future
+            return
+        future.result()
+
+    async def __run_round(self, tasks, timer, event, repeat):
+        while True:
+            if timer > 0:
+                await self.__wait(timer, event)
+            if self.stopper.is_set():
+                break
+            section = None
+            cycle_start = time.time()
+            for task in tasks:
+                logger.debug("Executing task %s", task)
+                section = getattr(task, 'backend_section', None) or "global"
+                with TASK_DURATION.time(section=section, task=type(task).__name__):
+                    await self.__execute_task(task, section)
+            if section:
+                CYCLE_DURATION.observe(time.time() - cycle_start, section=section)
+            if not repeat:
+                break
+
+    async def __run(self, repeat):
+        self.stopper = asyncio.Event()
+        self.events = [asyncio.Event() for _ in self.rounds]
+        coros = [self.__run_round(tasks, timer, event, repeat)
+                 for ((tasks, timer, _), event) in zip(self.rounds, self.events)]
+        results = await asyncio.gather(*coros, return_exceptions=True)
+        # the abandoned tasks still running are not waited for
+        abandoned = [future for future in self.abandoned_tasks.values() if not future.done()]
+        for future in abandoned:
+            future.cancel()
+        await asyncio.gather(*abandoned, return_exceptions=True)
+        return results
+
+    def run(self, repeat=False):
+        """ Execute the rounds until they are done or the engine is stopped
+
+        :param repeat: execute the rounds forever
+        :returns: list of exceptions raised by the rounds
+        """
+        try:
+            results = self.loop.run_until_complete(self.__run(repeat))
+        finally:
+            self.executor.shutdown(wait=True)
+            self.loop.close()
+
+        return [res for res in results if isinstance(res, BaseException)]
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import queue
+import threading
+import time
+
+from mordred.http import HttpSession, ofuscate_server_uri
+from mordred.metrics import BACKPRESSURE_WAIT, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# seconds between checks of the ElasticSearch ingest queue
+INGEST_CHECK_INTERVAL = 1
+
+
+class Watermark():
+    """ Flow control between stages with a high and a low watermark
+
+    The flow stops when the level of the downstream stage reaches the high
+    watermark and it does not resume until the level drops to the low one,
+    so the producers don't flap around a single limit.
+    """
+
+    def __init__(self, high, low=0, name=""):
+        """
+        :param high: level which stops the flow, 0 means no limit
+        :param low: level which resumes the flow, 0 means half of high
+        :param name: name of the queue between the stages
+        """
+        self.high = high
+        self.low = min(low, high) if low > 0 else high // 2
+        self.name = name
+        self.level = 0
+        self.stopped = False
+        self.cond = threading.Condition()
+
+    def set_level(self, level):
+        with self.cond:
+            self.level = level
+            self.__update()
+
+    def add(self, amount=1):
+        with self.cond:
+            self.level += amount
+            self.__update()
+
+    def __update(self):
+        if self.high <= 0:
+            return
+        if not self.stopped and self.level >= self.high:
+            logger.debug("Flow stopped in %s with %i pending", self.name, self.level)
+            self.stopped = True
+        elif self.stopped and self.level <= self.low:
+            logger.debug("Flow resumed in %s with %i pending", self.name, self.level)
+            self.stopped = False
+            self.cond.notify_all()
+
+    def is_open(self):
+        with self.cond:
+            return not self.stopped
+
+    def wait(self):
+        """ Wait until the flow is not stopped """
+        with self.cond:
+            if not self.stopped:
+                return
+            start = time.time()
+            self.cond.wait_for(lambda: not self.stopped)
+        BACKPRESSURE_WAIT.inc(time.time() - start, queue=self.name)
+
+
+class WatermarkQueue(queue.Queue):
+    """ Queue with its size as the level of a watermark
+
+    The producers wait for the watermark before producing a new item, so
+    the work already done is never blocked in the queue.
+    """
+
+    def __init__(self, high=0, low=0, name="", section=""):
+        super().__init__()
+        self.watermark = Watermark(high, low, name)
+        self.name = name
+        self.section = section
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        self.__update()
+
+    def get(self, block=True, timeout=None):
+        item = super().get(block, timeout)
+        self.__update()
+        return item
+
+    def __update(self):
+        size = self.qsize()
+        self.watermark.set_level(size)
+        QUEUE_DEPTH.set(size, queue=self.name, section=self.section)
+
+
+class IngestGate():
+    """ Wait while ElasticSearch can not keep up with the bulk uploads
+
+    The level is the number of bulk requests queued in the ElasticSearch
+    nodes (the bulk thread pool, write in ElasticSearch >= 6.3), checked at
+    most once per INGEST_CHECK_INTERVAL for all the threads using the gate.
+    """
+
+    __gates = {}  # es url -> gate
+    __gates_lock = threading.Lock()
+
+    def __init__(self, es_url, high, low=0):
+        self.es_url = es_url
+        # name of the gate in the logs and metrics, without the credentials
+        self.name = ofuscate_server_uri(es_url)
+        self.watermark = Watermark(high, low, "es_ingest")
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_gate(cls, es_url, high, low=0):
+        """ Get the gate shared by all the users of es_url """
+        with cls.__gates_lock:
+            if es_url not in cls.__gates:
+                cls.__gates[es_url] = IngestGate(es_url, high, low)
+            return cls.__gates[es_url]
+
+    def fetch_queued(self):
+        """ Number of bulk requests queued in all the ElasticSearch nodes """
+        r = HttpSession.get().get(self.es_url + "/_nodes/stats/thread_pool")
+        r.raise_for_status()
+        queued = 0
+        for node in r.json()['nodes'].values():
+            pools = node['thread_pool']
+            pool = pools['write'] if 'write' in pools else pools.get('bulk', {})
+            queued += pool.get('queue', 0)
+        return queued
+
+    def __check(self):
+        with self.lock:
+            if self.checked + INGEST_CHECK_INTERVAL > time.time():
+                return
+            try:
+                queued = self.fetch_queued()
+            except Exception as ex:
+                # don't stop the work if the stats are not available
+                logger.warning("Can not get the ingest queue of %s: %s", self.name, ex)
+                queued = 0
+            self.checked = time.time()
+        self.watermark.set_level(queued)
+        QUEUE_DEPTH.set(queued, queue="es_ingest", section=self.name)
+
+    def wait(self):
+        """ Wait until ElasticSearch is below the watermarks """
+        if self.watermark.high <= 0:
+            return
+        self.__check()
+        if self.watermark.is_open():
+            return
+        start = time.time()
+        logger.info("Waiting for %s to ingest the pending bulks", self.name)
+        while not self.watermark.is_open():
+            time.sleep(INGEST_CHECK_INTERVAL)
+            self.__check()
+        BACKPRESSURE_WAIT.inc(time.time() - start, queue="es_ingest")
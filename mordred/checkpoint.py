@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import sqlite3
+
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointStore():
+    """ Durable state of Mordred to resume the work after a restart
+
+    It stores the stats of the last run of each repository in each phase
+    (the ReposStats), the start of the cycles in progress and the pending
+    autorefresh work of each backend (the AutorefreshState). Every change
+    is committed when it happens, so a process killed in the middle of a
+    cycle loses nothing already done.
+    """
+
+    def __init__(self, db_path):
+        """
+        :param db_path: path to the SQLite database with the state
+        """
+        self.db_path = db_path
+
+        with self.__connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS repos_stats "
+                         "(section TEXT, phase TEXT, repo TEXT, last_run REAL, "
+                         "duration REAL, items INTEGER, interval INTEGER, "
+                         "PRIMARY KEY (section, phase, repo))")
+            conn.execute("CREATE TABLE IF NOT EXISTS cycles "
+                         "(section TEXT, phase TEXT, start REAL, PRIMARY KEY (section, phase))")
+            conn.execute("CREATE TABLE IF NOT EXISTS autorefresh "
+                         "(section TEXT PRIMARY KEY, dirty INTEGER)")
+            conn.execute("CREATE TABLE IF NOT EXISTS autorefresh_uuids "
+                         "(section TEXT, uuid TEXT, PRIMARY KEY (section, uuid))")
+
+    def __connect(self):
+        # A connection per operation, so the store can be used from any thread
+        return _Connection(self.db_path)
+
+    def load_repos_stats(self):
+        """ Get the stats of all the repositories
+
+        :returns: dict with (section, phase, repo) -> stats dict
+        """
+        stats = {}
+        with self.__connect() as conn:
+            for row in conn.execute("SELECT * FROM repos_stats"):
+                repo_stats = {
+                    "last_run": row[3],
+                    "duration": row[4],
+                    "items": row[5]
+                }
+                if row[6] is not None:
+                    repo_stats["interval"] = row[6]
+                stats[(row[0], row[1], row[2])] = repo_stats
+        return stats
+
+    def save_repo_stats(self, backend_section, phase, repo, stats):
+        with self.__connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO repos_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (backend_section, phase, repo, stats['last_run'], stats['duration'],
+                          stats['items'], stats.get('interval')))
+
+    def remove_repo_stats(self, backend_section, phase, repo):
+        with self.__connect() as conn:
+            conn.execute("DELETE FROM repos_stats WHERE section = ? AND phase = ? AND repo = ?",
+                         (backend_section, phase, repo))
+
+    def load_cycles(self):
+        """ Get the cycles not finished, interrupted by a restart
+
+        :returns: dict with (section, phase) -> start of the cycle
+        """
+        with self.__connect() as conn:
+            return {(row[0], row[1]): row[2] for row in conn.execute("SELECT * FROM cycles")}
+
+    def save_cycle(self, backend_section, phase, start):
+        with self.__connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO cycles VALUES (?, ?, ?)",
+                         (backend_section, phase, start))
+
+    def remove_cycle(self, backend_section, phase):
+        with self.__connect() as conn:
+            conn.execute("DELETE FROM cycles WHERE section = ? AND phase = ?",
+                         (backend_section, phase))
+
+    def load_autorefresh(self):
+        """ Get the pending autorefresh work
+
+        :returns: dicts with section -> dirty flag and section -> set of uuids
+        """
+        dirty = {}
+        uuids = {}
+        with self.__connect() as conn:
+            for (backend_section, section_dirty) in conn.execute("SELECT * FROM autorefresh"):
+                dirty[backend_section] = bool(section_dirty)
+                uuids[backend_section] = set()
+            for (backend_section, uuid) in conn.execute("SELECT * FROM autorefresh_uuids"):
+                uuids.setdefault(backend_section, set()).add(uuid)
+        return dirty, uuids
+
+    def save_autorefresh(self, dirty):
+        """ Save the autorefresh flags
+
+        :param dirty: dict with section -> dirty flag
+        """
+        with self.__connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO autorefresh VALUES (?, ?)",
+                             [(backend_section, int(section_dirty))
+                              for (backend_section, section_dirty) in dirty.items()])
+
+    def add_autorefresh_uuids(self, backend_sections, uuids):
+        with self.__connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO autorefresh_uuids VALUES (?, ?)",
+                             [(backend_section, uuid) for backend_section in backend_sections
+                              for uuid in uuids])
+
+    def remove_autorefresh_uuids(self, backend_section, uuids):
+        with self.__connect() as conn:
+            conn.executemany("DELETE FROM autorefresh_uuids WHERE section = ? AND uuid = ?",
+                             [(backend_section, uuid) for uuid in uuids])
+
+
+class _Connection():
+    """ SQLite connection committed and closed at the end of the block """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path, timeout=60)
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with closing(self.conn):
+            if exc_type:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
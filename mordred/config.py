@@ -23,12 +23,153 @@
 
 import configparser
 import json
+import keyword
 import logging
 
+from collections.abc import Mapping
+from functools import lru_cache
+from types import MappingProxyType
+
 from grimoire_elk.utils import get_connectors
 
 logger = logging.getLogger(__name__)
 
+# params of the backend sections which are not for the perceval backend
+ES_INDEX_FIELDS = ('enriched_index', 'raw_index', 'es_collection_url')
+
+
+class _ReadOnlyMapping(Mapping):
+    """ Mapping which can not be changed, with its keys also as attributes
+
+    The keys which are valid identifiers, with '_' for '-', are slots of
+    a class created for them, so reading them is an attribute read.
+    """
+
+    __slots__ = ('_items',)
+
+    def __init__(self, items):
+        set_attr = object.__setattr__
+        set_attr(self, '_items', MappingProxyType(items))
+        for (key, value) in items.items():
+            attr = _attr_name(type(self).__bases__[0], key)
+            if attr:
+                set_attr(self, attr, value)
+
+    def __getitem__(self, key):
+        return self._items[key]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError("The config is read only, use Config.set_param to change it")
+
+    def __delattr__(self, attr):
+        raise AttributeError("The config is read only, use Config.set_param to change it")
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__bases__[0].__name__, dict(self._items))
+
+
+def _attr_name(base, key):
+    """ Attribute for key in the classes derived from base, None if it has not one """
+    attr = key.replace('-', '_')
+    if not attr.isidentifier() or keyword.iskeyword(attr) or attr.startswith('_') or \
+            hasattr(base, attr):
+        return None
+    return attr
+
+
+@lru_cache(maxsize=None)
+def _mapping_class(base, attrs):
+    return type(base.__name__, (base,), {'__slots__': attrs})
+
+
+def _new_mapping(base, items, *args):
+    """ Instance of base with slots for the keys of items """
+    attrs = tuple(sorted(set(filter(None, (_attr_name(base, key) for key in items)))))
+    return _mapping_class(base, attrs)(items, *args)
+
+
+def _freeze_value(value):
+    return tuple(value) if isinstance(value, list) else value
+
+
+class ConfigSection(_ReadOnlyMapping):
+    """ Read only params of a section of the compiled config
+
+    The backend sections have also their params for the perceval backend
+    compiled as arguments: perceval_args without the api-token, which
+    could be replaced for each repository, and api_token_args.
+    """
+
+    __slots__ = ('name', 'backend', 'perceval_args', 'api_token_args')
+
+    def __init__(self, items, name, backend):
+        super().__init__(items)
+        set_attr = object.__setattr__
+        set_attr(self, 'name', name)
+        set_attr(self, 'backend', backend)
+        perceval_args = []
+        api_token_args = []
+        if backend:
+            for (param, value) in items.items():
+                if param in ES_INDEX_FIELDS:
+                    continue
+                args = api_token_args if param == 'api-token' else perceval_args
+                args.append("--" + param)
+                # If param is boolean, no values must be added
+                if value and type(value) != bool:
+                    if isinstance(value, tuple):
+                        # '--blacklist-jobs', 'a', 'b', 'c'
+                        args += value
+                    else:
+                        args.append(value)
+        set_attr(self, 'perceval_args', tuple(perceval_args))
+        set_attr(self, 'api_token_args', tuple(api_token_args))
+
+    @classmethod
+    def compile(cls, name, params, backend):
+        """ Section with the params, the lists are converted to tuples
+
+        :param backend: it is a backend section
+        """
+        items = {param: _freeze_value(value) for (param, value) in params.items()}
+        return _new_mapping(cls, items, name, backend)
+
+    def __reduce__(self):
+        return (ConfigSection.compile, (self.name, dict(self._items), self.backend))
+
+
+class CompiledConfig(_ReadOnlyMapping):
+    """ Read only config, compiled once from the config files
+
+    The sections are read as items (conf['general']) or as attributes
+    (conf.general), like the params of each section (conf.general.debug).
+    Changing it is not possible, Config.set_param compiles a new one.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def compile(cls, conf, backend_sections):
+        """
+        :param conf: dict with the params dict of each section
+        :param backend_sections: names of the backend sections
+        """
+        sections = {}
+        for (name, params) in conf.items():
+            # [data_source] or [*data_source]
+            backend = name in backend_sections or name[1:] in backend_sections
+            sections[name] = ConfigSection.compile(name, params, backend)
+        return _new_mapping(cls, sections)
+
+    def __reduce__(self):
+        return (_new_mapping, (CompiledConfig, dict(self._items)))
+
 
 class Config():
     """ Class aimed to manage mordred configuration """
@@ -36,7 +177,7 @@ class Config():
     def __init__(self, conf_file):
         self.conf_file = conf_file
         self.raw_conf = None
-        self.conf = self.__read_conf_files()
+        self.conf = CompiledConfig.compile(self.__read_conf_files(), self.get_backend_sections())
 
         # If projects are not already loaded do it
         from .task_projects import TaskProjects
@@ -161,7 +302,103 @@ class Config():
                     "optional": True,
                     "default": 100,
                     "type": int
-                }
+                },
+                "collection_workers": {
+                    "optional": True,
+                    "default": 1,
+                    "type": int
+                },
+                "collection_workers_per_host": {
+                    "optional": True,
+                    "default": 0,  # no limit
+                    "type": int
+                },
+                "scheduler": {  # threads (a thread per backend), dag or asyncio
+                    "optional": True,
+                    "default": "threads",
+                    "type": str
+                },
+                "scheduler_workers": {
+                    "optional": True,
+                    "default": 10,
+                    "type": int
+                },
+                "pipeline": {  # enrich each repository just after collecting it
+                    "optional": True,
+                    "default": False,
+                    "type": bool
+                },
+                "pipeline_high_watermark": {  # max repos collected and not enriched, 0 no limit
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "pipeline_low_watermark": {  # repos to resume the collection, 0 half of the high one
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "es_queue_high_watermark": {  # max bulks queued in ES to upload more, 0 no limit
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "es_queue_low_watermark": {  # bulks queued to resume the uploads, 0 half of the high one
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "adaptive_update": {  # update less often the repositories without activity
+                    "optional": True,
+                    "default": False,
+                    "type": bool
+                },
+                "max_update_delay": {  # max seconds between updates with adaptive_update
+                    "optional": True,
+                    "default": 86400,
+                    "type": int
+                },
+                "repo_timeout": {  # seconds processing a repository before abandoning it, 0 no limit
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "task_timeout": {  # seconds executing a task before abandoning it, 0 no limit
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "straggler_workers": {  # workers for the repositories which exceeded repo_timeout
+                    "optional": True,
+                    "default": 1,
+                    "type": int
+                },
+                "lease_db": optional_string_none,  # db shared by the nodes processing the repos
+                "node_id": optional_string_none,  # unique name of the node, needed with lease_db
+                "lease_ttl": {  # seconds before the repos leased by a dead node are reclaimed
+                    "optional": True,
+                    "default": 3600,
+                    "type": int
+                },
+                "state_db": optional_string_none,  # db to resume the work after a restart
+                "metrics_port": {  # port for the Prometheus metrics, 0 to disable them
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
+                "metrics_host": {  # address the metrics are served on, 0.0.0.0 for all
+                    "optional": True,
+                    "default": "localhost",
+                    "type": str
+                },
+                "profile": {  # profile the tasks to logs_dir/profiles, kill -USR2 toggles it
+                    "optional": True,
+                    "default": False,
+                    "type": bool
+                },
+                "profile_tasks": optional_empty_list,  # tasks to profile, all if empty
+                "profile_sections": optional_empty_list,  # backend sections to profile, all if empty
+                "trace_file": optional_string_none  # file to export the trace spans in OTLP JSON
 
             }
         }
@@ -222,6 +459,11 @@ class Config():
                     "default": True,
                     "type": bool
                 },
+                "enrich_processes": {  # 0: enrich in the task thread
+                    "optional": True,
+                    "default": 0,
+                    "type": int
+                },
                 "user": optional_string_none,
                 "password": optional_string_none
             }
@@ -392,15 +634,21 @@ class Config():
             parser.write(f)
 
     def get_conf(self):
-        # TODO: Return a deepcopy to avoid uncontrolled changes in config?
+        """ Get the compiled config, it is read only """
         return self.conf
 
     def set_param(self, section, param, value):
-        """ Change a param in the config """
+        """ Change a param in the config
+
+        The config is compiled again: the objects using the config got
+        before keep reading the old one.
+        """
         if section not in self.conf or param not in self.conf[section]:
             logger.error('Config section %s and param %s not exists', section, param)
         else:
-            self.conf[section][param] = value
+            conf = {name: dict(params) for (name, params) in self.conf.items()}
+            conf[section][param] = value
+            self.conf = CompiledConfig.compile(conf, self.get_backend_sections())
 
     @classmethod
     def get_backend_sections(cls):
@@ -459,6 +707,11 @@ class Config():
                               (section, param, ptype, ptype_ok)
                         raise RuntimeError(msg)
 
+        # Several nodes can run in the same host, so their names are not guessed
+        if 'general' in config and config['general'].get('lease_db') and \
+                not config['general'].get('node_id'):
+            raise RuntimeError("Missing section param:", 'general', 'node_id')
+
         # And now the backend_section entries
         # A backend section entry could have specific perceval params which are
         # not checked
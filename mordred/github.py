@@ -22,9 +22,9 @@
 #
 
 import logging
-import urllib.request
 
 from mordred.error import GithubFileNotFound
+from mordred.http import HttpSession
 
 logger = logging.getLogger(__name__)
 
@@ -60,14 +60,10 @@ class Github:
 
         self.__check_looks_like_uri(uri)
 
-        try:
-            req = urllib.request.Request(uri)
-            req.add_header('Authorization', 'token %s' % self.token)
-            r = urllib.request.urlopen(req)
-        except urllib.error.HTTPError as err:
-            if err.code == 404:
-                raise GithubFileNotFound('File %s is not available. Check the URL to ensure it really exists' % uri)
-            else:
-                raise
+        headers = {'Authorization': 'token %s' % self.token}
+        r = HttpSession.get().get(uri, headers=headers)
+        if r.status_code == 404:
+            raise GithubFileNotFound('File %s is not available. Check the URL to ensure it really exists' % uri)
+        r.raise_for_status()
 
-        return r.read().decode("utf-8")
+        return r.content.decode("utf-8")
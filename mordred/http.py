@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import logging
+import threading
+
+import requests
+
+
+logger = logging.getLogger(__name__)
+
+# Max number of connections kept alive per host in the shared HTTP session
+HTTP_POOL_SIZE = 50
+
+
+class HttpSession():
+    """ HTTP session with the connections pool shared by all the modules """
+
+    session = None
+    session_lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """ Get the shared HTTP session, created the first time it is used """
+        with cls.session_lock:
+            if cls.session is None:
+                adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE,
+                                                        pool_maxsize=HTTP_POOL_SIZE)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls.session = session
+            return cls.session
+
+
+def ofuscate_server_uri(uri):
+    """ Hide the password of the credentials in uri, to show it in logs and metrics """
+    if uri.rfind('@') > 0:
+        pre, post = uri.rsplit('@', 1)
+        char_from = pre.rfind(':')
+        return uri[0:char_from + 1] + '****@' + post
+    else:
+        return uri
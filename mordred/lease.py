@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import math
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lease used to select the node executing the global tasks
+LEADER_LEASE = "__leader__"
+
+
+class LeaseStore():
+    """ Leases of the repositories shared by several Mordred nodes
+
+    The leases are stored in a SQLite database in a shared filesystem.
+    Each node gets a fair share of the repositories of a backend section:
+    it renews its leases, takes the free or expired ones (from dead nodes)
+    and releases the ones over its share, so new nodes get work too.
+
+    The leases must be acquired again before their ttl expires, so the
+    ttl must be longer than the time needed to process the repositories.
+    """
+
+    def __init__(self, db_path, node_id, ttl=3600):
+        """
+        :param db_path: path to the SQLite database shared by the nodes
+        :param node_id: unique name of this node. It must not change between
+                        restarts, so the node gets back its own leases. The
+                        host name is not used, several nodes can share a host.
+        :param ttl: seconds before the leases of a node not renewing them expire
+        """
+        if not node_id:
+            raise ValueError("A node id is needed to share the leases")
+        self.db_path = db_path
+        self.node_id = node_id
+        self.ttl = ttl
+
+        with self.__connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS leases "
+                         "(section TEXT, repo TEXT, node TEXT, expires REAL, "
+                         "PRIMARY KEY (section, repo))")
+            conn.execute("CREATE TABLE IF NOT EXISTS nodes "
+                         "(node TEXT PRIMARY KEY, heartbeat REAL)")
+
+    def __connect(self):
+        # A connection per operation, so the store can be used from any thread
+        conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+        return _Transaction(conn)
+
+    def __live_nodes(self, conn, now):
+        conn.execute("INSERT OR REPLACE INTO nodes VALUES (?, ?)", (self.node_id, now))
+        rows = conn.execute("SELECT count(*) FROM nodes WHERE heartbeat > ?",
+                            (now - self.ttl,)).fetchone()
+        return max(rows[0], 1)
+
+    def acquire(self, backend_section, repos):
+        """ Acquire the leases for this node share of the repositories
+
+        :param backend_section: section the repositories belong to
+        :param repos: all the repositories of the section
+        :returns: the repositories leased by this node, in the same order
+        """
+        now = time.time()
+        expires = now + self.ttl
+
+        with self.__connect() as conn:
+            nodes = self.__live_nodes(conn, now)
+            share = math.ceil(len(repos) / nodes)
+
+            rows = conn.execute("SELECT repo, node, expires FROM leases WHERE section = ?",
+                                (backend_section,)).fetchall()
+            owned = [row[0] for row in rows if row[1] == self.node_id and row[2] > now]
+            taken = set(row[0] for row in rows if row[1] != self.node_id and row[2] > now)
+
+            current = set(repos)
+            leased = [repo for repo in owned if repo in current][:share]
+            for repo in repos:
+                if len(leased) >= share:
+                    break
+                if repo not in taken and repo not in leased:
+                    leased.append(repo)
+
+            conn.execute("DELETE FROM leases WHERE section = ? AND node = ?",
+                         (backend_section, self.node_id))
+            conn.executemany("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                             [(backend_section, repo, self.node_id, expires) for repo in leased])
+
+        logger.debug("[%s] %s leased %i of %i repositories (%i nodes)",
+                     backend_section, self.node_id, len(leased), len(repos), nodes)
+        leased = set(leased)
+
+        return [repo for repo in repos if repo in leased]
+
+    def is_leader(self):
+        """ Check if this node is the one executing the global tasks """
+        now = time.time()
+
+        with self.__connect() as conn:
+            self.__live_nodes(conn, now)
+            row = conn.execute("SELECT node, expires FROM leases WHERE section = ? AND repo = ?",
+                               (LEADER_LEASE, LEADER_LEASE)).fetchone()
+            if row and row[0] != self.node_id and row[1] > now:
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases VALUES (?, ?, ?, ?)",
+                         (LEADER_LEASE, LEADER_LEASE, self.node_id, now + self.ttl))
+        return True
+
+    def release(self):
+        """ Release all the leases of this node, to be called on shutdown
+
+        The other nodes take its repositories without waiting for the ttl
+        and it is not counted anymore in their fair share.
+        """
+        with self.__connect() as conn:
+            conn.execute("DELETE FROM leases WHERE node = ?", (self.node_id,))
+            conn.execute("DELETE FROM nodes WHERE node = ?", (self.node_id,))
+
+
+class _Transaction():
+    """ Exclusive transaction in a SQLite connection, closed at the end """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self.conn.execute("ROLLBACK")
+        else:
+            self.conn.execute("COMMIT")
+        self.conn.close()
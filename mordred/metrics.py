@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+logger = logging.getLogger(__name__)
+
+# Buckets in seconds for the durations, from ES bulks to full cycles
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200, 21600)
+
+
+class Metric():
+    """ Metric with a value for each combination of its labels """
+
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}  # labels values -> value
+        self.lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[label]) for label in self.labels)
+
+    def _format_labels(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                   for (name, value) in pairs]
+        return "{" + ",".join('%s="%s"' % pair for pair in escaped) + "}"
+
+    def _samples(self):
+        """ List of (suffix, labels, value) with the samples of the metric """
+        with self.lock:
+            return [("", self._format_labels(key), value)
+                    for (key, value) in sorted(self.values.items())]
+
+    def expose(self):
+        """ The metric in Prometheus text format """
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.type)]
+        for (suffix, labels, value) in self._samples():
+            lines.append("%s%s%s %s" % (self.name, suffix, labels, repr(float(value))))
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """ Value which only increases """
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """ Value which could go up and down """
+
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """ Distribution of the observed values in buckets """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.buckets = tuple(buckets) + (float("inf"),)
+        super().__init__(name, documentation, labels)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0, "count": 0}
+            data = self.values[key]
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    data["buckets"][i] += 1
+            data["sum"] += value
+            data["count"] += 1
+
+    def time(self, **labels):
+        """ Context manager observing the time spent in its block """
+        return _Timer(self, labels)
+
+    def _samples(self):
+        samples = []
+        with self.lock:
+            for (key, data) in sorted(self.values.items()):
+                for (bound, count) in zip(self.buckets, data["buckets"]):
+                    bound_str = "+Inf" if bound == float("inf") else repr(float(bound))
+                    samples.append(("_bucket", self._format_labels(key, ("le", bound_str)), count))
+                samples.append(("_sum", self._format_labels(key), data["sum"]))
+                samples.append(("_count", self._format_labels(key), data["count"]))
+        return samples
+
+
+class _Timer():
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+
+
+class MetricsRegistry():
+    """ All the metrics exposed by Mordred """
+
+    def __init__(self):
+        self.metrics = []
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+
+    def expose(self):
+        """ All the metrics in Prometheus text format """
+        with self.lock:
+            metrics = list(self.metrics)
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+ITEMS_COLLECTED = Counter("mordred_items_collected_total",
+                          "Items collected for a repository", ["section", "repo"])
+ITEMS_ENRICHED = Counter("mordred_items_enriched_total",
+                         "Items enriched for a repository", ["section", "repo"])
+REPO_DURATION = Histogram("mordred_repo_duration_seconds",
+                          "Time processing a repository in a phase", ["section", "phase"])
+REPO_LAST_DURATION = Gauge("mordred_repo_last_duration_seconds",
+                           "Time processing a repository in a phase the last time",
+                           ["section", "phase", "repo"])
+REPO_FAILURES = Counter("mordred_repo_failures_total",
+                        "Failed processing of repositories", ["section", "phase"])
+REPO_TIMEOUTS = Counter("mordred_repo_timeouts_total",
+                        "Repositories abandoned for exceeding their time budget",
+                        ["section", "phase"])
+TASK_TIMEOUTS = Counter("mordred_task_timeouts_total",
+                        "Tasks abandoned for exceeding their time budget", ["section", "task"])
+TASK_DURATION = Histogram("mordred_task_duration_seconds",
+                          "Time executing a task", ["section", "task"])
+CYCLE_DURATION = Histogram("mordred_cycle_duration_seconds",
+                           "Time executing all the tasks of a backend section", ["section"])
+QUEUE_DEPTH = Gauge("mordred_queue_depth",
+                    "Work waiting in the queues between stages", ["queue", "section"])
+BACKPRESSURE_WAIT = Counter("mordred_backpressure_wait_seconds_total",
+                            "Time producers waited for the stages downstream", ["queue"])
+ES_BULK_DURATION = Histogram("mordred_es_bulk_duration_seconds",
+                             "Time uploading bulks of items to ElasticSearch", ["section"])
+GITHUB_TOKEN_REMAINING = Gauge("mordred_github_token_remaining",
+                               "Remaining requests in the quota of the GitHub tokens",
+                               ["section", "token"])
+SORTINGHAT_DURATION = Histogram("mordred_sortinghat_duration_seconds",
+                                "Time executing SortingHat commands", ["command"])
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = REGISTRY.expose().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Metrics request: " + format, *args)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_metrics_server(port, host="localhost"):
+    """ Expose the metrics in http://host:port/metrics from a daemon thread
+
+    :returns: the HTTP server, shutdown() stops it
+    """
+    server = _ThreadingHTTPServer((host, port), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, name="metrics", daemon=True)
+    thread.start()
+    logger.info("Metrics available in http://%s:%i/metrics", host, server.server_address[1])
+    return server
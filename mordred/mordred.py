@@ -32,10 +32,19 @@ from datetime import datetime, timedelta
 
 import requests
 
+from mordred.async_engine import AsyncEngine
+from mordred.backpressure import Watermark
+from mordred.checkpoint import CheckpointStore
 from mordred.config import Config
 from mordred.error import ElasticSearchError
 from mordred.error import DataCollectionError
 from mordred.error import DataEnrichmentError
+from mordred.http import ofuscate_server_uri
+from mordred.lease import LeaseStore
+from mordred.metrics import CYCLE_DURATION, start_metrics_server
+from mordred.profiler import Profiler
+from mordred.repos_stats import ReposStats
+from mordred.scheduler import Scheduler
 from mordred.task import Task
 from mordred.task_collection import TaskRawDataCollection
 from mordred.task_enrich import TaskEnrich
@@ -45,6 +54,7 @@ from mordred.task_panels import TaskPanels, TaskPanelsAliases, TaskPanelsMenu
 from mordred.task_projects import TaskProjects
 from mordred.task_report import TaskReport
 from mordred.task_track import TaskTrackItems
+from mordred.trace import Tracer
 
 ES_ERROR = "Before starting to seek the Holy Grail, make sure your ElasticSearch " + \
 "at '%(uri)s' is available!!\n - Mordred said."
@@ -60,27 +70,29 @@ class Mordred:
         self.config = config
         self.conf = config.get_conf()
 
+        Profiler.configure(self.conf['general']['logs_dir'], self.conf['general']['profile'],
+                           self.conf['general']['profile_tasks'],
+                           self.conf['general']['profile_sections'])
+        Tracer.configure(self.conf['general']['trace_file'])
+
+        if self.conf['general']['state_db']:
+            # Resume the work done before the last restart
+            store = CheckpointStore(self.conf['general']['state_db'])
+            ReposStats.set_store(store)
+            TasksManager.AUTOREFRESH_STATE.set_store(store)
+
     def check_es_access(self):
         ##
         ## So far there is no way to distinguish between read and write permission
         ##
 
-        def _ofuscate_server_uri(uri):
-            if uri.rfind('@') > 0:
-                pre, post = uri.split('@')
-                char_from = pre.rfind(':')
-                result = uri[0:char_from + 1] + '****@' + post
-                return result
-            else:
-                return uri
-
         es = self.conf['es_collection']['url']
         try:
             r = requests.get(es, verify=False)
             if r.status_code != 200:
-                raise ElasticSearchError(ES_ERROR % {'uri' : _ofuscate_server_uri(es)})
+                raise ElasticSearchError(ES_ERROR % {'uri' : ofuscate_server_uri(es)})
         except:
-            raise ElasticSearchError(ES_ERROR % {'uri' : _ofuscate_server_uri(es)})
+            raise ElasticSearchError(ES_ERROR % {'uri' : ofuscate_server_uri(es)})
 
 
         if self.conf['phases']['enrichment'] or \
@@ -89,25 +101,21 @@ class Mordred:
             try:
                 r = requests.get(es, verify=False)
                 if r.status_code != 200:
-                    raise ElasticSearchError(ES_ERROR % {'uri' : _ofuscate_server_uri(es)})
+                    raise ElasticSearchError(ES_ERROR % {'uri' : ofuscate_server_uri(es)})
             except:
-                raise ElasticSearchError(ES_ERROR % {'uri' : _ofuscate_server_uri(es)})
+                raise ElasticSearchError(ES_ERROR % {'uri' : ofuscate_server_uri(es)})
 
     def _get_repos_by_backend(self):
         #
         # return dict with backend and list of repositories
         #
         output = {}
-        projects = TaskProjects.get_projects()
+        snapshot = TaskProjects.get_snapshot()
 
         for backend_section in Config.get_backend_sections():
-            for pro in projects:
-                backend = Task.get_backend(backend_section)
-                if backend in projects[pro]:
-                    if not backend_section in output:
-                        output[backend_section]  = projects[pro][backend]
-                    else:
-                        output[backend_section] += projects[pro][backend]
+            backend = Task.get_backend(backend_section)
+            if backend in snapshot.repos:
+                output[backend_section] = snapshot.get_repos(backend)
 
         # backend could be in project/repo file but not enabled in
         # mordred conf file
@@ -133,6 +141,32 @@ class Mordred:
                                  self.conf['sortinghat']['sleep_for'],
                                  self.conf['general']['min_update_delay'], False)
 
+    @staticmethod
+    def __split_tasks(tasks_cls):
+        """
+        we internally distinguish between tasks executed by backend
+        and tasks executed with no specific backend. """
+        backend_t = []
+        global_t = []
+        for t in tasks_cls:
+            if t.is_backend_task(t):
+                backend_t.append(t)
+            else:
+                global_t.append(t)
+        return backend_t, global_t
+
+    @staticmethod
+    def __trace_cycle(tasks_cls, wait_for_threads):
+        if not wait_for_threads:
+            return Tracer.attach(None)
+        return Tracer.span("cycle", tasks=[tc.__name__ for tc in tasks_cls])
+
+    def __init_autorefresh(self, repos_backend):
+        # Init the shared state to control if autorefresh must be done
+        # and the uuids to be autorefreshed in each backend
+        TasksManager.AUTOREFRESH_STATE.init_backends(repos_backend)
+        logger.debug("Initial Autorefresh backends: %s", list(repos_backend))
+
     def execute_batch_tasks(self, tasks_cls, big_delay=0, small_delay=0, wait_for_threads = True):
         """
         Start a task manager per backend to complete the tasks.
@@ -144,72 +178,336 @@ class Mordred:
                                 should be synchronized in a meeting point
         """
 
-        def _split_tasks(tasks_cls):
-            """
-            we internally distinguish between tasks executed by backend
-            and tasks executed with no specific backend. """
-            backend_t = []
-            global_t = []
-            for t in tasks_cls:
-                if t.is_backend_task(t):
-                    backend_t.append(t)
-                else:
-                    global_t.append(t)
-            return backend_t, global_t
+        if self.conf['general']['scheduler'] == 'dag':
+            self.execute_dag_tasks(tasks_cls, big_delay, small_delay, wait_for_threads)
+            return
+        elif self.conf['general']['scheduler'] == 'asyncio':
+            self.execute_async_tasks(tasks_cls, big_delay, small_delay, wait_for_threads)
+            return
 
         logger.debug('Tasks Manager starting .. ')
 
-        backend_tasks, global_tasks = _split_tasks(tasks_cls)
+        backend_tasks, global_tasks = self.__split_tasks(tasks_cls)
         logger.debug ('backend_tasks = %s' % (backend_tasks))
         logger.debug ('global_tasks = %s' % (global_tasks))
 
-        threads = []
+        # The tasks executed forever (not waiting for threads) are not part of a cycle
+        with self.__trace_cycle(tasks_cls, wait_for_threads) as cycle_span:
+            threads = []
+
+            # stopper won't be set unless wait_for_threads is True
+            stopper = threading.Event()
+
+            # launching threads for tasks by backend
+            if len(backend_tasks) > 0:
+                repos_backend = self._get_repos_by_backend()
+                self.__init_autorefresh(repos_backend)
+                for backend in repos_backend:
+                    # Start new Threads and add them to the threads list to complete
+                    t = TasksManager(backend_tasks, backend, stopper, self.config, small_delay,
+                                     cycle_span, self.conf['general']['task_timeout'])
+                    threads.append(t)
+                    t.start()
+
+            # launch thread for global tasks
+            if len(global_tasks) > 0:
+                #FIXME timer is applied to all global_tasks, does it make sense?
+                # All tasks are executed in the same thread sequentially
+                gt = TasksManager(global_tasks, None, stopper, self.config, big_delay, cycle_span,
+                                  self.conf['general']['task_timeout'])
+                threads.append(gt)
+                gt.start()
+                if big_delay > 0:
+                    when = datetime.now() + timedelta(seconds = big_delay)
+                    when_str = when.strftime('%a, %d %b %Y %H:%M:%S %Z')
+                    logger.info("%s will be executed on %s" % (global_tasks, when_str))
+
+            if wait_for_threads:
+                time.sleep(1)  # Give enough time create and run all threads
+                stopper.set()  # All threads must stop in the next iteration
+                logger.debug(" Waiting for all threads to complete. This could take a while ..")
+
+            # Wait for all threads to complete
+            for t in threads:
+                t.join()
 
-        # stopper won't be set unless wait_for_threads is True
-        stopper = threading.Event()
+        # Checking for exceptions in threads to log them
+        self.__check_queue_for_errors()
 
-        # launching threads for tasks by backend
-        if len(backend_tasks) > 0:
-            repos_backend = self._get_repos_by_backend()
-            # Init the shared dict to control if autorefresh must be done
-            backends_autorefresh = {backend: False for backend in repos_backend}
-            TasksManager.AUTOREFRESH_QUEUE.put(backends_autorefresh)
-            logger.debug("Initial Autorefresh queue: %s", backends_autorefresh)
-            # Init the shared dict to control the uuids to be autorefreshed in
-            # each backend
-            backends_autorefresh_uuids = {backend: [] for backend in repos_backend}
-            TasksManager.UPDATED_UUIDS_QUEUE.put(backends_autorefresh_uuids)
-            for backend in repos_backend:
-                # Start new Threads and add them to the threads list to complete
-                t = TasksManager(backend_tasks, backend, stopper, self.config, small_delay)
-                threads.append(t)
-                t.start()
-
-        # launch thread for global tasks
-        if len(global_tasks) > 0:
-            #FIXME timer is applied to all global_tasks, does it make sense?
-            # All tasks are executed in the same thread sequentially
-            gt = TasksManager(global_tasks, None, stopper, self.config, big_delay)
-            threads.append(gt)
-            gt.start()
+        logger.debug(" Task manager and all its tasks (threads) finished!")
+
+    def execute_dag_tasks(self, tasks_cls, big_delay=0, small_delay=0, wait_for_threads=True):
+        """
+        Execute the tasks as work units in a shared pool of workers following
+        the dependencies between them:
+
+        - the projects are loaded before the repositories are collected
+        - each repository is enriched once it has been collected
+        - the autorefresh of a backend is done once the identities are merged
+        - the collection of a backend waits while too many of its repositories
+          are waiting for enrichment (pipeline watermarks)
+        - the repositories added to the projects are collected and enriched
+          as soon as they are loaded, the ones removed are not processed again
+
+        Collection and enrichment are done per repository, so a worker is
+        never idle while other repositories of the same backend are waiting.
+
+        :param task_cls: list of tasks classes to be executed
+        :param big_delay: seconds between rounds of global tasks
+        :param small_delay: seconds between rounds of tasks for a backend
+        :param wait_for_threads: if False, new rounds are scheduled forever
+        """
+
+        backend_tasks, global_tasks = self.__split_tasks(tasks_cls)
+        logger.debug('DAG scheduler starting for %s', tasks_cls)
+
+        repeat = not wait_for_threads
+        # Last work units added for the global tasks by task class
+        global_units = {}
+        # Repositories being collected or waiting for enrichment by backend
+        backlogs = {}
+        # Tasks of each backend
+        backends_tasks = {}
+
+        def collect_repo(task, repo, backlog, enriched):
+            # the scheduler adds the repo to the backlog when it is dispatched
+            try:
+                task.collect_repo(repo)
+            finally:
+                if not enriched:
+                    backlog.add(-1)
+
+        def enrich_repo(func, repo, backlog, collected):
+            try:
+                func(repo)
+            finally:
+                if collected:
+                    backlog.add(-1)
+
+        def release_backlog(backlog, collect_unit):
+            # the backlog taken by a collection is released by its enrichment,
+            # or when the enrichment is cancelled once the collection started
+            if not collect_unit:
+                return None
+
+            def release():
+                if collect_unit.dispatched:
+                    backlog.add(-1)
+            return release
+
+        def get_enrich_func(task):
+            if TaskEnrich.uses_processes(self.config):
+                return task.enrich_repo_in_process
+            return task.enrich_repo
+
+        def add_repos_changed(repos_diff):
+            # new repositories are collected and enriched now, out of the rounds,
+            # and the moved ones are enriched again with their new projects
+            for (backend, tasks) in backends_tasks.items():
+                changed = set(repos_diff.get_added(backend) + repos_diff.get_moved(backend))
+                if not changed:
+                    continue
+                backlog = backlogs[backend]
+                repos = {}
+                for task in tasks:
+                    if isinstance(task, TaskRawDataCollection):
+                        repos[task] = [repo for repo in task.get_repos() if repo in changed]
+                    elif isinstance(task, TaskEnrich):
+                        # moved repositories are enriched again even with no new items
+                        repos[task] = [repo for repo in task.get_repos(forced=changed)
+                                       if repo in changed]
+                added = set(repos_diff.get_added(backend))
+                enrich_repos = set()
+                for task in tasks:
+                    if isinstance(task, TaskEnrich):
+                        enrich_repos.update(repos[task])
+                collect_units = {}
+                for task in tasks:
+                    if isinstance(task, TaskRawDataCollection):
+                        for repo in repos[task]:
+                            if repo not in added:
+                                continue
+                            collect_units[repo] = scheduler.add(
+                                "[%s] collect new %s" % (backend, repo), collect_repo, task,
+                                repo, backlog, repo in enrich_repos, repo=repo, gate=backlog,
+                                section=backend)
+                    elif isinstance(task, TaskEnrich):
+                        for repo in repos[task]:
+                            deps = [collect_units[repo]] if repo in collect_units else []
+                            scheduler.add("[%s] enrich new %s" % (backend, repo), enrich_repo,
+                                          get_enrich_func(task), repo, backlog,
+                                          repo in collect_units, deps=deps, repo=repo,
+                                          section=backend,
+                                          on_cancel=release_backlog(backlog,
+                                                                    collect_units.get(repo)))
+
+        scheduler = Scheduler(self.conf['general']['scheduler_workers'],
+                              self.conf['general']['collection_workers_per_host'],
+                              add_repos_changed)
+
+        def add_global_round(tasks, not_before):
+            round_units = []
+            for task in tasks:
+                # global tasks are executed sequentially in the configured order
+                unit = scheduler.add(type(task).__name__, task.execute,
+                                     deps=round_units[-1:], not_before=not_before,
+                                     global_task=True)
+                global_units[type(task)] = unit
+                round_units.append(unit)
+            if repeat:
+                scheduler.add("global round", lambda: add_global_round(tasks, time.time() + big_delay),
+                              deps=round_units, not_before=not_before, global_task=True)
+
+        def add_backend_round(backend, tasks, not_before):
+            round_units = []
+            collect_units = {}
+            projects_deps = [global_units[TaskProjects]] if TaskProjects in global_units else []
+            # the repositories done before a restart in the middle of the cycle are skipped
+            repos = {task: ReposStats.start_cycle(backend, ('collection',), task.get_repos())
+                     for task in tasks if isinstance(task, TaskRawDataCollection)}
+            # the repositories collected in the round are enriched in it too, even if
+            # the adaptive update found them up to date before collecting them
+            collected = set(repo for task_repos in repos.values() for repo in task_repos)
+            for task in tasks:
+                if isinstance(task, TaskEnrich):
+                    repos[task] = ReposStats.start_cycle(backend, ('enrichment',),
+                                                         task.get_repos(forced=collected))
+            phases = {task: 'collection' if isinstance(task, TaskRawDataCollection)
+                      else 'enrichment' for task in repos}
+            enrich_repos = set()
+            for task in tasks:
+                if isinstance(task, TaskEnrich):
+                    enrich_repos.update(repos[task])
+            # The collection waits when the enrichment lags too much
+            if backend not in backlogs:
+                backlogs[backend] = Watermark(self.conf['general']['pipeline_high_watermark'],
+                                              self.conf['general']['pipeline_low_watermark'],
+                                              'pipeline')
+            backlog = backlogs[backend]
+            for task in tasks:
+                if isinstance(task, TaskRawDataCollection):
+                    for repo in repos[task]:
+                        unit = scheduler.add("[%s] collect %s" % (backend, repo),
+                                             collect_repo, task, repo, backlog,
+                                             repo in enrich_repos, deps=projects_deps,
+                                             repo=repo, not_before=not_before, gate=backlog,
+                                             section=backend)
+                        collect_units[repo] = unit
+                        round_units.append(unit)
+                elif isinstance(task, TaskEnrich):
+                    enrich_units = []
+                    enrich_func = get_enrich_func(task)
+                    for repo in repos[task]:
+                        deps = [collect_units[repo]] if repo in collect_units else projects_deps
+                        unit = scheduler.add("[%s] enrich %s" % (backend, repo),
+                                             enrich_repo, enrich_func, repo, backlog,
+                                             repo in collect_units, deps=deps,
+                                             repo=repo, not_before=not_before,
+                                             section=backend,
+                                             on_cancel=release_backlog(backlog,
+                                                                       collect_units.get(repo)))
+                        enrich_units.append(unit)
+                    merge_deps = [global_units[TaskIdentitiesMerge]] if TaskIdentitiesMerge in global_units else []
+                    unit = scheduler.add("[%s] post enrich" % backend, task.post_enrich,
+                                         deps=enrich_units + merge_deps, not_before=not_before,
+                                         section=backend, autorefresh=task.autorefresh)
+                    round_units += enrich_units + [unit]
+                else:
+                    unit = scheduler.add("[%s] %s" % (backend, type(task).__name__), task.execute,
+                                         deps=list(round_units), not_before=not_before)
+                    round_units.append(unit)
+            unit = scheduler.add("[%s] cycle done" % backend, ReposStats.end_cycle, backend,
+                                 tuple(phases.values()), deps=round_units, not_before=not_before)
+            if repeat:
+                round_start = max(not_before, time.time())
+                scheduler.add("[%s] round" % backend,
+                              lambda: next_backend_round(backend, tasks, round_start),
+                              deps=[unit], not_before=not_before)
+
+        def next_backend_round(backend, tasks, round_start):
+            CYCLE_DURATION.observe(time.time() - round_start, section=backend)
+            add_backend_round(backend, tasks, time.time() + small_delay)
+
+        if global_tasks:
+            tasks = [tc(self.config) for tc in global_tasks]
+            add_global_round(tasks, time.time() + big_delay)
             if big_delay > 0:
                 when = datetime.now() + timedelta(seconds = big_delay)
                 when_str = when.strftime('%a, %d %b %Y %H:%M:%S %Z')
                 logger.info("%s will be executed on %s" % (global_tasks, when_str))
 
-        if wait_for_threads:
-            time.sleep(1)  # Give enough time create and run all threads
-            stopper.set()  # All threads must stop in the next iteration
-            logger.debug(" Waiting for all threads to complete. This could take a while ..")
+        if backend_tasks:
+            repos_backend = self._get_repos_by_backend()
+            self.__init_autorefresh(repos_backend)
+            for backend in repos_backend:
+                tasks = []
+                for tc in backend_tasks:
+                    task = tc(self.config)
+                    task.set_backend_section(backend)
+                    tasks.append(task)
+                backends_tasks[backend] = tasks
+                add_backend_round(backend, tasks, 0)
+
+        TasksManager.add_listener(scheduler)
+        try:
+            with self.__trace_cycle(tasks_cls, wait_for_threads):
+                failed = scheduler.run()
+        finally:
+            TasksManager.remove_listener(scheduler)
+        for unit in failed:
+            logger.error("Work unit %s failed: %s", unit.name, unit.exception)
 
-        # Wait for all threads to complete
-        for t in threads:
-            t.join()
+        logger.debug("DAG scheduler and all its work units finished!")
 
-        # Checking for exceptions in threads to log them
-        self.__check_queue_for_errors()
+    def execute_async_tasks(self, tasks_cls, big_delay=0, small_delay=0, wait_for_threads=True):
+        """
+        Execute the tasks in an asyncio event loop. The tasks of each backend
+        and the global tasks are executed serially like with the threads
+        scheduler, but all of them share the same loop and the HTTP requests
+        of the panels, aliases and identities export are done concurrently.
 
-        logger.debug(" Task manager and all its tasks (threads) finished!")
+        :param task_cls: list of tasks classes to be executed
+        :param big_delay: seconds before global tasks are executed
+        :param small_delay: seconds before backend tasks are executed
+        :param wait_for_threads: if False, the tasks are executed forever
+        """
+
+        backend_tasks, global_tasks = self.__split_tasks(tasks_cls)
+        logger.debug('Async engine starting for %s', tasks_cls)
+
+        engine = AsyncEngine(self.conf['general']['scheduler_workers'],
+                             self.conf['general']['task_timeout'])
+
+        if backend_tasks:
+            repos_backend = self._get_repos_by_backend()
+            self.__init_autorefresh(repos_backend)
+            for backend in repos_backend:
+                tasks = []
+                for tc in backend_tasks:
+                    task = tc(self.config)
+                    task.set_backend_section(backend)
+                    tasks.append(task)
+                engine.add_round(tasks, small_delay)
+
+        if global_tasks:
+            engine.add_round([tc(self.config) for tc in global_tasks], big_delay,
+                             global_task=True)
+            if big_delay > 0:
+                when = datetime.now() + timedelta(seconds = big_delay)
+                when_str = when.strftime('%a, %d %b %Y %H:%M:%S %Z')
+                logger.info("%s will be executed on %s" % (global_tasks, when_str))
+
+        TasksManager.add_listener(engine)
+        try:
+            exceptions = engine.run(repeat=not wait_for_threads)
+        finally:
+            TasksManager.remove_listener(engine)
+        for ex in exceptions:
+            logger.error("Exception in async engine %s", ex)
+        if exceptions:
+            raise exceptions[0]
+
+        logger.debug("Async engine and all its tasks finished!")
 
     def __check_queue_for_errors(self):
         try:
@@ -236,6 +534,15 @@ class Mordred:
         return
 
 
+    def __release_leases(self):
+        """ Release the repositories leased by this node, so other nodes get them now """
+        if not self.conf['general']['lease_db']:
+            return
+        store = LeaseStore(self.conf['general']['lease_db'], self.conf['general']['node_id'],
+                           self.conf['general']['lease_ttl'])
+        store.release()
+        logger.info("Leases of node %s released", store.node_id)
+
     def run(self):
         """
         This method defines the workflow of Mordred. So it calls to:
@@ -244,14 +551,24 @@ class Mordred:
           (collection, identities, enrichment)
         - start the collection and enrichment in parallel by data source
         - start also the Sorting Hat merge
+        - release the leases of the node when it exits
         """
+        try:
+            self.__run()
+        finally:
+            self.__release_leases()
 
+    def __run(self):
         #logger.debug("Starting Mordred engine ...")
         logger.info("")
         logger.info("----------------------------")
         logger.info("Starting Mordred engine ...")
         logger.info("- - - - - - - - - - - - - - ")
 
+        if self.conf['general']['metrics_port']:
+            start_metrics_server(self.conf['general']['metrics_port'],
+                                 self.conf['general']['metrics_host'])
+
         # check we have access to the needed ES
         self.check_es_access()
 
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import threading
+import time
+
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait
+from itertools import count
+from urllib.parse import urlparse
+
+from mordred.trace import Tracer
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerPool():
+    """ Bounded pool of threads to process the repositories of a backend section
+
+    The number of repositories processed at the same time is limited by
+    max_workers globally and by max_workers_host for each remote host, so
+    a slow server is not hammered by all the workers at once. The work
+    units of a host at its limit wait in a queue of the host without
+    taking a worker, so the repositories of the other hosts keep going.
+
+    With a timeout, the work units running for longer than it are abandoned:
+    threads can not be killed, so they keep running, but wait() does not
+    wait for them anymore. Until they finish they are reported by
+    is_abandoned() so the same work is not started again. Each work unit
+    runs in its own daemon thread, so an abandoned unit which never ends
+    does not block the exit of the process, and its worker is given to
+    the next unit.
+    """
+
+    __abandoned = set()  # (pool name, repo) of abandoned work still running
+    __abandoned_lock = threading.Lock()
+
+    def __init__(self, max_workers=1, max_workers_host=0, timeout=0, name=None, gates=None):
+        """
+        :param max_workers: max number of repositories processed in parallel
+        :param max_workers_host: max number of repositories processed in parallel
+                                 for the same host (0 means no limit)
+        :param timeout: seconds a work unit could run before being abandoned
+                        (0 means no limit)
+        :param name: name of the work done in the pool, to track the abandoned work
+        :param gates: objects with a wait method (i.e. Watermark) the work units
+                      wait for before starting
+        """
+        self.max_workers = max(1, max_workers)
+        self.max_workers_host = max_workers_host
+        self.timeout = timeout
+        self.name = name
+        self.gates = gates if gates else []
+        self.futures = {}  # future -> work unit
+        self.abandoned = []  # repos abandoned for exceeding the timeout
+        self.lock = threading.Lock()
+        self.running = 0  # work units running and not abandoned
+        self.hosts_running = {}  # host -> work units of the host running
+        self.hosts_waiting = OrderedDict()  # host -> deque of units waiting for a worker
+        self.seq = count()
+
+    @classmethod
+    def is_abandoned(cls, name, repo):
+        """ Check if abandoned work for repo in a pool called name is still running """
+        with cls.__abandoned_lock:
+            return (name, repo) in cls.__abandoned
+
+    @staticmethod
+    def get_host(repo):
+        """ Get the remote host for a repository in the projects file
+
+        Repositories could include extra params after the URL:
+        "https://github.com/grimoirelab/perceval --filter-raw ..." or be
+        local paths "metrics-grimoire /home/bitergia/mbox"
+        """
+        url = repo.split()[0] if repo.split() else repo
+        host = urlparse(url).netloc
+        if not host:
+            host = url
+        return host
+
+    def __get_unit_host(self, unit):
+        """ Host limiting the work unit, None if it is not limited """
+        if self.max_workers_host <= 0 or unit.repo is None:
+            return None
+        return self.get_host(unit.repo)
+
+    def __dispatch(self):
+        """ Start the waiting work units while there are free workers
+
+        The next unit is the first one submitted among the hosts below their
+        limit, the hosts at their limit don't take any worker.
+        """
+        with self.lock:
+            while self.running < self.max_workers:
+                hosts = [host for host in self.hosts_waiting if host is None or
+                         self.hosts_running.get(host, 0) < self.max_workers_host]
+                if not hosts:
+                    break
+                host = min(hosts, key=lambda h: self.hosts_waiting[h][0].seq)
+                units = self.hosts_waiting[host]
+                unit = units.popleft()
+                if not units:
+                    del self.hosts_waiting[host]
+                if not unit.future.set_running_or_notify_cancel():
+                    continue
+                self.running += 1
+                if host is not None:
+                    self.hosts_running[host] = self.hosts_running.get(host, 0) + 1
+                threading.Thread(target=self.__run, args=(unit,), daemon=True,
+                                 name="%s-%s" % (self.name, unit.repo)).start()
+
+    def __release(self, unit):
+        """ Free the worker and the host slot taken by the work unit """
+        with self.lock:
+            self.running -= 1
+            host = self.__get_unit_host(unit)
+            if host is not None:
+                self.hosts_running[host] -= 1
+
+    def __run(self, unit):
+        with Tracer.attach(unit.trace_parent):
+            for gate in self.gates:
+                gate.wait()
+            # the time waiting for the gate is not part of the budget
+            unit.start = time.time()
+            try:
+                result = unit.func(*unit.args)
+            except BaseException as ex:
+                self.__finish_unit(unit)
+                unit.future.set_exception(ex)
+            else:
+                self.__finish_unit(unit)
+                unit.future.set_result(result)
+
+    def __finish_unit(self, unit):
+        with unit.lock:
+            unit.finished = True
+            abandoned = unit.abandoned
+            if abandoned:
+                with WorkerPool.__abandoned_lock:
+                    WorkerPool.__abandoned.discard((self.name, unit.repo))
+                logger.warning("Abandoned work for %s finished after %i s",
+                               unit.repo, time.time() - unit.start)
+        if not abandoned:
+            # the abandoned units released their worker already
+            self.__release(unit)
+        self.__dispatch()
+
+    def __abandon_expired(self, pending):
+        """ Abandon the pending work units which exceeded the timeout
+
+        :returns: the pending futures not abandoned
+        """
+        now = time.time()
+        for future in list(pending):
+            unit = self.futures[future]
+            with unit.lock:
+                if unit.finished or unit.start is None or now - unit.start < self.timeout:
+                    continue
+                unit.abandoned = True
+                # added with the unit locked, so the unit does not finish before
+                with WorkerPool.__abandoned_lock:
+                    WorkerPool.__abandoned.add((self.name, unit.repo))
+            # let other repositories of the host run meanwhile
+            self.__release(unit)
+            logger.error("Abandoning %s after %i s", unit.repo, now - unit.start)
+            self.abandoned.append(unit.repo)
+            pending.discard(future)
+        return pending
+
+    def __next_timeout(self, pending):
+        """ Seconds until the next work unit exceeds the timeout """
+        if self.timeout <= 0:
+            return None
+        starts = [self.futures[future].start for future in pending
+                  if self.futures[future].start is not None]
+        if not starts:
+            # nothing running yet, the first deadline will be later
+            return self.timeout
+        return max(0, min(starts) + self.timeout - time.time())
+
+    def run(self, repo, func, *args):
+        """ Schedule func(*args) to process repo in the pool without tracking it
+
+        The caller is in charge of the returned future. repo could be None
+        for work not related to a repository, which is not limited by host.
+        """
+        return self.__submit(_WorkUnit(repo, func, args))
+
+    def __submit(self, unit):
+        with self.lock:
+            unit.seq = next(self.seq)
+            host = self.__get_unit_host(unit)
+            if host not in self.hosts_waiting:
+                self.hosts_waiting[host] = deque()
+            self.hosts_waiting[host].append(unit)
+        self.__dispatch()
+        return unit.future
+
+    def submit(self, repo, func, *args):
+        """ Schedule func(*args) to process repo in the pool """
+        unit = _WorkUnit(repo, func, args)
+        self.futures[unit.future] = unit
+        return self.__submit(unit)
+
+    def pending(self):
+        """ Number of work units not yet finished """
+        return len([f for f in self.futures if not f.done()])
+
+    def wait(self):
+        """ Wait for all the work units and return the failed ones
+
+        The work units exceeding the timeout are not waited for, they are
+        added to the abandoned list instead.
+
+        :returns: list of (repo, exception) for the work units that failed
+        """
+        pending = set(self.futures.keys())
+        while pending:
+            (_, pending) = wait(pending, timeout=self.__next_timeout(pending))
+            if self.timeout > 0:
+                pending = self.__abandon_expired(pending)
+                # the workers of the abandoned units are free
+                self.__dispatch()
+
+        failed = []
+        for future, unit in self.futures.items():
+            if unit.abandoned:
+                continue
+            exc = future.exception()
+            if exc:
+                failed.append((unit.repo, exc))
+        self.futures = {}
+
+        return failed
+
+    def shutdown(self):
+        """ Release the pool once its work units were waited for
+
+        The thread of each work unit ends with it. The abandoned ones could
+        never end, they are daemon threads which don't block the exit.
+        """
+        running = [repo for repo in self.abandoned if WorkerPool.is_abandoned(self.name, repo)]
+        if running:
+            logger.warning("%i abandoned work units of %s still running",
+                           len(running), self.name)
+
+
+class _WorkUnit():
+    """ Processing of a repository in the pool """
+
+    def __init__(self, repo, func, args):
+        self.repo = repo
+        self.func = func
+        self.args = args
+        # the work is traced as part of the span submitting it
+        self.trace_parent = Tracer.current()
+        self.future = Future()  # result of the work, even before it is dispatched
+        self.seq = None  # order of submission
+        self.start = None  # when it started running
+        self.finished = False
+        self.abandoned = False
+        self.lock = threading.Lock()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Profiler():
+    """ Profile the execution of the tasks on demand
+
+    Profiling is enabled in the config or toggled with a signal. The work
+    of a task for a backend section done at the same time in several
+    threads (i.e. the repositories collected in a pool) is merged in a
+    single profile, written to logs_dir/profiles in pstats format once all
+    the threads are done: one file per backend section, task and cycle.
+
+    When profiling is disabled the only overhead is checking a flag.
+    """
+
+    enabled = False
+    profiles_dir = os.path.join("logs", "profiles")
+    tasks = []  # names of the tasks to profile, all if empty
+    sections = []  # backend sections to profile, all if empty
+
+    __sessions = {}  # (section, task) -> profiling session
+    __cycles = {}  # (section, task) -> number of profiles written
+    __lock = threading.Lock()
+    __local = threading.local()  # avoid nested profiles in the same thread
+
+    @classmethod
+    def configure(cls, logs_dir, enabled=False, tasks=None, sections=None):
+        cls.profiles_dir = os.path.join(logs_dir, "profiles")
+        cls.enabled = enabled
+        cls.tasks = tasks if tasks else []
+        cls.sections = sections if sections else []
+
+    @classmethod
+    def toggle(cls):
+        cls.enabled = not cls.enabled
+        logger.info("Profiling %s", "enabled" if cls.enabled else "disabled")
+
+    @classmethod
+    def profile(cls, section, task):
+        """ Context manager to profile the execution of a task in a section
+
+        :param section: backend section, None for global tasks
+        :param task: name of the task
+        """
+        if not cls.enabled:
+            return _NO_PROFILE
+        section = section if section else "global"
+        if cls.tasks and task not in cls.tasks:
+            return _NO_PROFILE
+        if cls.sections and section not in cls.sections:
+            return _NO_PROFILE
+        if getattr(cls.__local, 'active', False):
+            # already profiled by an outer block in this thread
+            return _NO_PROFILE
+        return _Profile(cls, section, task)
+
+    @classmethod
+    def _start(cls, key):
+        with cls.__lock:
+            session = cls.__sessions.setdefault(key, {"running": 0, "stats": None})
+            session["running"] += 1
+        cls.__local.active = True
+
+    @classmethod
+    def _stop(cls, key, profile):
+        cls.__local.active = False
+        with cls.__lock:
+            session = cls.__sessions[key]
+            if session["stats"]:
+                session["stats"].add(profile)
+            else:
+                session["stats"] = pstats.Stats(profile)
+            session["running"] -= 1
+            if session["running"] > 0:
+                return
+            del cls.__sessions[key]
+            cycle = cls.__cycles.get(key, 0) + 1
+            cls.__cycles[key] = cycle
+
+        cls.__dump(key, cycle, session["stats"])
+
+    @classmethod
+    def __dump(cls, key, cycle, stats):
+        (section, task) = key
+        os.makedirs(cls.profiles_dir, exist_ok=True)
+        name = "%s_%s_%04i_%s.prof" % (section.replace(":", "_"), task, cycle,
+                                       time.strftime("%Y%m%d-%H%M%S"))
+        path = os.path.join(cls.profiles_dir, name)
+        stats.dump_stats(path)
+        logger.info("[%s] Profile for %s written to %s", section, task, path)
+
+
+class _Profile():
+
+    def __init__(self, profiler, section, task):
+        self.profiler = profiler
+        self.key = (section, task)
+        self.profile = cProfile.Profile()
+
+    def __enter__(self):
+        self.profiler._start(self.key)
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self.profiler._stop(self.key, self.profile)
+
+
+class _NoProfile():
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_PROFILE = _NoProfile()
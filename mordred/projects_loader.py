@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import hashlib
+import json
+import logging
+import sys
+
+from os import listdir, path
+from types import MappingProxyType
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024  # chars read from the projects files at once
+WHITESPACE = ' \t\n\r'
+
+
+def get_projects_files(projects_path):
+    """ Files with the projects: the JSON files of a directory (shards) or a file """
+    if path.isdir(projects_path):
+        return [path.join(projects_path, fname) for fname in sorted(listdir(projects_path))
+                if fname.endswith('.json')]
+    return [projects_path]
+
+
+def get_files_state(files):
+    """ Modification times of the files, to detect changes without reading them """
+    return tuple((fname, path.getmtime(fname)) for fname in files)
+
+
+def get_files_digest(files):
+    """ SHA-1 of the names and contents of the files, read in chunks """
+    digest = hashlib.sha1()
+    for fname in files:
+        digest.update(fname.encode('utf-8'))
+        with open(fname, 'rb') as fproj:
+            for chunk in iter(lambda: fproj.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compact(data):
+    """ Compact and read only version of JSON data
+
+    The strings are interned, so the repositories shared by several
+    projects or backends are stored once, the dicts are mapping proxies
+    and the lists tuples. The data already compact is not copied.
+    """
+    if isinstance(data, str):
+        return sys.intern(data)
+    if isinstance(data, dict):
+        return MappingProxyType({sys.intern(key): compact(value)
+                                 for (key, value) in data.items()})
+    if isinstance(data, list):
+        return tuple(compact(value) for value in data)
+    return data
+
+
+def normalize_repo(repo):
+    """ Identity of a repository, to find it listed in different ways
+
+    The scheme and host of the URL are case insensitive, the trailing
+    slashes of its path and the spaces between the URL and the params
+    of the repository don't matter.
+    """
+    parts = repo.split()
+    if not parts:
+        return ''
+    url = urlsplit(parts[0])
+    if url.scheme and url.netloc:
+        parts[0] = urlunsplit((url.scheme.lower(), url.netloc.lower(), url.path.rstrip('/'),
+                               url.query, url.fragment))
+    return ' '.join(parts)
+
+
+class _Reader():
+    """ JSON values decoded one by one from a file read in chunks """
+
+    def __init__(self, fproj, chunk_size):
+        self.fproj = fproj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def __fill(self):
+        """ Read more data, dropping the data already decoded """
+        pending = self.buffer[self.pos:]
+        # the chunks grow with the pending data, so a value longer than
+        # a chunk is not decoded again too many times
+        data = self.fproj.read(max(self.chunk_size, len(pending)))
+        self.buffer = pending + data
+        self.pos = 0
+        if not data:
+            self.eof = True
+
+    def peek(self):
+        """ Next char which is not whitespace, '' at the end of the file """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or self.eof:
+                return self.buffer[self.pos:self.pos + 1]
+            self.__fill()
+
+    def expect(self, chars):
+        char = self.peek()
+        if not char or char not in chars:
+            raise ValueError("Expecting one of '%s' in projects file %s, found '%s'" %
+                             (chars, self.fproj.name, char))
+        self.pos += 1
+        return char
+
+    def value(self):
+        """ Decode the next value, reading more data until it is complete """
+        self.peek()
+        while True:
+            try:
+                (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number could continue in the next chunk
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.__fill()
+
+
+def iter_projects(projects_file, chunk_size=CHUNK_SIZE):
+    """ Read the projects of a file one by one
+
+    Only the data of one project is decoded at a time, so the memory used
+    doesn't depend on the size of the file.
+
+    :returns: iterator of (project name, compact project data)
+    """
+    with open(projects_file, 'r', encoding='utf-8') as fproj:
+        reader = _Reader(fproj, chunk_size)
+        reader.expect('{')
+        if reader.peek() == '}':
+            return
+        while True:
+            name = reader.value()
+            if not isinstance(name, str):
+                raise ValueError("Wrong project name %s in projects file %s" %
+                                 (name, projects_file))
+            reader.expect(':')
+            yield (sys.intern(name), compact(reader.value()))
+            if reader.expect(',}') == '}':
+                break
+        if reader.peek():
+            raise ValueError("Extra data after the projects in projects file %s" % projects_file)
+
+
+def load_projects(projects_path, chunk_size=CHUNK_SIZE):
+    """ Load the projects of a file or of a directory with several files
+
+    :returns: dict with the compact data of each project
+    """
+    projects = {}
+    for projects_file in get_projects_files(projects_path):
+        for (name, data) in iter_projects(projects_file, chunk_size):
+            if name in projects:
+                logger.warning("Project %s defined again in %s, the last one is used",
+                               name, projects_file)
+            projects[name] = data
+    return projects
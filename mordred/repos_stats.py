@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import logging
+import time
+
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+class ReposStats():
+    """ Timing and activity of the last run of each repository in each phase
+
+    The phases are 'collection' and 'enrichment'. The stats are used to
+    decide the order in which the repositories are processed and, for
+    adaptive updates, how often each repository is processed.
+    """
+
+    __stats = {}  # (backend_section, phase, repo) -> stats dict
+    __stragglers = {}  # (backend_section, phase, repo) -> timeouts and next retry
+    __interrupted = {}  # (backend_section, phase) -> start of the cycle interrupted by a restart
+    stats_lock = Lock()
+    store = None  # CheckpointStore in which the stats are persisted
+
+    @classmethod
+    def set_store(cls, store):
+        """ Persist the stats in store, loading the ones already in it """
+        with cls.stats_lock:
+            cls.__stats.update(store.load_repos_stats())
+            cls.__interrupted = store.load_cycles()
+            cls.store = store
+            logger.debug("Loaded stats for %i repositories", len(cls.__stats))
+
+    @classmethod
+    def record(cls, backend_section, phase, repo, start, end, items=None):
+        """ Record the execution of a phase for a repository
+
+        :param start: epoch time when the repository processing started
+        :param end: epoch time when the repository processing finished
+        :param items: number of new items produced, None if unknown
+        """
+        with cls.stats_lock:
+            stats = cls.__stats.setdefault((backend_section, phase, repo), {})
+            stats.update({
+                "last_run": end,
+                "duration": end - start,
+                "items": items
+            })
+            if cls.store:
+                cls.store.save_repo_stats(backend_section, phase, repo, stats)
+
+    @classmethod
+    def forget(cls, backend_section, repo, phases=('collection', 'enrichment')):
+        """ Remove the stats of a repository, it is processed as a new one """
+        with cls.stats_lock:
+            for phase in phases:
+                cls.__stragglers.pop((backend_section, phase, repo), None)
+                if cls.__stats.pop((backend_section, phase, repo), None) and cls.store:
+                    cls.store.remove_repo_stats(backend_section, phase, repo)
+
+    @classmethod
+    def start_cycle(cls, backend_section, phases, repos):
+        """ Start a cycle processing the repositories in some phases
+
+        The start of the cycle is persisted until end_cycle is called. If
+        the process is restarted in the middle of the cycle, the next one
+        resumes it: the repositories already processed in all the phases
+        since the start of the interrupted cycle are skipped.
+
+        :param phases: phases done to each repository in the cycle
+        :param repos: repositories of the cycle
+        :returns: the repositories to be processed, in the same order
+        """
+        if not cls.store:
+            return repos
+        now = time.time()
+        with cls.stats_lock:
+            starts = [cls.__interrupted.pop((backend_section, phase), None) for phase in phases]
+            for (phase, start) in zip(phases, starts):
+                # a resumed cycle keeps the start, in case it is interrupted again
+                cls.store.save_cycle(backend_section, phase, start if start else now)
+            if None in starts:
+                return repos
+            pending = [repo for repo in repos
+                       if not cls.__done_since(backend_section, phases, starts, repo)]
+        logger.info("[%s] Resuming the %s interrupted cycle, %i of %i repositories done",
+                    backend_section, "/".join(phases), len(repos) - len(pending), len(repos))
+        return pending
+
+    @classmethod
+    def __done_since(cls, backend_section, phases, starts, repo):
+        for (phase, start) in zip(phases, starts):
+            stats = cls.__stats.get((backend_section, phase, repo))
+            if not stats or stats['last_run'] < start:
+                return False
+        return True
+
+    @classmethod
+    def end_cycle(cls, backend_section, phases):
+        """ All the repositories of the cycle were processed, it won't be resumed """
+        if not cls.store:
+            return
+        with cls.stats_lock:
+            for phase in phases:
+                cls.store.remove_cycle(backend_section, phase)
+
+    @classmethod
+    def adapt_interval(cls, backend_section, phase, repo, min_interval, max_interval):
+        """ Update the interval between runs of a repository with its last run
+
+        The interval is doubled for repositories without new items and
+        halved for the ones with new items, always within the bounds.
+        """
+        with cls.stats_lock:
+            stats = cls.__stats.get((backend_section, phase, repo))
+            if not stats or stats['items'] is None:
+                return
+            interval = stats.get('interval', max(min_interval, 1))
+            if stats['items'] == 0:
+                interval = min(interval * 2, max_interval)
+            else:
+                interval = max(interval // 2, min_interval)
+            stats['interval'] = interval
+            if cls.store:
+                cls.store.save_repo_stats(backend_section, phase, repo, stats)
+            logger.debug("[%s] %s new items in %s, next update in %i s",
+                         backend_section, stats['items'], repo, interval)
+
+    @classmethod
+    def record_timeout(cls, backend_section, phase, repo, timeout, max_delay):
+        """ Record that a repository exceeded its time budget in a phase
+
+        The repository becomes a straggler and it is retried later, with
+        a delay which doubles with each consecutive timeout.
+
+        :param timeout: seconds of the exceeded time budget
+        :param max_delay: max seconds before retrying the repository
+        :returns: seconds before retrying the repository
+        """
+        with cls.stats_lock:
+            straggler = cls.__stragglers.setdefault((backend_section, phase, repo),
+                                                    {"timeouts": 0, "retry_after": 0})
+            straggler['timeouts'] += 1
+            delay = min(timeout * 2 ** (straggler['timeouts'] - 1), max_delay)
+            straggler['retry_after'] = time.time() + delay
+            return delay
+
+    @classmethod
+    def clear_straggler(cls, backend_section, phase, repo):
+        """ The repository is processed again within the time budget """
+        with cls.stats_lock:
+            cls.__stragglers.pop((backend_section, phase, repo), None)
+
+    @classmethod
+    def is_straggler(cls, backend_section, phase, repo):
+        """ Check if the repository exceeded its time budget the last time """
+        with cls.stats_lock:
+            return (backend_section, phase, repo) in cls.__stragglers
+
+    @classmethod
+    def is_backed_off(cls, backend_section, phase, repo, now=None):
+        """ Check if the retry of a straggler repository must still wait """
+        now = now if now else time.time()
+        with cls.stats_lock:
+            straggler = cls.__stragglers.get((backend_section, phase, repo))
+            return straggler is not None and straggler['retry_after'] > now
+
+    @classmethod
+    def is_due(cls, backend_section, phase, repo, now=None):
+        """ Check if the interval since the last run of a repository expired """
+        stats = cls.get(backend_section, phase, repo)
+        if not stats or 'interval' not in stats:
+            return True
+        now = now if now else time.time()
+        return stats['last_run'] + stats['interval'] <= now
+
+    @classmethod
+    def get(cls, backend_section, phase, repo):
+        """ Stats for the last run of a repository or None if never run """
+        with cls.stats_lock:
+            stats = cls.__stats.get((backend_section, phase, repo))
+            return dict(stats) if stats else None
+
+    @classmethod
+    def priority(cls, backend_section, phase, repo, now=None):
+        """ Priority of a repository, the higher the sooner it is processed
+
+        The priority is how outdated the repository data will be once it
+        has been processed again: the time since its last run plus the
+        time it took to process it. Stale repositories are refreshed first
+        and, within the same staleness, the longest ones are started first
+        so they don't delay the end of the cycle.
+        """
+        stats = cls.get(backend_section, phase, repo)
+        if not stats:
+            # never processed repositories go first
+            return float("inf")
+        now = now if now else time.time()
+        return (now - stats['last_run']) + stats['duration']
+
+    @classmethod
+    def sort_repos(cls, backend_section, phase, repos):
+        """ Sort the repositories with the highest priority first """
+        now = time.time()
+        return sorted(repos, key=lambda repo: cls.priority(backend_section, phase, repo, now),
+                      reverse=True)
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import heapq
+import logging
+import threading
+import time
+
+from collections import deque
+from itertools import count
+
+from mordred.metrics import QUEUE_DEPTH
+from mordred.pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+# failed units kept to be returned by the scheduler, the older ones are
+# dropped when it runs forever
+MAX_FAILED_UNITS = 1000
+
+
+class WorkUnit():
+    """ A piece of work to be executed once its dependencies are done """
+
+    def __init__(self, name, func, args=(), deps=None, repo=None, not_before=0,
+                 global_task=False, gate=None, section=None, autorefresh=None,
+                 on_cancel=None):
+        """
+        :param name: name of the work unit, used for logging
+        :param func: function to be called with args
+        :param deps: work units that must be done before this one
+        :param repo: repository processed, used to limit the work per host
+        :param not_before: epoch time before which the unit is not executed
+        :param global_task: the unit is not related to a backend
+        :param gate: Watermark which must be open to execute the unit, its
+                     level is increased when the unit is dispatched
+        :param section: backend section of the unit, if any
+        :param autorefresh: function doing the autorefresh part of the unit
+                            work, executed alone when identities are merged
+        :param on_cancel: function called if the unit is cancelled, to undo
+                          what it was expected to undo when executed
+        """
+        self.name = name
+        self.func = func
+        self.args = args
+        self.deps = deps if deps else []
+        self.repo = repo
+        self.not_before = not_before
+        self.global_task = global_task
+        self.gate = gate
+        self.section = section
+        self.autorefresh = autorefresh
+        self.autorefresh_unit = None  # unit executing the autorefresh now
+        self.on_cancel = on_cancel
+        self.dispatched = False
+        self.done = False
+        self.exception = None
+        self.seq = None  # order in which it was added
+        self.dep_index = 0  # deps before it are done
+        self.dependents = []  # units waiting for this one to be done
+
+    def is_blocking(self, now):
+        """ A dependency blocks until it is done
+
+        A dependency which is not due yet (not_before in the future) does not
+        block: the work depending on it is ordered only with the runs of the
+        dependency in the same time window, it does not wait for the next one.
+        """
+        return not self.done and self.not_before <= now
+
+    def get_blocking_dep(self, now):
+        """ First dependency blocking the unit, None if there is none
+
+        The deps are done in order most of the times, so the check starts
+        after the ones found done before.
+        """
+        while self.dep_index < len(self.deps) and self.deps[self.dep_index].done:
+            self.dep_index += 1
+        for dep in self.deps[self.dep_index:]:
+            if dep.is_blocking(now):
+                return dep
+        return None
+
+    def __repr__(self):
+        return "WorkUnit(%s)" % self.name
+
+
+class Scheduler():
+    """ Execute work units in a shared pool of workers following their dependencies
+
+    Work units can be added while the scheduler is running, i.e. from the
+    work units themselves to schedule the next round of work.
+
+    The units are not checked again and again: the ones waiting for their
+    time are in a heap by due time, the ones waiting for a dependency are
+    attached to it until it is done and the ones waiting for a closed gate
+    are kept with the gate. Only the due units are checked, in order of due
+    time and addition.
+    """
+
+    def __init__(self, max_workers=1, max_workers_host=0, repos_listener=None):
+        """
+        :param max_workers: max number of work units executed in parallel
+        :param max_workers_host: max number of work units executed in parallel
+                                 for the repositories in the same host
+        :param repos_listener: function called with the ReposDiff when the
+                               repositories of the projects change, to add
+                               the work units for them
+        """
+        self.pool = WorkerPool(max_workers, max_workers_host)
+        self.stopper = threading.Event()
+        self.cond = threading.Condition()
+        self.pending = {}  # units not dispatched yet (used as an ordered set)
+        self.running = []  # units being executed in the pool
+        self.failed = deque(maxlen=MAX_FAILED_UNITS)  # units finished with an exception
+        self.repos_listener = repos_listener
+        self.waiting = []  # heap of (not_before, seq, unit) not due yet
+        self.due = []  # heap of (not_before, seq, unit) to be checked
+        self.gated = {}  # gate -> units waiting for it to open
+        self.seq = count()
+
+    def add(self, name, func, *args, deps=None, repo=None, not_before=0,
+            global_task=False, gate=None, section=None, autorefresh=None, on_cancel=None):
+        """ Add a new work unit to be executed
+
+        A unit with a gate adds one to its level when it is dispatched. The
+        level must be decreased by the work of the unit itself or of others:
+        a closed gate is checked again when other units finish.
+        """
+        unit = WorkUnit(name, func, args, deps, repo, not_before, global_task, gate, section,
+                        autorefresh, on_cancel)
+        with self.cond:
+            unit.seq = next(self.seq)
+            self.pending[unit] = None
+            self.__push(unit, time.time())
+            self.cond.notify()
+        return unit
+
+    def __push(self, unit, now):
+        """ Queue a pending unit to be checked when it is due """
+        entry = (unit.not_before, unit.seq, unit)
+        heapq.heappush(self.due if unit.not_before <= now else self.waiting, entry)
+
+    def stop(self):
+        """ Stop the scheduler once the running units finish """
+        with self.cond:
+            self.stopper.set()
+            self.cond.notify()
+
+    def wakeup(self, reason, global_tasks=False, repos_diff=None, autorefresh=False):
+        """ Make due now the units waiting for their time
+
+        With a repos_diff, the pending units of the removed repositories are
+        cancelled and the repos_listener adds the ones for the new
+        repositories, the rest of the units keep waiting for their time.
+        With autorefresh, just the autorefresh of the pending units is
+        executed now, in units of its own.
+        """
+        logger.debug("Scheduler woken up: %s", reason)
+        if repos_diff is not None:
+            self.__cancel_removed(repos_diff)
+            if self.repos_listener:
+                self.repos_listener(repos_diff)
+            return
+        if autorefresh:
+            self.__add_autorefresh()
+            return
+        with self.cond:
+            now = time.time()
+            waiting = []
+            for (not_before, seq, unit) in self.waiting:
+                if unit.global_task and not global_tasks:
+                    waiting.append((not_before, seq, unit))
+                elif unit in self.pending:
+                    unit.not_before = min(unit.not_before, now)
+                    self.__push(unit, now)
+            heapq.heapify(waiting)
+            self.waiting = waiting
+            self.cond.notify()
+
+    def __add_autorefresh(self):
+        with self.cond:
+            for unit in list(self.pending):
+                if not unit.autorefresh or unit.global_task:
+                    continue
+                if unit.autorefresh_unit and not unit.autorefresh_unit.done:
+                    # the one added before is not done yet
+                    continue
+                unit.autorefresh_unit = self.add(unit.name + " autorefresh", unit.autorefresh,
+                                                 section=unit.section)
+
+    def __cancel_removed(self, repos_diff):
+        with self.cond:
+            for unit in list(self.pending):
+                if unit.repo and unit.section and \
+                        unit.repo in repos_diff.get_removed(unit.section):
+                    logger.debug("Work unit %s cancelled, repository removed", unit.name)
+                    # the units depending on it are not blocked
+                    del self.pending[unit]
+                    self.__set_done(unit)
+                    if unit.on_cancel:
+                        unit.on_cancel()
+            self.cond.notify()
+
+    def __set_done(self, unit):
+        """ Mark the unit as done and check again the units waiting for it """
+        unit.done = True
+        now = time.time()
+        for dependent in unit.dependents:
+            if dependent in self.pending:
+                self.__push(dependent, now)
+        unit.dependents = []
+
+    def __unit_done(self, unit, future):
+        with self.cond:
+            unit.exception = future.exception()
+            if unit.exception:
+                logger.error("Exception in work unit %s: %s", unit.name, unit.exception)
+                self.failed.append(unit)
+            self.running.remove(unit)
+            self.__set_done(unit)
+            self.cond.notify()
+
+    def __dispatch(self, unit):
+        logger.debug("Dispatching work unit %s", unit.name)
+        if unit.gate:
+            unit.gate.add(1)
+        unit.dispatched = True
+        del self.pending[unit]
+        self.running.append(unit)
+        future = self.pool.run(unit.repo, unit.func, *unit.args)
+        future.add_done_callback(lambda f: self.__unit_done(unit, f))
+
+    def __dispatch_due(self, now):
+        """ Dispatch the due units which are not blocked """
+        while self.waiting and self.waiting[0][0] <= now:
+            heapq.heappush(self.due, heapq.heappop(self.waiting))
+        for (gate, units) in list(self.gated.items()):
+            if gate.is_open():
+                del self.gated[gate]
+                for unit in units:
+                    self.__push(unit, now)
+        while self.due:
+            (_, _, unit) = heapq.heappop(self.due)
+            if unit not in self.pending:
+                # cancelled or queued more than once
+                continue
+            dep = unit.get_blocking_dep(now)
+            if dep:
+                dep.dependents.append(unit)
+            elif unit.gate and not unit.gate.is_open():
+                # the gate could be closed by the units just dispatched
+                self.gated.setdefault(unit.gate, []).append(unit)
+            else:
+                self.__dispatch(unit)
+
+    def __next_wakeup(self, now):
+        """ Seconds until the next unit waiting for its time is due
+
+        None if no unit is waiting for its time: the scheduler sleeps until
+        a unit finishes, a new one is added or it is woken up.
+        """
+        return self.waiting[0][0] - now if self.waiting else None
+
+    def run(self):
+        """ Execute the work units until all are done or the stopper is set
+
+        :returns: list of work units that failed, the last MAX_FAILED_UNITS
+        """
+        with self.cond:
+            while True:
+                if self.stopper.is_set():
+                    if not self.running:
+                        break
+                else:
+                    self.__dispatch_due(time.time())
+                    if not self.pending and not self.running:
+                        break
+                QUEUE_DEPTH.set(len(self.pending), queue='scheduler_pending', section='')
+                QUEUE_DEPTH.set(len(self.running), queue='scheduler_running', section='')
+                self.cond.wait(self.__next_wakeup(time.time()))
+
+        self.pool.shutdown()
+        logger.debug("Scheduler finished. Failed units: %s", list(self.failed))
+
+        return list(self.failed)
@@ -23,25 +23,41 @@
 #
 
 import logging
+import time
+
+from datetime import datetime
 
 from grimoire_elk.arthur import get_ocean_backend
+from grimoire_elk.elastic_items import ElasticItems
+from grimoire_elk.elk.elastic import ElasticSearch
 from grimoire_elk.utils import get_connector_from_name, get_elastic
 
+from mordred.backpressure import IngestGate
+from mordred.http import HttpSession, ofuscate_server_uri
+from mordred.lease import LeaseStore
+from mordred.metrics import REPO_TIMEOUTS
+from mordred.pool import WorkerPool
+from mordred.repos_stats import ReposStats
+from mordred.token_pool import TokenPool
+from mordred.trace import Tracer
+
 logger = logging.getLogger(__name__)
 
+# The repositories in the stragglers lane get a longer time budget
+STRAGGLER_TIMEOUT_FACTOR = 4
+
+
 class Task():
     """ Basic class shared by all tasks """
 
-    ES_INDEX_FIELDS = ['enriched_index', 'raw_index', 'es_collection_url']
-
     def __init__(self, config):
         self.backend_section = None
         self.config = config
         self.conf = config.get_conf()
-        self.db_sh = self.conf['sortinghat']['database']
-        self.db_user = self.conf['sortinghat']['user']
-        self.db_password = self.conf['sortinghat']['password']
-        self.db_host = self.conf['sortinghat']['host']
+        self.db_sh = self.conf.sortinghat.database
+        self.db_user = self.conf.sortinghat.user
+        self.db_password = self.conf.sortinghat.password
+        self.db_host = self.conf.sortinghat.host
 
     def is_backend_task(self):
         """
@@ -54,6 +70,19 @@ class Task():
         """ Execute the Task """
         logger.debug("A bored task. It does nothing!")
 
+    async def execute_async(self, loop, executor):
+        """ Execute the Task in an asyncio event loop
+
+        By default the blocking execute is done in the executor. Tasks doing
+        independent HTTP requests override it to do them concurrently.
+        """
+        await loop.run_in_executor(executor, self.execute)
+
+    @classmethod
+    def get_http_session(cls):
+        """ Get the HTTP session with the connections pool shared by all tasks """
+        return HttpSession.get()
+
     @classmethod
     def get_backend(self, backend_section):
         # To support the same data source with different configs
@@ -65,6 +94,14 @@ class Task():
     def set_backend_section(self, backend_section):
         self.backend_section = backend_section
 
+    def _set_es_sizes(self):
+        """ Configure the scroll and bulk sizes used with ElasticSearch """
+        if 'scroll_size' in self.conf['general']:
+            ElasticItems.scroll_size = self.conf.general.scroll_size
+
+        if 'bulk_size' in self.conf['general']:
+            ElasticSearch.max_items_bulk = self.conf.general.bulk_size
+
     def _compose_p2o_params(self, backend_section, repo):
         # get p2o params included in the projects list
         params = {}
@@ -78,7 +115,11 @@ class Task():
 
         return params
 
-    def _compose_perceval_params(self, backend_section, repo):
+    def _compose_perceval_params(self, backend_section, repo, api_token=None):
+        """ Params for the perceval backend of a repository
+
+        :param api_token: token to use instead of the api-token in the config
+        """
         backend = self.get_backend(backend_section)
         connector = get_connector_from_name(backend)
         ocean = connector[1]
@@ -87,25 +128,105 @@ class Task():
         params = ocean.get_perceval_params_from_url(repo)
 
         # Now add the backend params included in the config file
-        for p in self.conf[backend_section]:
-            if p in self.ES_INDEX_FIELDS:
-                # These params are not for the perceval backend
-                continue
-            params.append("--"+p)
-            if self.conf[backend_section][p]:
-                # If param is boolean, no values must be added
-                if type(self.conf[backend_section][p]) != bool:
-                    if type(self.conf[backend_section][p]) == list:
-                        # '--blacklist-jobs', 'a', 'b', 'c'
-                        # 'a', 'b', 'c' must be added as items in the list
-                        list_params = self.conf[backend_section][p]
-                        params += list_params
-                    else:
-                        params.append(self.conf[backend_section][p])
+        section = self.conf[backend_section]
+        params += section.perceval_args
+        if api_token and section.api_token_args:
+            params += ["--api-token", api_token]
+        else:
+            params += section.api_token_args
         return params
 
+    def __get_lease_store(self):
+        cfg = self.conf['general']
+        return LeaseStore(cfg['lease_db'], cfg['node_id'], cfg['lease_ttl'])
+
+    def _get_leased_repos(self, repos):
+        """ Repositories of the backend section to be processed by this node
+
+        All the repositories if there are not several nodes sharing them.
+        """
+        if not self.conf.general.lease_db:
+            return repos
+        return self.__get_lease_store().acquire(self.backend_section, repos)
+
+    def _is_leader(self):
+        """ Check if this node must execute the tasks shared by all the nodes """
+        if not self.conf.general.lease_db:
+            return True
+        return self.__get_lease_store().is_leader()
+
+    def _process_repos(self, phase, repos, workers, workers_host, func, *args, gates=None):
+        """ Execute func(repo, *args) for the repositories in a phase in pools of workers
+
+        With a repo_timeout, the repositories exceeding it are abandoned and
+        retried later with backoff. Until they are processed again within
+        the time budget, they go to their own stragglers lane, with a longer
+        budget, so they don't take the workers of the other repositories.
+        The repositories waiting for a retry are skipped.
+
+        Each repository waits for the gates (i.e. Watermarks) before starting.
+
+        :returns: list of (repo, exception) for the repositories that failed
+        """
+        timeout = self.conf.general.repo_timeout
+        name = "%s:%s" % (self.backend_section, phase)
+        now = time.time()
+        regular_repos = []
+        straggler_repos = []
+        for repo in repos:
+            if ReposStats.is_backed_off(self.backend_section, phase, repo, now) or \
+                    WorkerPool.is_abandoned(name, repo):
+                logger.debug("[%s] %s of %s waiting for a retry", self.backend_section, phase, repo)
+            elif ReposStats.is_straggler(self.backend_section, phase, repo):
+                straggler_repos.append(repo)
+            else:
+                regular_repos.append(repo)
+
+        lanes = [("regular", WorkerPool(workers, workers_host, timeout, name, gates),
+                  regular_repos, timeout)]
+        if straggler_repos:
+            logger.info("[%s] %i repositories in the stragglers lane for %s",
+                        self.backend_section, len(straggler_repos), phase)
+            straggler_timeout = timeout * STRAGGLER_TIMEOUT_FACTOR
+            lanes.append(("stragglers", WorkerPool(self.conf.general.straggler_workers,
+                                                   workers_host, straggler_timeout, name,
+                                                   gates),
+                          straggler_repos, straggler_timeout))
+
+        for (_, pool, lane_repos, _) in lanes:
+            for repo in lane_repos:
+                pool.submit(repo, func, repo, *args)
+
+        failed = []
+        for (lane, pool, lane_repos, lane_timeout) in lanes:
+            lane_failed = pool.wait()
+            pool.shutdown()
+            failed += lane_failed
+
+            for repo in pool.abandoned:
+                REPO_TIMEOUTS.inc(section=self.backend_section, phase=phase)
+                delay = ReposStats.record_timeout(self.backend_section, phase, repo, lane_timeout,
+                                                  self.conf.general.max_update_delay)
+                logger.error("[%s] %s of %s abandoned after %i s, retrying it in %i s",
+                             self.backend_section, phase, repo, lane_timeout, delay)
+
+            if lane == "stragglers":
+                done = set(lane_repos) - set(pool.abandoned) - set(repo for (repo, _) in lane_failed)
+                for repo in done:
+                    stats = ReposStats.get(self.backend_section, phase, repo)
+                    if stats and stats['duration'] <= timeout:
+                        # back to the regular lane
+                        ReposStats.clear_straggler(self.backend_section, phase, repo)
+
+        return failed
+
+    def _get_ingest_gate(self, es_url):
+        """ Gate to wait until ElasticSearch in es_url can ingest more items """
+        return IngestGate.get_gate(es_url, self.conf.general.es_queue_high_watermark,
+                                   self.conf.general.es_queue_low_watermark)
+
     def _get_collection_url(self):
-        es_col_url = self.conf['es_collection']['url']
+        es_col_url = self.conf.es_collection.url
         if self.backend_section and self.backend_section in self.conf:
             if 'es_collection_url' in self.conf[self.backend_section]:
                 es_col_url = self.conf[self.backend_section]['es_collection_url']
@@ -113,6 +234,63 @@ class Task():
             logger.warning("No config for the backend %s", self.backend_section)
         return es_col_url
 
+    def __count_items(self, index_url, origin, date_field, since):
+        """ Number of items in index_url for origin with date_field after since (epoch)
+
+        :returns: the number of items or None if it can not be counted
+        """
+        count_url = index_url + "/_count"
+        since_str = datetime.utcfromtimestamp(since).isoformat()
+        query = {
+            "query": {
+                "bool": {
+                    "filter": [
+                        {"term": {"origin": origin}},
+                        {"range": {date_field: {"gte": since_str}}}
+                    ]
+                }
+            }
+        }
+        # the credentials in the url are not written in the traces or logs
+        index_name = ofuscate_server_uri(index_url)
+        try:
+            with Tracer.span("es_count", index=index_name, origin=origin):
+                res = self.get_http_session().post(count_url, json=query, verify=False)
+                res.raise_for_status()
+            return res.json()['count']
+        except Exception as ex:
+            logger.warning("Can not count the items for %s in %s: %s", origin, index_name, ex)
+            return None
+
+    def _count_raw_items(self, origin, since):
+        """ Number of raw items for origin retrieved after since (epoch) """
+        index_url = self._get_collection_url() + "/" + \
+            self.conf[self.backend_section]['raw_index']
+        return self.__count_items(index_url, origin, "metadata__timestamp", since)
+
+    def _count_enriched_items(self, origin, since):
+        """ Number of enriched items for origin produced after since (epoch) """
+        index_url = self.conf.es_enrichment.url + "/" + \
+            self.conf[self.backend_section]['enriched_index']
+        return self.__count_items(index_url, origin, "metadata__enriched_on", since)
+
+    def _get_api_token_pool(self):
+        """ Pool with the GitHub tokens of the backend section
+
+        None if the section is not a github one with a list of tokens.
+        """
+        tokens = self.conf[self.backend_section].get('api-token')
+        if self.get_backend(self.backend_section) != 'github' or not isinstance(tokens, tuple):
+            return None
+        return TokenPool.get_pool(tokens, self.backend_section)
+
+    def _get_backend_token_pool(self):
+        """ Pool with the GitHub tokens used in enrichment, None if not a list """
+        if 'github' not in self.conf or \
+                not isinstance(self.conf['github'].get('backend_token'), tuple):
+            return None
+        return TokenPool.get_pool(self.conf['github']['backend_token'], self.backend_section)
+
     def _get_enrich_backend(self):
         db_projects_map = None
         json_projects_map = None
@@ -121,7 +299,7 @@ class Task():
 
         enrich_backend = connector[2](self.db_sh, db_projects_map, json_projects_map,
                                       self.db_user, self.db_password, self.db_host)
-        elastic_enrich = get_elastic(self.conf['es_enrichment']['url'],
+        elastic_enrich = get_elastic(self.conf.es_enrichment.url,
                                      self.conf[self.backend_section]['enriched_index'],
                                      clean, enrich_backend)
         enrich_backend.set_elastic(elastic_enrich)
@@ -131,10 +309,12 @@ class Task():
             self.get_backend(self.backend_section) == "git":
 
             gh_token = self.conf['github']['backend_token']
+            if self._get_backend_token_pool():
+                gh_token = self._get_backend_token_pool().best_token()
             enrich_backend.set_github_token(gh_token)
 
         if 'unaffiliated_group' in self.conf['sortinghat']:
-            enrich_backend.unaffiliated_group = self.conf['sortinghat']['unaffiliated_group']
+            enrich_backend.unaffiliated_group = self.conf.sortinghat.unaffiliated_group
 
         return enrich_backend
 
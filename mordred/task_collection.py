@@ -23,15 +23,22 @@
 #
 
 import logging
+import threading
 import time
 
+from concurrent.futures import FIRST_COMPLETED, wait
+
 from grimoire_elk.arthur import feed_backend
-from grimoire_elk.elastic_items import ElasticItems
-from grimoire_elk.elk.elastic import ElasticSearch
 
+from mordred.backpressure import WatermarkQueue
 from mordred.error import DataCollectionError
+from mordred.metrics import ITEMS_COLLECTED, REPO_DURATION, REPO_FAILURES, REPO_LAST_DURATION
+from mordred.profiler import Profiler
+from mordred.repos_stats import ReposStats
 from mordred.task import Task
+from mordred.task_enrich import TaskEnrich
 from mordred.task_projects import TaskProjects
+from mordred.trace import Tracer
 
 
 logger = logging.getLogger(__name__)
@@ -46,16 +53,167 @@ class TaskRawDataCollection(Task):
         self.backend_section = backend_section
         # This will be options in next iteration
         self.clean = False
+        self._set_es_sizes()
 
-    def execute(self):
+    def get_repos(self):
+        """ Repositories to be collected in the backend section """
+        cfg = self.config.get_conf()
+
+        if 'collect' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['collect'] == False:
+            logging.info('%s collect disabled', self.backend_section)
+            return []
+
+        # repos could change between executions because changes in projects
+        repos = TaskProjects.get_repos_by_backend_section(self.backend_section)
+        repos = self._get_leased_repos(repos)
+
+        if cfg.general.adaptive_update:
+            # quiet repositories are not collected in all the cycles
+            now = time.time()
+            due_repos = [repo for repo in repos
+                         if ReposStats.is_due(self.backend_section, 'collection', repo, now)]
+            logger.debug("[%s] %i repositories not due for collection", self.backend_section,
+                         len(repos) - len(due_repos))
+            repos = due_repos
+
+        return ReposStats.sort_repos(self.backend_section, 'collection', repos)
+
+    def collect_repo(self, repo):
+        """ Collect the raw data for a repository of the backend section """
         cfg = self.config.get_conf()
 
-        if 'scroll_size' in cfg['general']:
-            ElasticItems.scroll_size = cfg['general']['scroll_size']
+        start = time.time()
+        try:
+            with Profiler.profile(self.backend_section, type(self).__name__), \
+                    Tracer.span("collect", section=self.backend_section, repo=repo):
+                items = self.__collect_repo(repo)
+        except Exception:
+            REPO_FAILURES.inc(section=self.backend_section, phase='collection')
+            raise
+        end = time.time()
+        ReposStats.record(self.backend_section, 'collection', repo, start, end, items)
+
+        REPO_DURATION.observe(end - start, section=self.backend_section, phase='collection')
+        REPO_LAST_DURATION.set(end - start, section=self.backend_section, phase='collection',
+                               repo=repo)
+        if items is not None:
+            ITEMS_COLLECTED.inc(items, section=self.backend_section, repo=repo)
+
+        if cfg.general.adaptive_update:
+            ReposStats.adapt_interval(self.backend_section, 'collection', repo,
+                                      cfg.general.min_update_delay,
+                                      cfg.general.max_update_delay)
+
+    def __collect_repo(self, repo):
+        """ Collect a repository
+
+        :returns: number of new items collected if adaptive update or
+                  metrics are enabled, None otherwise
+        """
+        cfg = self.config.get_conf()
+
+        fetch_cache = False
+        if 'fetch-cache' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['fetch-cache']:
+            fetch_cache = True
+
+        p2o_args = self._compose_p2o_params(self.backend_section, repo)
+        filter_raw = p2o_args['filter-raw'] if 'filter-raw' in p2o_args else None
+
+        if filter_raw:
+            # If filter-raw exists the goal is to enrich already collected
+            # data, so don't collect anything
+            logging.warning("Not collecting filter raw repository: %s", repo)
+            return
 
-        if 'bulk_size' in cfg['general']:
-            ElasticSearch.max_items_bulk = cfg['general']['bulk_size']
+        url = p2o_args['url']
+        start = time.time()
+        token_pool = self._get_api_token_pool()
+        if token_pool:
+            # the repository is collected with the token with more quota
+            with token_pool.token() as api_token:
+                self.__feed_backend(repo, url, fetch_cache, api_token)
+        else:
+            self.__feed_backend(repo, url, fetch_cache)
 
+        if cfg.general.adaptive_update or cfg.general.metrics_port:
+            return self._count_raw_items(url, start)
+
+    def __feed_backend(self, repo, url, fetch_cache, api_token=None):
+        cfg = self.config.get_conf()
+
+        backend_args = self._compose_perceval_params(self.backend_section, repo, api_token)
+        logger.debug(backend_args)
+        logger.debug('[%s] collection starts for %s', self.backend_section, repo)
+        es_col_url = self._get_collection_url()
+        ds = self.backend_section
+        backend = self.get_backend(self.backend_section)
+        project = None  # just used for github in cauldron
+        self._get_ingest_gate(es_col_url).wait()
+        try:
+            feed_backend(es_col_url, self.clean, fetch_cache, backend, backend_args,
+                         cfg[ds]['raw_index'], cfg[ds]['enriched_index'], project)
+        except:
+            logger.error("Something went wrong collecting data from this %s repo: %s . " \
+                         "Using the backend_args: %s " % (ds, url, str(backend_args)))
+            raise DataCollectionError('Failed to collect data from %s' % url)
+
+    def __enrich_stream(self, repos_queue, failed):
+        """ Enrich the repositories as soon as they are collected
+
+        With enrichment processes, a repository is enriched in each process
+        at the same time. No more repositories are taken from the queue
+        while all the processes are busy, so the collection still waits
+        when the enrichment lags too much.
+        """
+        cfg = self.config.get_conf()
+
+        # all the repositories collected are enriched: the ones filtered out
+        # by TaskEnrich.get_repos are just the ones not collected again
+        task_enrich = TaskEnrich(self.config, backend_section=self.backend_section)
+        if 'enrich' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['enrich'] is False:
+            logger.info('%s enrich disabled', self.backend_section)
+            task_enrich = None
+        processes = self.conf.es_enrichment.enrich_processes
+        running = {}  # future -> repo enriched in a process
+
+        def record(futures):
+            for future in futures:
+                repo = running.pop(future)
+                try:
+                    task_enrich.record_repo_future(repo, future)
+                except Exception as ex:
+                    failed.append((repo, ex))
+
+        while True:
+            repo = repos_queue.get()
+            if repo is None:
+                break
+            if not task_enrich:
+                continue
+            if processes <= 0:
+                try:
+                    task_enrich.enrich_repo(repo)
+                except Exception as ex:
+                    failed.append((repo, ex))
+                continue
+            if len(running) >= processes:
+                (done, _) = wait(running, return_when=FIRST_COMPLETED)
+                record(done)
+            running[task_enrich.submit_repo_in_process(repo)] = repo
+
+        record(wait(running)[0])
+
+    def __collect_and_stream(self, repo, repos_queue):
+        self.collect_repo(repo)
+        repos_queue.put(repo)
+
+    def execute(self):
+        cfg = self.config.get_conf()
+
+        self._set_es_sizes()
 
         if 'collect' in cfg[self.backend_section] and \
             cfg[self.backend_section]['collect'] == False:
@@ -64,45 +222,47 @@ class TaskRawDataCollection(Task):
 
         t2 = time.time()
         logger.info('[%s] raw data collection starts', self.backend_section)
-        clean = False
-
-        fetch_cache = False
-        if 'fetch-cache' in cfg[self.backend_section] and \
-            cfg[self.backend_section]['fetch-cache']:
-            fetch_cache = True
 
-        # repos could change between executions because changes in projects
-        repos = TaskProjects.get_repos_by_backend_section(self.backend_section)
+        repos = self.get_repos()
 
         if not repos:
             logger.warning("No collect repositories for %s", self.backend_section)
 
-        for repo in repos:
-            p2o_args = self._compose_p2o_params(self.backend_section, repo)
-            filter_raw = p2o_args['filter-raw'] if 'filter-raw' in p2o_args else None
+        # Repositories are collected in parallel, they are I/O bound
+        workers = cfg.general.collection_workers
+        workers_host = cfg.general.collection_workers_per_host
+        gates = [self._get_ingest_gate(self._get_collection_url())]
 
-            if filter_raw:
-                # If filter-raw exists the goal is to enrich already collected
-                # data, so don't collect anything
-                logging.warning("Not collecting filter raw repository: %s", repo)
-                continue
+        pipelined = TaskEnrich.is_pipelined(self.config, self.backend_section)
+        # the repositories done before a restart in the middle of the cycle are skipped
+        phases = ('collection', 'enrichment') if pipelined else ('collection',)
+        repos = ReposStats.start_cycle(self.backend_section, phases, repos)
 
-            url = p2o_args['url']
-            backend_args = self._compose_perceval_params(self.backend_section, repo)
-            logger.debug(backend_args)
-            logger.debug('[%s] collection starts for %s', self.backend_section, repo)
-            es_col_url = self._get_collection_url()
-            ds = self.backend_section
-            backend = self.get_backend(self.backend_section)
-            project = None  # just used for github in cauldron
-            try:
-                feed_backend(es_col_url, clean, fetch_cache, backend, backend_args,
-                             cfg[ds]['raw_index'], cfg[ds]['enriched_index'], project)
-            except:
-                logger.error("Something went wrong collecting data from this %s repo: %s . " \
-                             "Using the backend_args: %s " % (ds, url, str(backend_args)))
-                raise DataCollectionError('Failed to collect data from %s' % url)
+        if pipelined:
+            # Each repository is enriched just after it is collected. The
+            # collection waits when the enrichment lags too much.
+            repos_queue = WatermarkQueue(cfg.general.pipeline_high_watermark,
+                                         cfg.general.pipeline_low_watermark,
+                                         'pipeline', self.backend_section)
+            failed_enrich = []
+            enrich_thread = threading.Thread(target=self.__enrich_stream,
+                                             args=(repos_queue, failed_enrich))
+            enrich_thread.start()
+            failed = self._process_repos('collection', repos, workers, workers_host,
+                                         self.__collect_and_stream, repos_queue,
+                                         gates=gates + [repos_queue.watermark])
+            repos_queue.put(None)
+            enrich_thread.join()
+            failed += failed_enrich
+        else:
+            failed = self._process_repos('collection', repos, workers, workers_host,
+                                         self.collect_repo, gates=gates)
+        ReposStats.end_cycle(self.backend_section, phases)
 
+        if failed:
+            for repo, ex in failed:
+                logger.error("[%s] Failed processing %s: %s", self.backend_section, repo, ex)
+            raise failed[0][1]
 
         t3 = time.time()
 
@@ -23,26 +23,61 @@
 #
 
 import logging
+import multiprocessing
+import threading
 import time
 
+from concurrent.futures import ProcessPoolExecutor, wait
+
 from grimoire_elk.arthur import (do_studies, enrich_backend, refresh_projects,
                                  refresh_identities)
-from grimoire_elk.elastic_items import ElasticItems
-from grimoire_elk.elk.elastic import ElasticSearch
 
 from mordred.error import DataEnrichmentError
+from mordred.metrics import (ES_BULK_DURATION, ITEMS_ENRICHED, REPO_DURATION, REPO_FAILURES,
+                             REPO_LAST_DURATION)
+from mordred.profiler import Profiler
+from mordred.repos_stats import ReposStats
 from mordred.task import Task
 from mordred.task_manager import TasksManager
 from mordred.task_panels import TaskPanelsAliases
 from mordred.task_projects import TaskProjects
+from mordred.trace import Tracer
 
 
 logger = logging.getLogger(__name__)
 
+# Config and enrich tasks by backend section of an enrichment worker process
+_worker_config = None
+_worker_tasks = {}
+
+
+def _init_enrich_worker(config):
+    global _worker_config
+    _worker_config = config
+
+
+def _enrich_repo_worker(backend_section, repo):
+    """ Enrich a repository inside an enrichment worker process
+
+    The tasks are reused by all the repositories of a backend section
+    enriched in the same worker, so they are created once per process.
+    The enrichment is not recorded here, the stats and metrics of this
+    process are lost: the parent records it with the returned data.
+
+    :returns: start and end time of the enrichment and items enriched
+    """
+    if backend_section not in _worker_tasks:
+        _worker_tasks[backend_section] = TaskEnrich(_worker_config, backend_section)
+    return _worker_tasks[backend_section].enrich_repo_timed(repo)
+
 
 class TaskEnrich(Task):
     """ Basic class shared by all enriching tasks """
 
+    # pool of processes shared by all backends when enrich_processes is set
+    process_pool = None
+    process_pool_lock = threading.Lock()
+
     def __init__(self, config, backend_section=None):
         super().__init__(config)
         self.backend_section = backend_section
@@ -50,21 +85,140 @@ class TaskEnrich(Task):
         self.clean = False
           # check whether the aliases has beed already created
         self.enrich_aliases = False
+        self._set_es_sizes()
 
-    def __enrich_items(self):
+    @classmethod
+    def is_pipelined(cls, config, backend_section):
+        """ Check if the repositories are enriched just after being collected
 
-        time_start = time.time()
+        In this case the enrichment is done by TaskRawDataCollection and
+        TaskEnrich just needs to do the post enrichment work.
+        """
+        cfg = config.get_conf()
 
-        #logger.info('%s starts for %s ', 'enrichment', self.backend_section)
-        logger.info('[%s] enrichment starts', self.backend_section)
+        if not cfg.general.pipeline:
+            return False
+        if not cfg.phases.collection or not cfg.phases.enrichment:
+            return False
+        if 'collect' in cfg[backend_section] and cfg[backend_section]['collect'] is False:
+            return False
+
+        return True
+
+    @classmethod
+    def uses_processes(cls, config):
+        """ Check if the repositories are enriched in a pool of processes """
+        return config.get_conf()['es_enrichment']['enrich_processes'] > 0
+
+    def __get_process_pool(self):
+        with TaskEnrich.process_pool_lock:
+            if not TaskEnrich.process_pool:
+                processes = self.conf.es_enrichment.enrich_processes
+                logger.info("Starting %i enrichment processes", processes)
+                # spawn: forking a process with running threads is not safe
+                context = multiprocessing.get_context('spawn')
+                TaskEnrich.process_pool = ProcessPoolExecutor(max_workers=processes,
+                                                              mp_context=context,
+                                                              initializer=_init_enrich_worker,
+                                                              initargs=(self.config,))
+            return TaskEnrich.process_pool
+
+    def submit_repo_in_process(self, repo):
+        """ Enrich a repository in the pool of processes without waiting for it
+
+        :returns: future of the enrichment, to be recorded with record_repo_future
+        """
+        return self.__get_process_pool().submit(_enrich_repo_worker, self.backend_section, repo)
+
+    def record_repo_future(self, repo, future):
+        """ Record the enrichment of a repository done in the pool of processes
+
+        :returns: number of items enriched if metrics are enabled, None otherwise
+        """
+        try:
+            (start, end, items) = future.result()
+        except Exception:
+            REPO_FAILURES.inc(section=self.backend_section, phase='enrichment')
+            raise
+        self.__record_repo(repo, start, end, items)
+        return items
 
+    def enrich_repo_in_process(self, repo):
+        """ Enrich a repository in the pool of processes and wait for it
+
+        :returns: number of items enriched if metrics are enabled, None otherwise
+        """
+        future = self.submit_repo_in_process(repo)
+        with Tracer.span("enrich", section=self.backend_section, repo=repo, process=True):
+            wait([future])
+        return self.record_repo_future(repo, future)
+
+    def get_repos(self, forced=()):
+        """ Repositories to be enriched in the backend section
+
+        :param forced: repositories enriched even if adaptive update finds no
+                       new items in them, like the ones collected in the same round
+        """
         cfg = self.config.get_conf()
 
-        if 'scroll_size' in cfg['general']:
-            ElasticItems.scroll_size = cfg['general']['scroll_size']
+        if 'enrich' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['enrich'] is False:
+            logger.info('%s enrich disabled', self.backend_section)
+            return []
+
+        # repos could change between executions because changes in projects
+        repos = TaskProjects.get_repos_by_backend_section(self.backend_section)
+        repos = self._get_leased_repos(repos)
+
+        if cfg.general.adaptive_update:
+            repos = [repo for repo in repos if repo in forced or self.__has_new_items(repo)]
 
-        if 'bulk_size' in cfg['general']:
-            ElasticSearch.max_items_bulk = cfg['general']['bulk_size']
+        return ReposStats.sort_repos(self.backend_section, 'enrichment', repos)
+
+    def __has_new_items(self, repo):
+        """ Check if a repository was collected after its last enrichment """
+        collection = ReposStats.get(self.backend_section, 'collection', repo)
+        enrichment = ReposStats.get(self.backend_section, 'enrichment', repo)
+        if not collection or not enrichment:
+            return True
+        return collection['last_run'] >= enrichment['last_run']
+
+    def enrich_repo(self, repo):
+        """ Produce the enriched data for a repository of the backend section
+
+        :returns: number of items enriched if metrics are enabled, None otherwise
+        """
+        try:
+            (start, end, items) = self.enrich_repo_timed(repo)
+        except Exception:
+            REPO_FAILURES.inc(section=self.backend_section, phase='enrichment')
+            raise
+        self.__record_repo(repo, start, end, items)
+        return items
+
+    def enrich_repo_timed(self, repo):
+        """ Produce the enriched data for a repository without recording it
+
+        :returns: start and end time of the enrichment and items enriched
+        """
+        start = time.time()
+        with Profiler.profile(self.backend_section, type(self).__name__), \
+                Tracer.span("enrich", section=self.backend_section, repo=repo):
+            items = self.__enrich_repo(repo)
+        return (start, time.time(), items)
+
+    def __record_repo(self, repo, start, end, items):
+        ReposStats.record(self.backend_section, 'enrichment', repo, start, end)
+
+        REPO_DURATION.observe(end - start, section=self.backend_section, phase='enrichment')
+        REPO_LAST_DURATION.set(end - start, section=self.backend_section, phase='enrichment',
+                               repo=repo)
+        if items is not None:
+            ITEMS_ENRICHED.inc(items, section=self.backend_section, repo=repo)
+
+    def __enrich_repo(self, repo):
+        cfg = self.config.get_conf()
+        start = time.time()
 
         no_incremental = False
         github_token = None
@@ -73,63 +227,110 @@ class TaskEnrich(Task):
         only_studies = False
         only_identities = False
 
-        # repos could change between executions because changes in projects
-        repos = TaskProjects.get_repos_by_backend_section(self.backend_section)
+        # First process p2o params from repo
+        p2o_args = self._compose_p2o_params(self.backend_section, repo)
+        filter_raw = p2o_args['filter-raw'] if 'filter-raw' in p2o_args else None
+        filters_raw_prefix = p2o_args['filters-raw-prefix'] if 'filters-raw-prefix' in p2o_args else None
+        jenkins_rename_file = p2o_args['jenkins-rename-file'] if 'jenkins-rename-file' in p2o_args else None
+        url = p2o_args['url']
+        # Second process perceval params from repo
+        api_token_pool = self._get_api_token_pool()
+        api_token = api_token_pool.best_token() if api_token_pool else None
+        backend_args = self._compose_perceval_params(self.backend_section, url, api_token)
+
+        token_pool = self._get_backend_token_pool()
+        if token_pool:
+            # the GitHub API is used with the token with more quota
+            github_token = token_pool.acquire()
+
+        self._get_ingest_gate(cfg.es_enrichment.url).wait()
+        try:
+            es_col_url = self._get_collection_url()
+            logger.debug('[%s] enrichment starts for %s', self.backend_section, repo)
+            backend = self.get_backend(self.backend_section)
+            enrich_backend(es_col_url, self.clean, backend, backend_args,
+                           cfg[self.backend_section]['raw_index'],
+                           cfg[self.backend_section]['enriched_index'],
+                           None, #projects_db is deprecated
+                           TaskProjects.get_projects_file(cfg.projects.projects_file),
+                           cfg.sortinghat.database,
+                           no_incremental, only_identities,
+                           github_token,
+                           False, # studies are executed in its own Task
+                           only_studies,
+                           cfg.es_enrichment.url,
+                           None, #args.events_enrich
+                           cfg.sortinghat.user,
+                           cfg.sortinghat.password,
+                           cfg.sortinghat.host,
+                           None, #args.refresh_projects,
+                           None, #args.refresh_identities,
+                           author_id=None,
+                           author_uuid=None,
+                           filter_raw=filter_raw,
+                           filters_raw_prefix=filters_raw_prefix,
+                           jenkins_rename_file=jenkins_rename_file,
+                           unaffiliated_group=cfg.sortinghat.unaffiliated_group)
+        except Exception as ex:
+            logger.error("Something went wrong producing enriched data for %s . " \
+                         "Using the backend_args: %s ", self.backend_section, str(backend_args))
+            logger.error("Exception: %s", ex)
+            raise DataEnrichmentError('Failed to produce enriched data for %s' % self.backend_section)
+        finally:
+            if token_pool:
+                token_pool.release(github_token)
+
+        # Let's try to create the aliases for the enriched index
+        if not self.enrich_aliases:
+            logger.debug("Creating aliases after enrich")
+            task_aliases = TaskPanelsAliases(self.config)
+            task_aliases.set_backend_section(self.backend_section)
+            task_aliases.execute()
+            logger.debug("Done creating aliases after enrich")
+            self.enrich_aliases = True
+
+        if cfg.general.metrics_port:
+            return self._count_enriched_items(url, start)
+
+    def __enrich_items(self):
+
+        time_start = time.time()
+
+        #logger.info('%s starts for %s ', 'enrichment', self.backend_section)
+        logger.info('[%s] enrichment starts', self.backend_section)
+
+        self._set_es_sizes()
+
+        repos = self.get_repos()
 
         if not repos:
             logger.warning("No enrich repositories for %s", self.backend_section)
 
-        for repo in repos:
-            # First process p2o params from repo
-            p2o_args = self._compose_p2o_params(self.backend_section, repo)
-            filter_raw = p2o_args['filter-raw'] if 'filter-raw' in p2o_args else None
-            filters_raw_prefix = p2o_args['filters-raw-prefix'] if 'filters-raw-prefix' in p2o_args else None
-            jenkins_rename_file = p2o_args['jenkins-rename-file'] if 'jenkins-rename-file' in p2o_args else None
-            url = p2o_args['url']
-            # Second process perceval params from repo
-            backend_args = self._compose_perceval_params(self.backend_section, url)
-
-            try:
-                es_col_url = self._get_collection_url()
-                logger.debug('[%s] enrichment starts for %s', self.backend_section, repo)
-                backend = self.get_backend(self.backend_section)
-                enrich_backend(es_col_url, self.clean, backend, backend_args,
-                               cfg[self.backend_section]['raw_index'],
-                               cfg[self.backend_section]['enriched_index'],
-                               None, #projects_db is deprecated
-                               cfg['projects']['projects_file'],
-                               cfg['sortinghat']['database'],
-                               no_incremental, only_identities,
-                               github_token,
-                               False, # studies are executed in its own Task
-                               only_studies,
-                               cfg['es_enrichment']['url'],
-                               None, #args.events_enrich
-                               cfg['sortinghat']['user'],
-                               cfg['sortinghat']['password'],
-                               cfg['sortinghat']['host'],
-                               None, #args.refresh_projects,
-                               None, #args.refresh_identities,
-                               author_id=None,
-                               author_uuid=None,
-                               filter_raw=filter_raw,
-                               filters_raw_prefix=filters_raw_prefix,
-                               jenkins_rename_file=jenkins_rename_file,
-                               unaffiliated_group=cfg['sortinghat']['unaffiliated_group'])
-            except Exception as ex:
-                logger.error("Something went wrong producing enriched data for %s . " \
-                             "Using the backend_args: %s ", self.backend_section, str(backend_args))
-                logger.error("Exception: %s", ex)
-                raise DataEnrichmentError('Failed to produce enriched data for %s', self.backend_name)
-
-            # Let's try to create the aliases for the enriched index
-            if not self.enrich_aliases:
-                logger.debug("Creating aliases after enrich")
-                task_aliases = TaskPanelsAliases(self.config)
-                task_aliases.set_backend_section(self.backend_section)
-                task_aliases.execute()
-                logger.debug("Done creating aliases after enrich")
-                self.enrich_aliases = True
+        # the repositories done before a restart in the middle of the cycle are skipped
+        repos = ReposStats.start_cycle(self.backend_section, ('enrichment',), repos)
+
+        failed = []
+        if self.uses_processes(self.config):
+            # The repositories are sharded between the enrichment processes
+            futures = {self.submit_repo_in_process(repo): repo for repo in repos}
+            wait(futures)
+            for future, repo in futures.items():
+                try:
+                    self.record_repo_future(repo, future)
+                except Exception as ex:
+                    failed.append(ex)
+        elif self.conf.general.repo_timeout:
+            # The repositories are enriched one by one, in a worker to abandon them
+            gates = [self._get_ingest_gate(self.conf.es_enrichment.url)]
+            failed = [ex for (_, ex) in self._process_repos('enrichment', repos, 1, 0,
+                                                            self.enrich_repo, gates=gates)]
+        else:
+            for repo in repos:
+                self.enrich_repo(repo)
+        ReposStats.end_cycle(self.backend_section, ('enrichment',))
+
+        if failed:
+            raise failed[0]
 
         spent_time = time.strftime("%H:%M:%S", time.gmtime(time.time()-time_start))
         logger.info('[%s] enrichment finished in %s', self.backend_section, spent_time)
@@ -152,51 +353,68 @@ class TaskEnrich(Task):
         field_id = enrich_backend.get_field_unique_id()
         # Now we need to get the uuids to be refreshed
         logger.debug("Checking if there are uuids to refresh in %s", self.backend_section)
-        backends_uuids = TasksManager.UPDATED_UUIDS_QUEUE.get()
-        if backends_uuids:
-            logger.debug("Doing autorefresh for %s (%s uuids)", self.backend_section, backends_uuids)
-            if backends_uuids[self.backend_section]:
-                uuids_refresh = backends_uuids[self.backend_section]
-                backends_uuids[self.backend_section] = []
-                logger.debug("New uuids data: %s", backends_uuids)
-                TasksManager.UPDATED_UUIDS_QUEUE.put(backends_uuids)
-                logger.debug("Refreshing uuids %s", uuids_refresh)
-                eitems = refresh_identities(enrich_backend,
-                                            {"name": "author_uuid",
-                                             "value": uuids_refresh})
+        uuids_refresh = TasksManager.AUTOREFRESH_STATE.drain_uuids(self.backend_section)
+        if uuids_refresh:
+            logger.debug("Refreshing uuids %s", uuids_refresh)
+            eitems = refresh_identities(enrich_backend,
+                                        {"name": "author_uuid",
+                                         "value": uuids_refresh})
+            self._get_ingest_gate(self.conf.es_enrichment.url).wait()
+            with ES_BULK_DURATION.time(section=self.backend_section), \
+                    Tracer.span("es_bulk", section=self.backend_section):
                 enrich_backend.elastic.bulk_upload_sync(eitems, field_id)
-            else:
-                TasksManager.UPDATED_UUIDS_QUEUE.put(backends_uuids)
-        else:
-            TasksManager.UPDATED_UUIDS_QUEUE.put(backends_uuids)
-            logger.warning("No dict with uuids per backend to be refreshed")
+        TasksManager.AUTOREFRESH_STATE.autorefresh_done(self.backend_section, uuids_refresh)
 
     def __studies(self):
         logger.info("Executing %s studies ...", self.backend_section)
         enrich_backend = self._get_enrich_backend()
         do_studies(enrich_backend)
 
-    def execute(self):
+    def post_enrich(self):
+        """ Autorefresh and studies to be done once all repositories are enriched """
+        cfg = self.config.get_conf()
+
+        if 'enrich' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['enrich'] is False:
+            return
+
+        with Profiler.profile(self.backend_section, type(self).__name__), \
+                Tracer.span("post_enrich", section=self.backend_section):
+            self.__autorefresh_dirty()
+
+            if cfg.es_enrichment.studies:
+                self.__studies()
+
+    def autorefresh(self):
+        """ Refresh the enriched items of the merged identities, out of the rounds """
         cfg = self.config.get_conf()
 
         if 'enrich' in cfg[self.backend_section] and \
             cfg[self.backend_section]['enrich'] is False:
-            logger.info('%s enrich disabled', self.backend_section)
             return
 
-        self.__enrich_items()
-        if cfg['es_enrichment']['autorefresh']:
+        with Tracer.span("autorefresh", section=self.backend_section):
+            self.__autorefresh_dirty()
+
+    def __autorefresh_dirty(self):
+        if self.conf.es_enrichment.autorefresh:
             # Check it we should do the autorefresh
-            autorefresh_backends = TasksManager.AUTOREFRESH_QUEUE.get()
-            logger.debug("Checking autorefresh for %s %s", self.backend_section, autorefresh_backends)
-            if autorefresh_backends[self.backend_section]:
+            if TasksManager.AUTOREFRESH_STATE.pop_dirty(self.backend_section):
                 logger.debug("Doing autorefresh for %s", self.backend_section)
-                autorefresh_backends[self.backend_section] = False
-                TasksManager.AUTOREFRESH_QUEUE.put(autorefresh_backends)
                 self.__autorefresh()
             else:
                 logger.debug("Not doing autorefresh for %s", self.backend_section)
-                TasksManager.AUTOREFRESH_QUEUE.put(autorefresh_backends)
 
-        if cfg['es_enrichment']['studies']:
-            self.__studies()
+    def execute(self):
+        cfg = self.config.get_conf()
+
+        if 'enrich' in cfg[self.backend_section] and \
+            cfg[self.backend_section]['enrich'] is False:
+            logger.info('%s enrich disabled', self.backend_section)
+            return
+
+        if self.is_pipelined(self.config, self.backend_section):
+            logger.debug('[%s] items already enriched during collection', self.backend_section)
+        else:
+            self.__enrich_items()
+        self.post_enrich()
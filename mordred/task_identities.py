@@ -22,6 +22,7 @@
 #     Alvaro del Castillo <acs@bitergia.com>
 #
 
+import asyncio
 import base64
 import gzip
 import json
@@ -30,12 +31,10 @@ import shutil
 import subprocess
 import tempfile
 
-import requests
-
-from queue import Empty
-
+from mordred.metrics import SORTINGHAT_DURATION
 from mordred.task import Task
 from mordred.task_manager import TasksManager
+from mordred.trace import Tracer
 from sortinghat import api
 from sortinghat.cmd.init import Init
 from sortinghat.cmd.load import Load
@@ -116,6 +115,10 @@ class TaskIdentitiesLoad(Task):
 
     def execute(self):
 
+        if not self._is_leader():
+            logger.debug("[sortinghat] Identities loaded by the leader node")
+            return
+
         def is_remote(filename):
             """ Naive implementation. To be evolved """
             remote = False
@@ -126,7 +129,9 @@ class TaskIdentitiesLoad(Task):
         def load_identities_file(filename):
             """ Load an identities file in Sortinghat """
             logger.info("[sortinghat] Loading identities from file %s", filename)
-            code = Load(**self.sh_kwargs).run("--identities", filename)
+            with SORTINGHAT_DURATION.time(command='load'), \
+                    Tracer.span("sortinghat", command='load', file=filename):
+                code = Load(**self.sh_kwargs).run("--identities", filename)
             if code != CMD_SUCCESS:
                 logger.error("[sortinghat] Error loading %s", filename)
 
@@ -140,7 +145,9 @@ class TaskIdentitiesLoad(Task):
             if 'orgs_file' not in cfg['sortinghat'] or not cfg['sortinghat']['orgs_file']:
                 raise RuntimeError("Load orgs active but no orgs_file configured")
             logger.info("[sortinghat] Loading orgs from file %s", cfg['sortinghat']['orgs_file'])
-            code = Load(**self.sh_kwargs).run("--orgs", cfg['sortinghat']['orgs_file'])
+            with SORTINGHAT_DURATION.time(command='load'), \
+                    Tracer.span("sortinghat", command='load', file=cfg['sortinghat']['orgs_file']):
+                code = Load(**self.sh_kwargs).run("--orgs", cfg['sortinghat']['orgs_file'])
             if code != CMD_SUCCESS:
                 logger.error("[sortinghat] Error loading %s", cfg['sortinghat']['orgs_file'])
             #FIXME get the number of loaded orgs
@@ -152,7 +159,7 @@ class TaskIdentitiesLoad(Task):
                 if filename == '':
                     continue
                 if is_remote(filename):
-                    res_get = requests.get(filename)
+                    res_get = self.get_http_session().get(filename)
                     res_get.raise_for_status()
                     with tempfile.NamedTemporaryFile() as temp:
                         temp.write(res_get.content)
@@ -173,15 +180,30 @@ class TaskIdentitiesExport(Task):
     def is_backend_task(self):
         return False
 
-    def execute(self):
+    def __export_identities(self, filename):
+        """ Export Sortinghat identities to a gzipped file
 
-        def export_identities(filename):
-            """ Export Sortinghat identities to a file """
-            logger.info("[sortinghat] Exporting identities to %s", filename)
+        :returns: the name of the gzipped file
+        """
+        logger.info("[sortinghat] Exporting identities to %s", filename)
+        with SORTINGHAT_DURATION.time(command='export'), \
+                Tracer.span("sortinghat", command='export'):
             code = Export(**self.sh_kwargs).run("--identities", filename)
-            if code != CMD_SUCCESS:
-                logger.error("[sortinghat] Error exporting %s", filename)
-
+        if code != CMD_SUCCESS:
+            logger.error("[sortinghat] Error exporting %s", filename)
+        logger.debug("SH identities exported to tmp file: %s", filename)
+        # Compress the file with gzip
+        with open(filename, 'rb') as f_in:
+            gzipped_identities_file = filename + '.gz'
+            with gzip.open(gzipped_identities_file, 'wb') as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        return gzipped_identities_file
+
+    def __get_repository(self):
+        """ Get the GitHub repository data to upload the identities
+
+        :returns: (repository_api, repository_branch, repo_file) or None
+        """
         cfg = self.config.get_conf()
 
         if cfg['sortinghat']['identities_export_url'] is None:
@@ -191,11 +213,6 @@ class TaskIdentitiesExport(Task):
             logger.error("github_api_token for uploading data to GitHub not found in sortinghat section")
             return
 
-        repo_file_sha = None
-        gzipped_identities_file = None
-        github_token = cfg['sortinghat']['github_api_token']
-        headers = {"Authorization": "token " + github_token}
-
         repository_url = cfg['sortinghat']['identities_export_url']
         try:
             # https://github.com/<owner>/<repo>/blob/<branch>/<sh_identities>.gz
@@ -211,45 +228,81 @@ class TaskIdentitiesExport(Task):
             logger.debug(ex)
             return
 
+        return (repository_api, repository_branch, repo_file)
+
+    def __get_headers(self):
+        github_token = self.config.get_conf()['sortinghat']['github_api_token']
+        return {"Authorization": "token " + github_token}
+
+    def __get_repo_file_sha(self, repository):
+        """ Get sha for the repository_file, None if it does not exist """
+        (repository_api, repository_branch, repo_file) = repository
+        repo_file_sha = None
+
+        url_dir = repository_api + "/git/trees/"+ repository_branch
+        logger.debug("Gettting sha data from tree: %s", url_dir)
+        raw_repo_file_info = self.get_http_session().get(url_dir, headers=self.__get_headers())
+        raw_repo_file_info.raise_for_status()
+        for rfile in raw_repo_file_info.json()['tree']:
+            if rfile['path'] == repo_file:
+                logger.debug("SHA found: %s, ", rfile["sha"])
+                repo_file_sha = rfile["sha"]
+
+        if repo_file_sha is None:
+            logger.debug("Can not find sha for %s. It will be created.", repo_file)
+
+        return repo_file_sha
+
+    def __upload_identities(self, repository, gzipped_identities_file, repo_file_sha):
+        """ Upload gzipped file to repository_file """
+        (repository_api, _, repo_file) = repository
+
+        logger.debug("Encoding to base64 identities file")
+        with open(gzipped_identities_file, "rb") as raw_file:
+            base64_raw = base64.b64encode(raw_file.read())
+            # base64 is ascii encoded data
+            gzipped_base64_identities = base64_raw.decode('ascii')
+            upload_json = {
+                "content": gzipped_base64_identities,
+                "message": "mordred automatic update"
+            }
+            if repo_file_sha:
+                upload_json["sha"] = repo_file_sha
+
+            data = json.dumps(upload_json)
+            url_put = repository_api + "/contents/"+ repo_file
+            logger.debug("Uploading to GitHub %s", url_put)
+            upload_res = self.get_http_session().put(url_put, headers=self.__get_headers(), data=data)
+            upload_res.raise_for_status()
+
+    def execute(self):
+        repository = self.__get_repository()
+        if not repository:
+            return
+        if not self._is_leader():
+            logger.debug("[sortinghat] Identities exported by the leader node")
+            return
+
+        with tempfile.NamedTemporaryFile() as temp:
+            gzipped_identities_file = self.__export_identities(temp.name)
+            repo_file_sha = self.__get_repo_file_sha(repository)
+            self.__upload_identities(repository, gzipped_identities_file, repo_file_sha)
+
+    async def execute_async(self, loop, executor):
+        repository = self.__get_repository()
+        if not repository:
+            return
+        if not self._is_leader():
+            logger.debug("[sortinghat] Identities exported by the leader node")
+            return
+
         with tempfile.NamedTemporaryFile() as temp:
-            export_identities(temp.name)
-            logger.debug("SH identities exported to tmp file: %s", temp.name)
-            # Compress the file with gzip
-            with open(temp.name, 'rb') as f_in:
-                gzipped_identities_file = temp.name + '.gz'
-                with gzip.open(gzipped_identities_file, 'wb') as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-            # Get sha for the repository_file
-            url_dir = repository_api + "/git/trees/"+ repository_branch
-            logger.debug("Gettting sha data from tree: %s", url_dir)
-            raw_repo_file_info = requests.get(url_dir, headers=headers)
-            raw_repo_file_info.raise_for_status()
-            for rfile in raw_repo_file_info.json()['tree']:
-                if rfile['path'] == repo_file:
-                    logger.debug("SHA found: %s, ", rfile["sha"])
-                    repo_file_sha = rfile["sha"]
-
-            if repo_file_sha is None:
-                logger.debug("Can not find sha for %s. It will be created.", repository_url)
-
-            # Upload gzipped file to repository_file
-            logger.debug("Encoding to base64 identities file")
-            with open(gzipped_identities_file, "rb") as raw_file:
-                base64_raw = base64.b64encode(raw_file.read())
-                # base64 is ascii encoded data
-                gzipped_base64_identities = base64_raw.decode('ascii')
-                upload_json = {
-                    "content": gzipped_base64_identities,
-                    "message": "mordred automatic update"
-                }
-                if repo_file_sha:
-                    upload_json["sha"] = repo_file_sha
-
-                data = json.dumps(upload_json)
-                url_put = repository_api + "/contents/"+ repo_file
-                logger.debug("Uploading to GitHub %s", url_put)
-                upload_res = requests.put(url_put, headers=headers, data=data)
-                upload_res.raise_for_status()
+            # The sha is got from GitHub while the identities are exported
+            (gzipped_identities_file, repo_file_sha) = await asyncio.gather(
+                loop.run_in_executor(executor, self.__export_identities, temp.name),
+                loop.run_in_executor(executor, self.__get_repo_file_sha, repository))
+            await loop.run_in_executor(executor, self.__upload_identities, repository,
+                                       gzipped_identities_file, repo_file_sha)
 
 
 class TaskIdentitiesMerge(Task):
@@ -297,10 +350,12 @@ class TaskIdentitiesMerge(Task):
 
         return cmd
 
-    def __execute_sh_command(self, cmd):
+    def __execute_sh_command(self, cmd, command):
         logger.debug("Executing %s", cmd)
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        outs, errs = proc.communicate()
+        with SORTINGHAT_DURATION.time(command=command), \
+                Tracer.span("sortinghat", command=command):
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE)
+            outs, errs = proc.communicate()
         uuids = self.__get_uuids_to_refresh(outs.decode("utf8"))
         return_code = proc.returncode
         if return_code != 0:
@@ -334,24 +389,28 @@ class TaskIdentitiesMerge(Task):
     def do_affiliate(self):
         cmd = self.__build_sh_command()
         cmd += ['affiliate']
-        uuids = self.__execute_sh_command(cmd)
+        uuids = self.__execute_sh_command(cmd, 'affiliate')
         return uuids
 
     def do_autoprofile(self, sources):
         cmd = self.__build_sh_command()
         cmd += ['autoprofile'] + sources
-        self.__execute_sh_command(cmd)
+        self.__execute_sh_command(cmd, 'autoprofile')
         return None
 
     def do_unify(self, kwargs):
         cmd = self.__build_sh_command()
         cmd += ['unify', '--fast-matching', '-m', kwargs['matching']]
-        uuids = self.__execute_sh_command(cmd)
+        uuids = self.__execute_sh_command(cmd, 'unify')
         return uuids
 
     def execute(self):
         cfg = self.config.get_conf()
 
+        if not self._is_leader():
+            logger.debug("[sortinghat] Identities merged by the leader node")
+            return
+
         uuids_refresh = []
 
         if self.unify:
@@ -380,15 +439,11 @@ class TaskIdentitiesMerge(Task):
                 self.do_autoprofile(sources)
 
         # The uuids must be refreshed in all backends (data sources)
-        # Give 5s so the queue is filled and if not, continue without it
-        try:
-            autorefresh_backends_uuids = TasksManager.UPDATED_UUIDS_QUEUE.get(timeout=5)
-            for backend_section in autorefresh_backends_uuids:
-                autorefresh_backends_uuids[backend_section] += uuids_refresh
-            TasksManager.UPDATED_UUIDS_QUEUE.put(autorefresh_backends_uuids)
-            logger.debug("Autorefresh uuids queue after processing identities: %s", autorefresh_backends_uuids)
-        except Empty:
-            logger.warning("Autorefresh uuids not active because the queue for it is empty.")
+        if TasksManager.AUTOREFRESH_STATE.is_active():
+            TasksManager.AUTOREFRESH_STATE.add_uuids(uuids_refresh)
+            logger.debug("Autorefresh uuids after processing identities: %s", uuids_refresh)
+        else:
+            logger.warning("Autorefresh uuids not active because there are no backends for it.")
 
         if self.bots:
             if not 'bots_names' in cfg['sortinghat']:
@@ -414,12 +469,12 @@ class TaskIdentitiesMerge(Task):
                             api.edit_profile(self.db, uuid, **profile)
 
         # Autorefresh must be done once identities processing has finished
-        # Give 5s so the queue is filled and if not, continue without it
-        try:
-            autorefresh_backends = TasksManager.AUTOREFRESH_QUEUE.get(timeout=5)
-            for backend_section in autorefresh_backends:
-                autorefresh_backends[backend_section] = True
-            TasksManager.AUTOREFRESH_QUEUE.put(autorefresh_backends)
-            logger.debug("Autorefresh queue after processing identities: %s", autorefresh_backends)
-        except Empty:
-            logger.warning("Autorefresh not active because the queue for it is empty.")
+        if TasksManager.AUTOREFRESH_STATE.is_active():
+            TasksManager.AUTOREFRESH_STATE.mark_all_dirty()
+            logger.debug("Autorefresh active for all backends after processing identities")
+        else:
+            logger.warning("Autorefresh not active because there are no backends for it.")
+
+        if uuids_refresh:
+            # only the autorefresh is affected, the rest keeps its time
+            TasksManager.notify("identities merged", autorefresh=True)
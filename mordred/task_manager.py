@@ -28,8 +28,102 @@ import threading
 import sys
 import time
 
+from mordred.metrics import CYCLE_DURATION, TASK_DURATION, TASK_TIMEOUTS
+from mordred.profiler import Profiler
+from mordred.trace import Tracer
+
 logger = logging.getLogger(__name__)
 
+
+class AutorefreshState():
+    """
+    Backends that must be autorefreshed and uuids to be refreshed in them
+
+    All the operations are atomic and don't wait for other backends, so
+    checking if the autorefresh is needed never blocks a backend thread.
+
+    If there is a store, the pending work is persisted until the
+    autorefresh of the backend is done, so it survives a restart.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.dirty = {}  # backend_section -> autorefresh needed
+        self.uuids = {}  # backend_section -> set of uuids to refresh
+        self.store = None  # CheckpointStore in which the state is persisted
+
+    def set_store(self, store):
+        """ Persist the state in store, loading the pending work in it """
+        (dirty, uuids) = store.load_autorefresh()
+        with self.lock:
+            for backend_section in dirty:
+                self.dirty[backend_section] = self.dirty.get(backend_section, False) or \
+                    dirty[backend_section]
+            for backend_section in uuids:
+                self.uuids.setdefault(backend_section, set()).update(uuids[backend_section])
+            self.store = store
+            store.save_autorefresh(self.dirty)
+        logger.debug("Loaded autorefresh state for %s", list(dirty))
+
+    def init_backends(self, backend_sections):
+        """ Register the backend sections, keeping their pending work """
+        with self.lock:
+            for backend_section in backend_sections:
+                self.dirty.setdefault(backend_section, False)
+                self.uuids.setdefault(backend_section, set())
+
+    def is_active(self):
+        """ True if there are backends registered for autorefresh """
+        with self.lock:
+            return len(self.dirty) > 0
+
+    def add_uuids(self, uuids):
+        """ Add uuids to be refreshed in all the backends """
+        with self.lock:
+            for backend_section in self.uuids:
+                self.uuids[backend_section].update(uuids)
+            if self.store:
+                self.store.add_autorefresh_uuids(list(self.uuids), uuids)
+
+    def mark_all_dirty(self):
+        """ All the backends must do the autorefresh """
+        with self.lock:
+            for backend_section in self.dirty:
+                self.dirty[backend_section] = True
+            if self.store:
+                self.store.save_autorefresh(self.dirty)
+
+    def is_dirty(self, backend_section):
+        with self.lock:
+            return self.dirty.get(backend_section, False)
+
+    def pop_dirty(self, backend_section):
+        """ Check and clear the autorefresh flag for a backend """
+        with self.lock:
+            dirty = self.dirty.get(backend_section, False)
+            if dirty:
+                self.dirty[backend_section] = False
+            return dirty
+
+    def drain_uuids(self, backend_section):
+        """ Get and remove the uuids to be refreshed in a backend """
+        with self.lock:
+            uuids = self.uuids.get(backend_section, set())
+            self.uuids[backend_section] = set()
+            return list(uuids)
+
+    def autorefresh_done(self, backend_section, uuids):
+        """ The autorefresh of a backend with the drained uuids is done
+
+        The flag and uuids cleared in memory are cleared also in the store.
+        """
+        with self.lock:
+            if self.store:
+                self.store.save_autorefresh({backend_section: self.dirty.get(backend_section, False)})
+                self.store.remove_autorefresh_uuids(backend_section, uuids)
+
+
 class TasksManager(threading.Thread):
     """
     Class to manage tasks execution
@@ -41,16 +135,21 @@ class TasksManager(threading.Thread):
 
     # this queue supports the communication from threads to mother process
     COMM_QUEUE = queue.Queue()
-    # data sources that need a autorefresh execution
-    AUTOREFRESH_QUEUE = queue.Queue()
-    # uuids that must be refreshed in enriched data
-    UPDATED_UUIDS_QUEUE = queue.Queue()
+    # data sources that need a autorefresh execution and uuids to refresh
+    AUTOREFRESH_STATE = AutorefreshState()
+
+    # task managers (and schedulers) to be woken up when something changes
+    listeners = []
+    listeners_lock = threading.Lock()
 
-    def __init__(self, tasks_cls, backend_section, stopper, config, timer = 0):
+    def __init__(self, tasks_cls, backend_section, stopper, config, timer = 0,
+                 trace_parent=None, task_timeout=0):
         """
         :tasks_cls : tasks classes to be executed using the backend
         :backend_section: perceval backend section name
         :config: config object for the manager
+        :trace_parent: span of the cycle the manager is part of
+        :task_timeout: seconds executing a task before abandoning it, 0 no limit
         """
         super().__init__()  # init the Thread
         self.config = config
@@ -59,10 +158,119 @@ class TasksManager(threading.Thread):
         self.backend_section = backend_section
         self.stopper = stopper  # To stop the thread from parent
         self.timer = timer
+        self.wakeup_event = threading.Event()  # To run before the timer expires
+        self.wakeup_lock = threading.Lock()
+        self.autorefresh_only = False  # woken up just to do the autorefresh
+        self.trace_parent = trace_parent
+        self.task_timeout = task_timeout
+        self.abandoned_tasks = {}  # task -> thread still executing it after its timeout
+
+    @classmethod
+    def add_listener(cls, listener):
+        with cls.listeners_lock:
+            cls.listeners.append(listener)
+
+    @classmethod
+    def remove_listener(cls, listener):
+        with cls.listeners_lock:
+            cls.listeners.remove(listener)
+
+    @classmethod
+    def notify(cls, reason, global_tasks=False, repos_diff=None, autorefresh=False):
+        """ Wake up the listeners waiting for their next execution
+
+        Used when there is new work to be done: projects changed,
+        identities merged or an operator request.
+
+        :param reason: what triggered the wake up, for logging
+        :param global_tasks: wake up also the managers of global tasks
+        :param repos_diff: ReposDiff with the repositories changed in the
+                           projects, only their backends are woken up
+        :param autorefresh: only the autorefresh of the enriched items is
+                            executed, the rest of the work keeps its time
+        """
+        logger.debug("Waking up task managers: %s", reason)
+        with cls.listeners_lock:
+            for listener in cls.listeners:
+                listener.wakeup(reason, global_tasks, repos_diff, autorefresh)
+
+    def wakeup(self, reason, global_tasks=False, repos_diff=None, autorefresh=False):
+        if repos_diff is not None and self.backend_section and \
+                not repos_diff.is_changed(self.backend_section):
+            return
+        if autorefresh and not self.backend_section:
+            return
+        if self.backend_section or global_tasks:
+            logger.debug("Task Manager %s woken up: %s", self.backend_section, reason)
+            with self.wakeup_lock:
+                # a full execution already pending does the autorefresh too
+                self.autorefresh_only = autorefresh and \
+                    (self.autorefresh_only or not self.wakeup_event.is_set())
+                self.wakeup_event.set()
 
     def add_task(self, task):
         self.tasks.append(task)
 
+    def __run_task(self, task, section):
+        task_name = type(task).__name__
+        with TASK_DURATION.time(section=section, task=task_name), \
+                Profiler.profile(self.backend_section, task_name), \
+                Tracer.span(task_name, section=section):
+            task.execute()
+
+    def __execute_task(self, task, section):
+        """ Execute a task, abandoning it if it exceeds the task_timeout
+
+        An abandoned task keeps running in its own thread (threads can not
+        be killed) but the manager goes on with the next tasks. It is not
+        executed again until that thread finishes.
+        """
+        timeout = self.task_timeout
+        if timeout <= 0:
+            self.__run_task(task, section)
+            return
+
+        task_name = type(task).__name__
+        if task in self.abandoned_tasks:
+            if self.abandoned_tasks[task].is_alive():
+                logger.warning("[%s] %s abandoned before is still running, skipping it",
+                               section, task_name)
+                return
+            del self.abandoned_tasks[task]
+
+        errors = []
+        trace_parent = Tracer.current()
+
+        def execute():
+            with Tracer.attach(trace_parent):
+                try:
+                    self.__run_task(task, section)
+                except Exception as ex:
+                    errors.append(ex)
+
+        thread = threading.Thread(target=execute, name="%s-%s" % (section, task_name),
+                                  daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            TASK_TIMEOUTS.inc(section=section, task=task_name)
+            logger.error("[%s] %s abandoned after %i s", section, task_name, timeout)
+            self.abandoned_tasks[task] = thread
+            return
+        if errors:
+            raise errors[0]
+
+    def __autorefresh(self, section):
+        """ Execute the autorefresh of the tasks doing it """
+        for task in self.tasks:
+            if not hasattr(task, 'autorefresh'):
+                continue
+            logger.debug("Executing autorefresh of task %s", task)
+            try:
+                task.autorefresh()
+            except Exception as ex:
+                logger.error("Exception in Task Manager %s autorefresh %s", section, ex)
+
     def run(self):
         logger.debug('Starting Task Manager thread %s', self.backend_section)
 
@@ -78,22 +286,40 @@ class TasksManager(threading.Thread):
             logger.debug('Task Manager thread %s without tasks', self.backend_section)
 
         logger.debug('run(tasks) - run(%s)', self.tasks)
-        while not self.stopper.is_set():
-            # we give 1 extra second to the stopper, so this loop does
-            # not finish before it is set.
-            time.sleep(1)
-
-            if self.timer > 0:
-                logger.debug("Sleeping in Task Manager %s s", self.timer)
-                time.sleep(self.timer)
-
-            for task in self.tasks:
-                logger.debug("Executing task %s", task)
-                try:
-                    task.execute()
-                except Exception as ex:
-                    logger.error("Exception in Task Manager %s", ex)
-                    raise
-                    TasksManager.COMM_QUEUE.put(sys.exc_info())
+        section = self.backend_section if self.backend_section else "global"
+        TasksManager.add_listener(self)
+        try:
+            next_cycle = time.time() + 1 + self.timer
+            while not self.stopper.is_set():
+                if self.timer > 0:
+                    # Wait for the timer or for a wake up, whatever comes first
+                    logger.debug("Sleeping in Task Manager %s s", self.timer)
+                    self.wakeup_event.wait(max(0, next_cycle - time.time()))
+                    with self.wakeup_lock:
+                        self.wakeup_event.clear()
+                        autorefresh_only = self.autorefresh_only and time.time() < next_cycle
+                        self.autorefresh_only = False
+                    if autorefresh_only:
+                        # the next execution keeps its time
+                        self.__autorefresh(section)
+                        continue
+                else:
+                    # we give 1 extra second to the stopper, so this loop does
+                    # not finish before it is set.
+                    time.sleep(1)
 
+                cycle_start = time.time()
+                with Tracer.span("tasks_manager", parent=self.trace_parent, section=section):
+                    for task in self.tasks:
+                        logger.debug("Executing task %s", task)
+                        try:
+                            self.__execute_task(task, section)
+                        except Exception as ex:
+                            logger.error("Exception in Task Manager %s", ex)
+                            raise
+                            TasksManager.COMM_QUEUE.put(sys.exc_info())
+                CYCLE_DURATION.observe(time.time() - cycle_start, section=section)
+                next_cycle = time.time() + 1 + self.timer
+        finally:
+            TasksManager.remove_listener(self)
         logger.debug('Exiting Task Manager thread %s', self.backend_section)
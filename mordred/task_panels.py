@@ -22,6 +22,7 @@
 #     Alvaro del Castillo <acs@bitergia.com>
 #
 
+import asyncio
 import json
 import logging
 import requests
@@ -65,7 +66,7 @@ class TaskPanels(Task):
         config_url = '/.kibana/config/_search'
         es_url = self.conf['es_enrichment']['url']
         url = urljoin(es_url + "/", config_url)
-        r = requests.get(url)
+        r = self.get_http_session().get(url)
         r.raise_for_status()
         return r.json()['hits']['hits'][0]['_id']
 
@@ -90,7 +91,7 @@ class TaskPanels(Task):
 
         es_url = self.conf['es_enrichment']['url']
         url = urljoin(es_url + "/", config_url)
-        r = requests.post(url, data=json.dumps(kibiter_config))
+        r = self.get_http_session().post(url, data=json.dumps(kibiter_config))
         r.raise_for_status()
 
     def __create_dashboard(self, panel_file):
@@ -103,18 +104,29 @@ class TaskPanels(Task):
             logger.info("Creating the panel: %s", dash_id)
             import_dashboard(es_enrich, panel_file)
 
+    def __get_panel_files(self):
+        # The commons panels
+        panel_files = list(self.panels_common)
+        # The panels which uses the aliases as data source
+        if self.backend_section in self.panels:
+            panel_files += self.panels[self.get_backend(self.backend_section)]
+        else:
+            logger.warning("No panels found for %s", self.backend_section)
+        return panel_files
+
     def execute(self):
         # Configure kibiter
         self.__configure_kibiter()
-        # Create the commons panels
-        for panel_file in self.panels_common:
+        # Create the panels
+        for panel_file in self.__get_panel_files():
             self.__create_dashboard(panel_file)
-        # Create the panels which uses the aliases as data source
-        if self.backend_section in self.panels:
-            for panel_file in self.panels[self.get_backend(self.backend_section)]:
-                self.__create_dashboard(panel_file)
-        else:
-            logger.warning("No panels found for %s", self.backend_section)
+
+    async def execute_async(self, loop, executor):
+        # Kibiter and all the panels are configured at the same time
+        calls = [loop.run_in_executor(executor, self.__configure_kibiter)]
+        calls += [loop.run_in_executor(executor, self.__create_dashboard, panel_file)
+                  for panel_file in self.__get_panel_files()]
+        await asyncio.gather(*calls)
 
 class TaskPanelsAliases(Task):
     """ Create the aliases needed for the panels """
@@ -172,7 +184,7 @@ class TaskPanelsAliases(Task):
         exists = False
 
         alias_url = urljoin(es_url+"/", "_alias/"+alias)
-        r = requests.get(alias_url)
+        r = self.get_http_session().get(alias_url)
         if r.status_code == 200:
             # The alias exists
             exists = True
@@ -180,7 +192,7 @@ class TaskPanelsAliases(Task):
 
     def __remove_alias(self, es_url, alias):
         alias_url = urljoin(es_url+"/", "_alias/"+alias)
-        r = requests.get(alias_url)
+        r = self.get_http_session().get(alias_url)
         if r.status_code == 200:
             real_index = list(r.json())[0]
             logger.debug("Removing alias %s to %s", alias, real_index)
@@ -193,7 +205,7 @@ class TaskPanelsAliases(Task):
                ]
              }
             """ % (real_index, alias)
-            r = requests.post(aliases_url, data=action)
+            r = self.get_http_session().post(aliases_url, data=action)
             r.raise_for_status()
 
     def __create_alias(self, es_url, es_index, alias):
@@ -212,7 +224,7 @@ class TaskPanelsAliases(Task):
         """ % (es_index, alias)
 
         logger.debug("%s %s", alias_url, action)
-        r = requests.post(alias_url, data=action)
+        r = self.get_http_session().post(alias_url, data=action)
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError:
@@ -223,8 +235,12 @@ class TaskPanelsAliases(Task):
             else:
                 raise
 
-    def __create_aliases(self):
-        """ Create aliases in ElasticSearch used by the panels """
+    def __get_aliases(self):
+        """ Get the aliases in ElasticSearch used by the panels
+
+        :returns: list of (es_url, es_index, alias) to be created
+        """
+        aliases = []
         real_alias = self.backend_section.replace(":","_")  # remo:activities -> remo_activities
         es_col_url = self._get_collection_url()
         es_enrich_url = self.conf['es_enrichment']['url']
@@ -235,22 +251,29 @@ class TaskPanelsAliases(Task):
         if self.backend_section in self.aliases and \
             'raw' in self.aliases[self.backend_section]:
             for alias in self.aliases[self.backend_section]['raw']:
-                self.__create_alias(es_col_url, index_raw, alias)
+                aliases.append((es_col_url, index_raw, alias))
         else:
             # Standard alias for the raw index
-            self.__create_alias(es_col_url, index_raw, real_alias + "-raw")
+            aliases.append((es_col_url, index_raw, real_alias + "-raw"))
 
         if self.backend_section in self.aliases and \
             'enrich' in self.aliases[self.backend_section]:
             for alias in self.aliases[self.backend_section]['enrich']:
-                self.__create_alias(es_enrich_url, index_enrich, alias)
+                aliases.append((es_enrich_url, index_enrich, alias))
         else:
             # Standard alias for the enrich index
-            self.__create_alias(es_enrich_url, index_enrich, real_alias)
+            aliases.append((es_enrich_url, index_enrich, real_alias))
+
+        return aliases
 
     def execute(self):
         # Create the aliases
-        self.__create_aliases()
+        for (es_url, es_index, alias) in self.__get_aliases():
+            self.__create_alias(es_url, es_index, alias)
+
+    async def execute_async(self, loop, executor):
+        await asyncio.gather(*[loop.run_in_executor(executor, self.__create_alias, *alias)
+                               for alias in self.__get_aliases()])
 
 
 
@@ -294,7 +317,7 @@ class TaskPanelsMenu(Task):
         logger.info("Adding dashboard menu definition")
         menu_url = urljoin(self.conf['es_enrichment']['url'] + "/", ".kibana/metadashboard/main")
         # r = requests.post(menu_url, data=json.dumps(dash_menu, sort_keys=True))
-        r = requests.post(menu_url, data=json.dumps(dash_menu))
+        r = self.get_http_session().post(menu_url, data=json.dumps(dash_menu))
         try:
             r.raise_for_status()
         except requests.exceptions.HTTPError:
@@ -305,7 +328,7 @@ class TaskPanelsMenu(Task):
         """ The dashboard must be removed before creating a new one """
         logger.info("Remove dashboard menu definition")
         menu_url = urljoin(self.conf['es_enrichment']['url'] + "/" , ".kibana/metadashboard/main")
-        requests.delete(menu_url)
+        self.get_http_session().delete(menu_url)
 
     def __get_menu_entries(self):
         """ Get the menu entries from the panel definition """
@@ -26,66 +26,211 @@ import logging
 import shutil
 
 from threading import Lock
-from os import path
-
-import requests
-
-from copy import deepcopy
+from os import path, replace, sep
 
 from mordred.config import Config
+from mordred.http import HttpSession
+from mordred.projects_loader import (compact, get_files_digest, get_files_state,
+                                     get_projects_files, load_projects, normalize_repo)
+from mordred.repos_stats import ReposStats
 from mordred.task import Task
+from mordred.task_manager import TasksManager
 from VizGrimoireUtils.eclipse.eclipse_projects_lib import get_repos_list_project, get_mls_repos
 
 
 
 logger = logging.getLogger(__name__)
 
+# file with all the projects of a directory of projects files
+MERGED_PROJECTS_SUFFIX = ".merged.json"
+# file with the last Eclipse projects downloaded and converted
+ECLIPSE_CACHE_SUFFIX = ".eclipse-cache.json"
+
+
+class ProjectsSnapshot():
+    """ Immutable version of the projects data
+
+    The projects and their data are read only mappings and the lists of
+    repositories are tuples (see projects_loader.compact), so the snapshot
+    is shared by all the readers without copying it. A new load of the
+    projects creates a new snapshot with the next version.
+
+    The snapshot also indexes the repositories by backend, with the
+    global project rule already applied, so the lookups don't scan all
+    the projects. The same repository listed in several projects is
+    indexed once. The projects of each repository are indexed only to
+    find the repositories moved between projects (see ReposDiff): the
+    project of the enriched items is still resolved by grimoire_elk from
+    the projects file, matching the repositories as they are written.
+    So a repository written in a different way (see
+    projects_loader.normalize_repo) is not merged with the other
+    listings, it is just reported to fix the projects file.
+    """
+
+    GLOBAL_PROJECT = 'unknown'  # project to download and enrich full sites
+
+    def __init__(self, projects, version):
+        """
+        :param projects: projects data dict, it is not changed
+        :param version: number of the load of the projects
+        """
+        self.projects = compact(projects)
+        self.version = version
+        self.repos = {}  # backend -> tuple of repositories
+        self.repo_projects = {}  # backend -> repository -> frozenset of projects
+        self.__build_index()
+
+    def __build_index(self):
+        global_sources = Config.get_global_data_sources()
+        has_global = self.GLOBAL_PROJECT in self.projects
+        repos = {}
+        repo_projects = {}
+        for (pro, pdata) in self.projects.items():
+            for (backend, backend_repos) in pdata.items():
+                if not isinstance(backend_repos, tuple):
+                    continue  # not a list of repositories, like meta
+                projects_by_repo = repo_projects.setdefault(backend, {})
+                for repo in backend_repos:
+                    projects_by_repo.setdefault(repo, set()).add(pro)
+                if backend in global_sources and has_global and pro != self.GLOBAL_PROJECT:
+                    logger.debug("Skip global data source %s for project %s", backend, pro)
+                    continue
+                # dicts keep the order of the repositories without duplicates
+                repos.setdefault(backend, {}).update(dict.fromkeys(backend_repos))
+        self.repos = {backend: tuple(brepos) for (backend, brepos) in repos.items()}
+        self.repo_projects = {backend: {repo: frozenset(pros) for (repo, pros) in brepos.items()}
+                              for (backend, brepos) in repo_projects.items()}
+        self.__report_variants()
+
+    def __report_variants(self):
+        """ Warn about the repositories written in different ways """
+        for (backend, brepos) in self.repos.items():
+            keys = {}
+            for repo in brepos:
+                first = keys.setdefault(normalize_repo(repo), repo)
+                if first != repo:
+                    logger.warning("[%s] %s is processed apart from %s, write it the same "
+                                   "way in all the projects", backend, repo, first)
+
+    def get_repos(self, backend):
+        """ Repositories of a backend, without duplicates """
+        return self.repos.get(backend, ())
+
+
+class ReposDiff():
+    """ Repositories added, removed and moved between two projects snapshots
+
+    A repository is moved when it is in both snapshots for a backend but
+    in different projects, so its items must be enriched again.
+    """
+
+    def __init__(self, old_snapshot, new_snapshot):
+        self.added = {}  # backend -> tuple of repositories
+        self.removed = {}
+        self.moved = {}
+        for backend in set(old_snapshot.repos) | set(new_snapshot.repos):
+            old_repos = old_snapshot.get_repos(backend)
+            new_repos = new_snapshot.get_repos(backend)
+            old_set = set(old_repos)
+            new_set = set(new_repos)
+            old_projects = old_snapshot.repo_projects.get(backend, {})
+            new_projects = new_snapshot.repo_projects.get(backend, {})
+            added = tuple(repo for repo in new_repos if repo not in old_set)
+            removed = tuple(repo for repo in old_repos if repo not in new_set)
+            moved = tuple(repo for repo in new_repos if repo in old_set and
+                          old_projects[repo] != new_projects[repo])
+            for (repos, changed) in ((self.added, added), (self.removed, removed),
+                                     (self.moved, moved)):
+                if changed:
+                    repos[backend] = changed
+
+    def get_added(self, backend_section):
+        return self.added.get(Task.get_backend(backend_section), ())
+
+    def get_removed(self, backend_section):
+        return self.removed.get(Task.get_backend(backend_section), ())
+
+    def get_moved(self, backend_section):
+        return self.moved.get(Task.get_backend(backend_section), ())
+
+    def is_changed(self, backend_section):
+        backend = Task.get_backend(backend_section)
+        return backend in self.added or backend in self.removed or backend in self.moved
+
+    def __bool__(self):
+        return bool(self.added or self.removed or self.moved)
+
+    def __repr__(self):
+        return "ReposDiff(added=%s, removed=%s, moved=%s)" % (self.added, self.removed,
+                                                              self.moved)
+
+
 class TaskProjects(Task):
     """ Task to manage the projects config """
 
-    GLOBAL_PROJECT = 'unknown'  # project to download and enrich full sites
-    __projects = {}  # static projects data dict
+    GLOBAL_PROJECT = ProjectsSnapshot.GLOBAL_PROJECT
+    __snapshot = ProjectsSnapshot({}, 0)  # current projects data
     projects_last_diff = []  # Projects changed in last update
+    repos_last_diff = None  # ReposDiff of the last update
     projects_lock = Lock()
+    __file_state = None  # (path, mtimes, digest) of the last projects files loaded
 
     def is_backend_task(self):
         return False
 
+    @classmethod
+    def get_snapshot(cls):
+        """ Current projects snapshot, the same until the projects change """
+        return cls.__snapshot
+
     @classmethod
     def get_projects(cls):
-        with cls.projects_lock:
-            # Return a deepcopy so it is not changed
-            return deepcopy(cls.__projects)
+        """ Read only projects data of the current snapshot """
+        return cls.__snapshot.projects
 
     @classmethod
     def set_projects(cls, projects):
         with cls.projects_lock:
-            old_projects_set = set(cls.__projects.keys())
+            old_snapshot = cls.__snapshot
+            first_load = not old_snapshot.projects
+            old_projects_set = set(old_snapshot.projects.keys())
             new_projects_set = set(projects.keys())
             cls.projects_last_diff = list(old_projects_set ^ new_projects_set)
             logger.debug("Update project diff %s", cls.projects_last_diff)
-            cls.__projects = projects
+            # readers get the old or the new snapshot, never a partial one
+            cls.__snapshot = ProjectsSnapshot(projects, old_snapshot.version + 1)
+            cls.repos_last_diff = ReposDiff(old_snapshot, cls.__snapshot)
+            # the projects don't come from the last file loaded anymore
+            cls.__file_state = None
+            logger.debug("Update repos diff %s", cls.repos_last_diff)
+
+        if cls.repos_last_diff and not first_load:
+            cls.__forget_repos(cls.repos_last_diff)
+            # New repositories must be collected as soon as possible
+            TasksManager.notify("projects changed", repos_diff=cls.repos_last_diff)
+
+    @classmethod
+    def __forget_repos(cls, repos_diff):
+        """ Removed repositories are processed as new ones if they come back
+        and the moved ones must be enriched again with their new projects """
+        for backend_section in Config.get_backend_sections():
+            for repo in repos_diff.get_removed(backend_section):
+                ReposStats.forget(backend_section, repo)
+            for repo in repos_diff.get_moved(backend_section):
+                ReposStats.forget(backend_section, repo, ['enrichment'])
 
     @classmethod
     def get_projects_last_diff(cls):
         return cls.projects_last_diff
 
     @classmethod
-    def get_repos_by_backend_section(cls, backend_section):
-        """ return list with the repositories for a backend_section """
-        repos = []
-        backend = Task.get_backend(backend_section)
-
-        projects = TaskProjects.get_projects()
+    def get_repos_last_diff(cls):
+        return cls.repos_last_diff
 
-        for pro in projects:
-            if backend in projects[pro]:
-                if backend in Config.get_global_data_sources() \
-                    and cls.GLOBAL_PROJECT in projects and pro != cls.GLOBAL_PROJECT:
-                    logger.debug("Skip global data source %s for project %s",
-                                 backend, pro)
-                else:
-                    repos += projects[pro][backend]
+    @classmethod
+    def get_repos_by_backend_section(cls, backend_section):
+        """ return tuple with the repositories for a backend_section """
+        repos = cls.__snapshot.get_repos(Task.get_backend(backend_section))
 
         logger.debug("List of repos for %s: %s", backend_section, repos)
 
@@ -98,30 +243,130 @@ class TaskProjects(Task):
         if config['projects']['load_eclipse']:
             self.__get_eclipse_projects()
 
-        logger.info("Reading projects data from  %s ", projects_file)
-        with open(projects_file, 'r') as fprojects:
-            projects = json.load(fprojects)
-        TaskProjects.set_projects(projects)
+        # The projects are reloaded only if the files changed
+        files = get_projects_files(projects_file)
+        files_state = get_files_state(files)
+        state = TaskProjects.__file_state
+        if state and state[:2] == (projects_file, files_state):
+            logger.debug("Projects file %s not modified", projects_file)
+            return
+
+        digest = get_files_digest(files)
+        if state and state[::2] == (projects_file, digest):
+            logger.debug("Projects file %s touched without changes", projects_file)
+        else:
+            logger.info("Reading projects data from  %s ", projects_file)
+            TaskProjects.set_projects(load_projects(projects_file))
+            if path.isdir(projects_file):
+                self.__write_merged_projects(projects_file)
+        TaskProjects.__file_state = (projects_file, files_state, digest)
+
+    @classmethod
+    def get_projects_file(cls, projects_file):
+        """ JSON file with all the projects, for the enrichment
+
+        The projects file itself or, for a directory of projects files,
+        the file with all of them written next to it.
+        """
+        if path.isdir(projects_file):
+            return projects_file.rstrip(sep) + MERGED_PROJECTS_SUFFIX
+        return projects_file
+
+    def __write_merged_projects(self, projects_dir):
+        merged_file = self.get_projects_file(projects_dir)
+        logger.debug("Writing all the projects to %s", merged_file)
+        # the enrichment in other processes never reads a partial file
+        with open(merged_file + ".tmp", "w") as fprojects:
+            json.dump(TaskProjects.get_projects(), fprojects, default=dict)
+        replace(merged_file + ".tmp", merged_file)
 
     def __get_eclipse_projects(self):
+        """ Update the projects file with the Eclipse projects
+
+        The Eclipse projects and their conversion are cached next to the
+        projects file: the download is conditional (ETag and Last-Modified),
+        only the projects changed are converted again and the projects file
+        is written only if its content changes.
+        """
         config = self.conf
         projects_file = config['projects']['projects_file']
+        cache_file = projects_file + ECLIPSE_CACHE_SUFFIX
 
         eclipse_projects_url = 'http://projects.eclipse.org/json/projects/all'
         # For debugging with a Eclipse local file
         eclipse_projects_file = 'VizGrimoireUtils/eclipse/http:__projects.eclipse.org_json_projects_all.json'
 
+        cache = {"etag": None, "last_modified": None, "eclipse": {}, "projects": {}}
+        if path.isfile(cache_file):
+            with open(cache_file) as fcache:
+                cache = json.load(fcache)
+
+        headers = {}
+        if cache['etag']:
+            headers['If-None-Match'] = cache['etag']
+        if cache['last_modified']:
+            headers['If-Modified-Since'] = cache['last_modified']
+
         logger.info("Getting Eclipse projects (1 min) from  %s ", eclipse_projects_url)
-        eclipse_projects_resp = requests.get(eclipse_projects_url)
-        eclipse_projects = eclipse_projects_resp.json()['projects']
-        projects = self.convert_from_eclipse(eclipse_projects)
+        eclipse_projects_resp = HttpSession.get().get(eclipse_projects_url, headers=headers)
+        if eclipse_projects_resp.status_code == 304:
+            logger.info("Eclipse projects not modified since the last download")
+        else:
+            eclipse_projects_resp.raise_for_status()
+            eclipse_projects = eclipse_projects_resp.json()['projects']
+            cache = {
+                "etag": eclipse_projects_resp.headers.get('ETag'),
+                "last_modified": eclipse_projects_resp.headers.get('Last-Modified'),
+                "eclipse": eclipse_projects,
+                "projects": self.__convert_changed_eclipse(eclipse_projects, cache)
+            }
+            with open(cache_file + ".tmp", "w") as fcache:
+                json.dump(cache, fcache)
+            replace(cache_file + ".tmp", cache_file)
+
+        # the global project and the converted ones
+        projects = self.convert_from_eclipse({})
+        projects.update(cache['projects'])
+        projects_data = json.dumps(projects, indent=True)
+        if path.isfile(projects_file):
+            with open(projects_file) as fprojects:
+                if fprojects.read() == projects_data:
+                    logger.info("Eclipse projects not changed in %s ", projects_file)
+                    return
 
         # Create a backup file for current projects_file
         if path.isfile(projects_file):
             shutil.copyfile(projects_file, projects_file + ".bak")
         logger.info("Writing Eclipse projects to %s ", projects_file)
         with open(projects_file, "w") as fprojects:
-            json.dump(projects, fprojects, indent=True)
+            fprojects.write(projects_data)
+
+    def __convert_changed_eclipse(self, eclipse_projects, cache):
+        """ Convert the Eclipse projects changed since the ones in cache """
+        projects = {}
+        converted = 0
+        for project in eclipse_projects:
+            if project in cache['projects'] and \
+                    cache['eclipse'].get(project) == eclipse_projects[project]:
+                projects[project] = cache['projects'][project]
+            else:
+                projects[project] = self.__convert_eclipse_project(project, eclipse_projects)
+                converted += 1
+        logger.info("Converted %i changed Eclipse projects of %i", converted, len(projects))
+        return projects
+
+    def __convert_eclipse_project(self, project, eclipse_projects):
+        pdata = {}
+        pdata["meta"] = {
+            "title": eclipse_projects[project]["title"]
+        }
+        pdata["git"] = get_repos_list_project(project, eclipse_projects, "scm")
+        pdata["bugzilla"] = get_repos_list_project(project, eclipse_projects, "its")
+        pdata["mailing_lists"] = get_mls_repos(eclipse_projects[project], True)
+        pdata["mbox"] = self.__convert_eclipse_mls(pdata["mailing_lists"])
+        pdata["gerrit"] = get_repos_list_project(project, eclipse_projects, "scr", 'git.eclipse.org')
+        # pdata["irc"] = get_repos_list_project(project, eclipse_projects, "irc")
+        return pdata
 
     def __convert_eclipse_mls(self, mls_data):
         """ We need to convert:
@@ -166,16 +411,6 @@ class TaskProjects(Task):
         }
 
         for project in eclipse_projects:
-            projects[project] = {}
-            pdata = projects[project]
-            pdata["meta"] = {
-                "title": eclipse_projects[project]["title"]
-            }
-            pdata["git"] = get_repos_list_project(project, eclipse_projects, "scm")
-            pdata["bugzilla"] = get_repos_list_project(project, eclipse_projects, "its")
-            pdata["mailing_lists"] = get_mls_repos(eclipse_projects[project], True)
-            pdata["mbox"] = self.__convert_eclipse_mls(pdata["mailing_lists"])
-            pdata["gerrit"] = get_repos_list_project(project, eclipse_projects, "scr", 'git.eclipse.org')
-            # pdata["irc"] = get_repos_list_project(project, eclipse_projects, "irc")
+            projects[project] = self.__convert_eclipse_project(project, eclipse_projects)
 
         return projects
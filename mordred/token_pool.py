@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import hashlib
+import logging
+import threading
+import time
+
+from mordred.http import HttpSession
+from mordred.metrics import GITHUB_TOKEN_REMAINING
+
+logger = logging.getLogger(__name__)
+
+GITHUB_RATE_LIMIT_URL = "https://api.github.com/rate_limit"
+GITHUB_RATE_LIMIT = 5000  # requests per hour for an authenticated token
+# seconds before checking again the quota of a token in use
+RATE_LIMIT_CHECK_INTERVAL = 60
+
+
+class TokenPool():
+    """ GitHub API tokens with their remaining quota
+
+    The repositories are processed with the token with more remaining
+    requests for each repository using it, so the work is spread between
+    the tokens according to their budget. When all of them are exhausted,
+    the work waits for the first reset instead of sleeping inside perceval
+    with a single token.
+
+    The quota of each token is checked in the rate_limit endpoint of the
+    GitHub API, which doesn't consume it. The pools are shared by all the
+    tasks using the same tokens, the quotas are exposed for each backend
+    section using them.
+    """
+
+    __pools = {}  # tuple of tokens -> pool
+    __pools_lock = threading.Lock()
+
+    def __init__(self, tokens):
+        self.tokens = {}  # token -> quota and number of repositories using it
+        for token in tokens:
+            self.tokens[token] = {
+                "remaining": None,  # unknown
+                "reset": 0,  # epoch when the quota is restored
+                "checked": 0,  # epoch of the last quota check
+                "in_use": 0
+            }
+        self.sections = set()  # backend sections using the pool
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_pool(cls, tokens, backend_section=None):
+        """ Get the pool shared by all the users of tokens
+
+        :param backend_section: section using the pool, for the metrics
+        """
+        key = tuple(sorted(tokens))
+        with cls.__pools_lock:
+            if key not in cls.__pools:
+                cls.__pools[key] = TokenPool(key)
+            pool = cls.__pools[key]
+        if backend_section:
+            with pool.lock:
+                pool.sections.add(backend_section)
+        return pool
+
+    @staticmethod
+    def get_fingerprint(token):
+        """ Stable name of a token in the metrics and logs, without revealing it """
+        return hashlib.sha256(token.encode('utf-8')).hexdigest()[:8]
+
+    def fetch_rate_limit(self, token):
+        """ Get the quota of a token from GitHub
+
+        :returns: remaining requests and epoch when the quota is restored
+        """
+        headers = {"Authorization": "token " + token}
+        r = HttpSession.get().get(GITHUB_RATE_LIMIT_URL, headers=headers)
+        r.raise_for_status()
+        core = r.json()['resources']['core']
+        return core['remaining'], core['reset']
+
+    def update(self, token, remaining, reset):
+        """ Update the quota of a token """
+        with self.lock:
+            self.tokens[token].update({
+                "remaining": remaining,
+                "reset": reset,
+                "checked": time.time()
+            })
+            sections = list(self.sections)
+        fingerprint = self.get_fingerprint(token)
+        for section in sections:
+            GITHUB_TOKEN_REMAINING.set(remaining, section=section, token=fingerprint)
+
+    def __check_quotas(self):
+        """ Check the quota of the tokens not checked recently """
+        now = time.time()
+        with self.lock:
+            tokens = [token for (token, quota) in self.tokens.items()
+                      if quota['remaining'] is None or quota['reset'] <= now or
+                      (quota['in_use'] and quota['checked'] + RATE_LIMIT_CHECK_INTERVAL <= now)]
+        for token in tokens:
+            try:
+                (remaining, reset) = self.fetch_rate_limit(token)
+            except Exception as ex:
+                # assume a full quota and don't check it again for a while
+                logger.warning("Can not get the GitHub rate limit of a token: %s", ex)
+                (remaining, reset) = (GITHUB_RATE_LIMIT, now + RATE_LIMIT_CHECK_INTERVAL)
+            self.update(token, remaining, reset)
+
+    def __pick(self):
+        """ Token with more remaining requests for each repository using it """
+        best = None
+        best_budget = 0
+        for (token, quota) in self.tokens.items():
+            remaining = GITHUB_RATE_LIMIT if quota['remaining'] is None else quota['remaining']
+            budget = remaining / (quota['in_use'] + 1)
+            if budget > best_budget:
+                (best, best_budget) = (token, budget)
+        return best
+
+    def acquire(self):
+        """ Get a token with quota, waiting for a reset if all are exhausted """
+        while True:
+            self.__check_quotas()
+            with self.lock:
+                token = self.__pick()
+                if token:
+                    self.tokens[token]['in_use'] += 1
+                    return token
+                wait = min(quota['reset'] for quota in self.tokens.values()) - time.time()
+            wait = max(1, wait)
+            logger.warning("All the GitHub tokens are exhausted, waiting %i s for a reset", wait)
+            time.sleep(wait)
+
+    def release(self, token):
+        with self.lock:
+            self.tokens[token]['in_use'] -= 1
+
+    def token(self):
+        """ Context manager with a token acquired for its block """
+        return _Token(self)
+
+    def best_token(self):
+        """ Token with more quota, without acquiring it """
+        self.__check_quotas()
+        with self.lock:
+            token = self.__pick()
+        return token if token else list(self.tokens)[0]
+
+
+class _Token():
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def __enter__(self):
+        self.token = self.pool.acquire()
+        return self.token
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.token)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+
+import json
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Span():
+    """ Timed operation inside a trace """
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else "%032x" % random.getrandbits(128)
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = attributes if attributes else {}
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def to_otlp(self):
+        """ The span in OTLP JSON format """
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(int(self.start * 1e9)),
+            "endTimeUnixNano": str(int(self.end * 1e9)),
+            "attributes": [{"key": key, "value": {"stringValue": str(value)}}
+                           for (key, value) in sorted(self.attributes.items())],
+            "status": {"code": 2, "message": self.error} if self.error else {}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Tracer():
+    """ Hierarchical spans of the work done by Mordred
+
+    The spans of a thread are nested: cycle, task manager, task, repository
+    and the calls to ElasticSearch or SortingHat. The work done in other
+    threads for a span (i.e. in a pool of workers) gets it with attach.
+
+    The finished spans are appended to trace_file, one OTLP JSON export
+    request per line, the format of the OpenTelemetry file exporter.
+    When tracing is disabled the only overhead is checking a flag.
+    """
+
+    trace_file = None
+    __local = threading.local()
+    __lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, trace_file):
+        cls.trace_file = trace_file
+
+    @classmethod
+    def __stack(cls):
+        if not hasattr(cls.__local, 'stack'):
+            cls.__local.stack = []
+        return cls.__local.stack
+
+    @classmethod
+    def current(cls):
+        """ Span being executed in this thread, None if not tracing """
+        if not cls.trace_file:
+            return None
+        stack = cls.__stack()
+        return stack[-1] if stack else None
+
+    @classmethod
+    def span(cls, name, parent=None, **attributes):
+        """ Context manager tracing the execution of its block
+
+        :param name: name of the span
+        :param parent: parent span, the current span of the thread by default
+        :param attributes: attributes of the span (section, repo, ...)
+        """
+        if not cls.trace_file:
+            return _NO_SPAN
+        return _SpanBlock(cls, name, parent, attributes)
+
+    @classmethod
+    def attach(cls, parent):
+        """ Context manager to use parent as the current span in this thread """
+        if not cls.trace_file or not parent:
+            return _NO_SPAN
+        return _Attach(cls, parent)
+
+    @classmethod
+    def _push(cls, span):
+        cls.__stack().append(span)
+
+    @classmethod
+    def _pop(cls):
+        cls.__stack().pop()
+
+    @classmethod
+    def _export(cls, span):
+        request = {
+            "resourceSpans": [{
+                "resource": {
+                    "attributes": [{"key": "service.name", "value": {"stringValue": "mordred"}}]
+                },
+                "scopeSpans": [{
+                    "scope": {"name": "mordred"},
+                    "spans": [span.to_otlp()]
+                }]
+            }]
+        }
+        line = json.dumps(request, sort_keys=True) + "\n"
+        with cls.__lock:
+            try:
+                with open(cls.trace_file, "a") as trace_file:
+                    trace_file.write(line)
+            except OSError as ex:
+                logger.warning("Can not write span %s to %s: %s", span.name, cls.trace_file, ex)
+
+
+class _SpanBlock():
+
+    def __init__(self, tracer, name, parent, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.parent = parent
+        self.attributes = attributes
+
+    def __enter__(self):
+        parent = self.parent if self.parent else self.tracer.current()
+        self.span = Span(self.name, parent, self.attributes)
+        self.tracer._push(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._pop()
+        self.span.end = time.time()
+        if exc_type:
+            self.span.error = "%s: %s" % (exc_type.__name__, exc_value)
+        self.tracer._export(self.span)
+
+
+class _Attach():
+
+    def __init__(self, tracer, parent):
+        self.tracer = tracer
+        self.parent = parent
+
+    def __enter__(self):
+        self.tracer._push(self.parent)
+        return self.parent
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.tracer._pop()
+
+
+class _NoSpan():
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_NO_SPAN = _NoSpan()
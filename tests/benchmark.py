@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+#
+# Benchmark of the orchestration of Mordred: a full cycle of projects,
+# collection and enrichment tasks for synthetic projects files, against
+# an in memory ElasticSearch and with feed_backend and enrich_backend
+# replaced by stubs which just wait for a configurable latency. The time
+# not spent in the stubs is the overhead of Mordred.
+#
+# Usage (from the tests directory):
+#
+#     ./benchmark.py --repos 10 1000 100000 --collect-latency 0.01 \
+#                    --enrich-latency 0.005 --scheduler dag --json results.json
+
+import argparse
+import json
+import logging
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from unittest import mock
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from fake_es import FakeElasticSearch
+
+from mordred.config import Config
+from mordred.mordred import Mordred
+from mordred.task_collection import TaskRawDataCollection
+from mordred.task_enrich import TaskEnrich
+from mordred.task_projects import TaskProjects
+
+REPOS_PER_PROJECT = 10
+
+
+def generate_projects(projects_file, repos, backends, hosts=10):
+    """ Write a projects file with repos repositories for each backend
+
+    The repositories are grouped in projects of REPOS_PER_PROJECT and
+    spread between several hosts, like in real deployments.
+    """
+    projects = {}
+    for i in range(repos):
+        project = projects.setdefault("project%i" % (i // REPOS_PER_PROJECT), {})
+        host = "host%i.example.com" % (i % hosts)
+        for backend in backends:
+            if backend == "git":
+                repo = "https://%s/org%i/repo%i.git" % (host, i % hosts, i)
+            elif backend == "github":
+                repo = "https://github.com/org%i/repo%i" % (i % hosts, i)
+            else:
+                repo = "https://%s/%s/repo%i" % (host, backend, i)
+            project.setdefault(backend, []).append(repo)
+
+    with open(projects_file, "w") as f:
+        json.dump(projects, f)
+
+
+def generate_config(conf_file, es_url, projects_file, backends, args):
+    """ Write a Mordred config to run the benchmark """
+    logs_dir = os.path.join(os.path.dirname(conf_file), "logs")
+    conf = """
+[general]
+short_name = Benchmark
+update = false
+debug = false
+logs_dir = %(logs_dir)s
+scheduler = %(scheduler)s
+scheduler_workers = %(workers)i
+collection_workers = %(workers)i
+pipeline = %(pipeline)s
+
+[projects]
+projects_file = %(projects_file)s
+
+[es_collection]
+url = %(es_url)s
+
+[es_enrichment]
+url = %(es_url)s
+autorefresh = false
+studies = false
+
+[sortinghat]
+host = localhost
+user = root
+password =
+database = benchmark_sh
+unaffiliated_group = Unknown
+autoprofile = [git]
+matching = [email]
+sleep_for = 3600
+
+[phases]
+collection = true
+identities = false
+enrichment = true
+panels = false
+""" % {"logs_dir": logs_dir, "scheduler": args.scheduler, "workers": args.workers,
+       "pipeline": str(args.pipeline).lower(), "projects_file": projects_file,
+       "es_url": es_url}
+
+    for backend in backends:
+        conf += """
+[%(backend)s]
+raw_index = %(backend)s_benchmark_raw
+enriched_index = %(backend)s_benchmark
+""" % {"backend": backend}
+
+    with open(conf_file, "w") as f:
+        f.write(conf)
+
+
+class BackendStubs():
+    """ feed_backend and enrich_backend waiting for a random latency
+
+    The latency of each call is uniformly distributed in
+    [latency * (1 - jitter), latency * (1 + jitter)]
+    """
+
+    def __init__(self, collect_latency, enrich_latency, jitter=0.5):
+        self.collect_latency = collect_latency
+        self.enrich_latency = enrich_latency
+        self.jitter = jitter
+        self.collected = 0
+        self.enriched = 0
+        self.busy = 0  # seconds spent in the stubs
+        self.lock = threading.Lock()
+
+    def __wait(self, latency):
+        delay = latency * random.uniform(1 - self.jitter, 1 + self.jitter)
+        time.sleep(delay)
+        return delay
+
+    def feed_backend(self, *args, **kwargs):
+        delay = self.__wait(self.collect_latency)
+        with self.lock:
+            self.collected += 1
+            self.busy += delay
+
+    def enrich_backend(self, *args, **kwargs):
+        delay = self.__wait(self.enrich_latency)
+        with self.lock:
+            self.enriched += 1
+            self.busy += delay
+
+
+def run_benchmark(repos, args, es_url, work_dir):
+    """ Run a cycle of Mordred for a projects file with repos repositories
+
+    :returns: dict with the results
+    """
+    projects_file = os.path.join(work_dir, "projects_%i.json" % repos)
+    conf_file = os.path.join(work_dir, "benchmark_%i.cfg" % repos)
+    generate_projects(projects_file, repos, args.backends)
+    generate_config(conf_file, es_url, projects_file, args.backends, args)
+
+    stubs = BackendStubs(args.collect_latency, args.enrich_latency, args.jitter)
+    rss_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    with mock.patch("mordred.task_collection.feed_backend", stubs.feed_backend), \
+        mock.patch("mordred.task_enrich.enrich_backend", stubs.enrich_backend):
+        start = time.time()
+        config = Config(conf_file)
+        TaskProjects(config).execute()
+        loaded = time.time()
+        Mordred(config).execute_batch_tasks([TaskProjects, TaskRawDataCollection, TaskEnrich])
+        end = time.time()
+
+    result = {
+        "repos": repos * len(args.backends),
+        "collected": stubs.collected,
+        "enriched": stubs.enriched,
+        "load_time": loaded - start,
+        "cycle_time": end - loaded,
+        "throughput": (stubs.collected + stubs.enriched) / (end - loaded),
+        # fraction of the workers time waiting for the backends
+        "efficiency": stubs.busy / ((end - loaded) * args.workers),
+        # ru_maxrss is in KB in Linux, it only grows so it is the peak until now
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "rss_growth_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_start) / 1024
+    }
+    if args.tracemalloc:
+        result["traced_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return result
+
+
+def get_params():
+    parser = argparse.ArgumentParser(description="Benchmark of the Mordred orchestration")
+    parser.add_argument("--repos", type=int, nargs="+", default=[10, 100, 1000],
+                        help="number of repositories per backend of each run")
+    parser.add_argument("--backends", nargs="+", default=["git", "github"],
+                        help="backend sections with repositories")
+    parser.add_argument("--collect-latency", type=float, default=0.01,
+                        help="mean seconds collecting a repository")
+    parser.add_argument("--enrich-latency", type=float, default=0.005,
+                        help="mean seconds enriching a repository")
+    parser.add_argument("--jitter", type=float, default=0.5,
+                        help="relative variation of the latencies")
+    parser.add_argument("--scheduler", default="threads", choices=["threads", "dag", "asyncio"])
+    parser.add_argument("--workers", type=int, default=10,
+                        help="collection and scheduler workers")
+    parser.add_argument("--pipeline", action="store_true",
+                        help="enrich each repository after collecting it")
+    parser.add_argument("--tracemalloc", action="store_true",
+                        help="trace the peak of allocated memory (slower)")
+    parser.add_argument("--json", help="file to write the results in JSON")
+    parser.add_argument("-g", "--debug", action="store_true")
+    return parser.parse_args()
+
+
+def main():
+    args = get_params()
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+
+    fake_es = FakeElasticSearch()
+    es_url = fake_es.start()
+
+    results = []
+    header = "%10s %10s %10s %12s %10s %10s %10s" % ("repos", "load (s)", "cycle (s)",
+                                                      "repos/s", "efficiency",
+                                                      "rss (MB)", "growth (MB)")
+    print(header)
+    with tempfile.TemporaryDirectory() as work_dir:
+        for repos in args.repos:
+            result = run_benchmark(repos, args, es_url, work_dir)
+            results.append(result)
+            print("%10i %10.2f %10.2f %12.1f %10.2f %10.1f %10.1f" %
+                  (result["repos"], result["load_time"], result["cycle_time"],
+                   result["throughput"], result["efficiency"], result["max_rss_mb"],
+                   result["rss_growth_mb"]))
+
+    fake_es.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"params": vars(args), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import json
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+KIBITER_VERSION = "5.6.0"
+
+
+class FakeElasticSearch():
+    """ In memory ElasticSearch stand-in with the endpoints used by Mordred
+
+    Indices and documents, aliases, bulk uploads, search with scroll and
+    count (with term and range filters) are supported, enough to run the
+    collection, enrichment and panels tasks without a real ElasticSearch.
+    """
+
+    def __init__(self, host="localhost", port=0):
+        self.indices = {}  # index -> {doc_id -> doc}
+        self.aliases = {}  # alias -> index
+        self.scrolls = {}  # scroll_id -> (pending hits, page size)
+        self.requests = {}  # endpoint -> number of requests
+        self.lock = threading.Lock()
+        self.server = _ThreadingHTTPServer((host, port), _FakeElasticSearchHandler)
+        self.server.fake_es = self
+        self.thread = None
+
+        # Kibiter config used by the panels tasks
+        self.indices[".kibana"] = {"config/" + KIBITER_VERSION: {}}
+
+    @property
+    def url(self):
+        (host, port) = self.server.server_address[:2]
+        return "http://%s:%i" % (host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count_request(self, endpoint):
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+    def resolve(self, name):
+        return self.aliases.get(name, name)
+
+    def docs(self, index, doc_type=None):
+        """ Documents in an index (or alias) as hits """
+        hits = []
+        with self.lock:
+            for (key, doc) in self.indices.get(self.resolve(index), {}).items():
+                (key_type, doc_id) = key.split("/", 1)
+                if doc_type and key_type != doc_type:
+                    continue
+                hits.append({"_index": index, "_type": key_type, "_id": doc_id,
+                             "_source": doc})
+        return hits
+
+    def put_doc(self, index, doc_type, doc_id, doc):
+        with self.lock:
+            self.indices.setdefault(self.resolve(index), {})[doc_type + "/" + doc_id] = doc
+
+    def delete_doc(self, index, doc_type, doc_id):
+        with self.lock:
+            return self.indices.get(self.resolve(index), {}).pop(doc_type + "/" + doc_id, None)
+
+
+def _match(doc, query):
+    """ Check a doc with the bool filters (term and range) of a query """
+    filters = query.get("query", {}).get("bool", {}).get("filter", [])
+    if isinstance(filters, dict):
+        filters = [filters]
+    for cond in filters:
+        if "term" in cond:
+            (field, value) = list(cond["term"].items())[0]
+            if doc.get(field) != value:
+                return False
+        elif "range" in cond:
+            (field, bounds) = list(cond["range"].items())[0]
+            if field not in doc:
+                return False
+            if "gte" in bounds and str(doc[field]) < str(bounds["gte"]):
+                return False
+            if "lte" in bounds and str(doc[field]) > str(bounds["lte"]):
+                return False
+    return True
+
+
+class _FakeElasticSearchHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def __reply(self, code, body=None):
+        data = json.dumps(body if body is not None else {}).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(data)
+
+    def __body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(length).decode("utf-8") if length else ""
+
+    def __json_body(self):
+        body = self.__body()
+        return json.loads(body) if body.strip() else {}
+
+    def __route(self):
+        parsed = urlparse(self.path)
+        parts = [part for part in parsed.path.split("/") if part]
+        return parts, parse_qs(parsed.query)
+
+    def do_HEAD(self):
+        es = self.server.fake_es
+        parts, _ = self.__route()
+        es.count_request("head")
+        if not parts or es.resolve(parts[0]) in es.indices:
+            self.__reply(200)
+        else:
+            self.__reply(404)
+
+    def do_GET(self):
+        self.__dispatch()
+
+    def do_POST(self):
+        self.__dispatch()
+
+    def do_PUT(self):
+        es = self.server.fake_es
+        parts, _ = self.__route()
+        es.count_request("put")
+        body = self.__json_body()
+        if len(parts) == 1 or "_mapping" in parts or "_settings" in parts:
+            # create index or mapping
+            with es.lock:
+                es.indices.setdefault(es.resolve(parts[0]), {})
+            self.__reply(200, {"acknowledged": True})
+        elif len(parts) == 3:
+            es.put_doc(parts[0], parts[1], parts[2], body)
+            self.__reply(201, {"_id": parts[2], "result": "created"})
+        else:
+            self.__reply(400, {"error": "unsupported PUT %s" % self.path})
+
+    def do_DELETE(self):
+        es = self.server.fake_es
+        parts, _ = self.__route()
+        es.count_request("delete")
+        if parts[:2] == ["_search", "scroll"]:
+            self.__reply(200, {"succeeded": True})
+        elif len(parts) == 1:
+            with es.lock:
+                found = es.indices.pop(es.resolve(parts[0]), None)
+            self.__reply(200 if found is not None else 404, {"acknowledged": True})
+        elif len(parts) == 3:
+            found = es.delete_doc(parts[0], parts[1], parts[2])
+            self.__reply(200 if found is not None else 404, {"result": "deleted"})
+        else:
+            self.__reply(400, {"error": "unsupported DELETE %s" % self.path})
+
+    def __dispatch(self):
+        es = self.server.fake_es
+        parts, params = self.__route()
+
+        if not parts:
+            es.count_request("info")
+            self.__reply(200, {"version": {"number": KIBITER_VERSION},
+                               "tagline": "You Know, for Search"})
+        elif parts[0] == "_alias" and len(parts) == 2:
+            es.count_request("alias")
+            alias = parts[1]
+            if alias in es.aliases:
+                self.__reply(200, {es.aliases[alias]: {"aliases": {alias: {}}}})
+            else:
+                self.__reply(404, {"error": "alias [%s] missing" % alias, "status": 404})
+        elif parts[0] == "_aliases":
+            es.count_request("aliases")
+            self.__aliases(self.__json_body())
+        elif parts[-1] == "_bulk":
+            es.count_request("bulk")
+            self.__bulk(parts[:-1])
+        elif parts[:2] == ["_search", "scroll"]:
+            es.count_request("scroll")
+            self.__scroll(self.__json_body())
+        elif parts[-1] == "_search":
+            es.count_request("search")
+            self.__search(parts[:-1], params)
+        elif parts[-1] == "_count":
+            es.count_request("count")
+            query = self.__json_body()
+            count = len([hit for hit in es.docs(parts[0]) if _match(hit["_source"], query)])
+            self.__reply(200, {"count": count})
+        elif parts[-1] in ("_refresh", "_mapping", "_settings"):
+            es.count_request(parts[-1][1:])
+            self.__body()
+            self.__reply(200, {})
+        elif len(parts) == 3 and self.command == "GET":
+            es.count_request("get")
+            hits = [hit for hit in es.docs(parts[0], parts[1]) if hit["_id"] == parts[2]]
+            if hits:
+                self.__reply(200, dict(hits[0], found=True))
+            else:
+                self.__reply(404, {"found": False})
+        elif len(parts) == 3 and self.command == "POST":
+            es.count_request("index")
+            es.put_doc(parts[0], parts[1], parts[2], self.__json_body())
+            self.__reply(201, {"_id": parts[2], "result": "created"})
+        elif len(parts) == 1 and self.command == "GET":
+            es.count_request("index_info")
+            if es.resolve(parts[0]) in es.indices:
+                self.__reply(200, {parts[0]: {"mappings": {}, "settings": {}}})
+            else:
+                self.__reply(404, {"error": "no such index", "status": 404})
+        else:
+            self.__reply(400, {"error": "unsupported %s %s" % (self.command, self.path)})
+
+    def __aliases(self, body):
+        es = self.server.fake_es
+        for action in body.get("actions", []):
+            if "add" in action:
+                index = action["add"]["index"]
+                if index not in es.indices:
+                    self.__reply(404, {"error": "no such index [%s]" % index, "status": 404})
+                    return
+                es.aliases[action["add"]["alias"]] = index
+            elif "remove" in action:
+                es.aliases.pop(action["remove"]["alias"], None)
+        self.__reply(200, {"acknowledged": True})
+
+    def __bulk(self, path_parts):
+        es = self.server.fake_es
+        lines = [line for line in self.__body().split("\n") if line.strip()]
+        items = []
+        for (action_line, doc_line) in zip(lines[0::2], lines[1::2]):
+            action = json.loads(action_line)
+            (op, meta) = list(action.items())[0]
+            index = meta.get("_index", path_parts[0] if path_parts else None)
+            doc_type = meta.get("_type", path_parts[1] if len(path_parts) > 1 else "items")
+            doc_id = str(meta.get("_id"))
+            es.put_doc(index, doc_type, doc_id, json.loads(doc_line))
+            items.append({op: {"_index": index, "_type": doc_type, "_id": doc_id,
+                               "status": 201}})
+        self.__reply(200, {"took": 1, "errors": False, "items": items})
+
+    def __page(self, hits, size):
+        es = self.server.fake_es
+        page, pending = hits[:size], hits[size:]
+        scroll_id = None
+        if pending:
+            with es.lock:
+                scroll_id = "scroll%i" % len(es.scrolls)
+                es.scrolls[scroll_id] = (pending, size)
+        return {"_scroll_id": scroll_id, "took": 1, "timed_out": False,
+                "hits": {"total": len(hits), "hits": page}}
+
+    def __search(self, path_parts, params):
+        es = self.server.fake_es
+        query = self.__json_body()
+        doc_type = path_parts[1] if len(path_parts) > 1 else None
+        hits = [hit for hit in es.docs(path_parts[0], doc_type) if _match(hit["_source"], query)]
+        size = int(params.get("size", [query.get("size", 10)])[0])
+        self.__reply(200, self.__page(hits, size))
+
+    def __scroll(self, body):
+        es = self.server.fake_es
+        with es.lock:
+            (hits, size) = es.scrolls.pop(body.get("scroll_id"), ([], 10))
+        self.__reply(200, self.__page(hits, size))
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
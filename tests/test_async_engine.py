@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import asyncio
+import sys
+import threading
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.async_engine import AsyncEngine
+
+
+class SleepTask():
+    """Task doing several blocking requests"""
+
+    def __init__(self, requests=3, fail=False):
+        self.requests = requests
+        self.fail = fail
+        self.executions = 0
+
+    def request(self):
+        time.sleep(0.2)
+        if self.fail:
+            raise RuntimeError("fail")
+
+    async def execute_async(self, loop, executor):
+        await asyncio.gather(*[loop.run_in_executor(executor, self.request)
+                               for _ in range(self.requests)])
+        self.executions += 1
+
+
+class AutorefreshTask(SleepTask):
+    """Task counting its autorefresh executions"""
+
+    def __init__(self):
+        super().__init__(requests=1)
+        self.autorefreshes = 0
+
+    def autorefresh(self):
+        self.autorefreshes += 1
+
+
+class HungTask():
+    """Task which never finishes"""
+
+    async def execute_async(self, loop, executor):
+        await asyncio.sleep(3600)
+
+
+class TestAsyncEngine(unittest.TestCase):
+    """AsyncEngine tests"""
+
+    def test_run(self):
+        """Test whether the rounds and their requests are executed concurrently"""
+
+        tasks = [SleepTask() for _ in range(3)]
+        engine = AsyncEngine(max_workers=9)
+        for task in tasks:
+            engine.add_round([task])
+        before = time.time()
+        exceptions = engine.run()
+
+        self.assertEqual(exceptions, [])
+        self.assertEqual([task.executions for task in tasks], [1, 1, 1])
+        self.assertLess(time.time() - before, 0.5)
+
+    def test_exceptions(self):
+        """Test whether the exceptions in the rounds are returned"""
+
+        task = SleepTask()
+        engine = AsyncEngine()
+        engine.add_round([SleepTask(requests=1, fail=True), task])
+        engine.add_round([SleepTask(requests=1)])
+        exceptions = engine.run()
+
+        self.assertEqual(len(exceptions), 1)
+        self.assertIsInstance(exceptions[0], RuntimeError)
+        self.assertEqual(task.executions, 0)
+
+    def test_task_timeout(self):
+        """Test whether a hung task is abandoned and the next ones are executed"""
+
+        task = SleepTask(requests=1)
+        engine = AsyncEngine(task_timeout=0.5)
+        engine.add_round([HungTask(), task])
+        before = time.time()
+        exceptions = engine.run()
+
+        self.assertEqual(exceptions, [])
+        self.assertEqual(task.executions, 1)
+        self.assertEqual(len(engine.abandoned_tasks), 1)
+        self.assertLess(time.time() - before, 1.5)
+
+    def test_wakeup(self):
+        """Test whether waiting rounds are executed when woken up"""
+
+        backend_task = SleepTask(requests=1)
+        global_task = SleepTask(requests=1)
+        engine = AsyncEngine()
+        engine.add_round([backend_task], timer=3600)
+        engine.add_round([global_task], timer=3600, global_task=True)
+        threading.Timer(0.2, engine.wakeup, args=("test",)).start()
+        threading.Timer(0.6, engine.stop).start()
+        engine.run(repeat=True)
+
+        self.assertEqual(backend_task.executions, 1)
+        self.assertEqual(global_task.executions, 0)
+
+    def test_wakeup_autorefresh(self):
+        """Test whether only the autorefresh is executed when identities are merged"""
+
+        task = AutorefreshTask()
+        engine = AsyncEngine()
+        engine.add_round([task], timer=3600)
+        threading.Timer(0.2, engine.wakeup, args=("test", False, None, True)).start()
+        threading.Timer(0.6, engine.stop).start()
+        engine.run(repeat=True)
+
+        self.assertEqual(task.autorefreshes, 1)
+        self.assertEqual(task.executions, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.checkpoint import CheckpointStore
+from mordred.repos_stats import ReposStats
+from mordred.task_manager import AutorefreshState
+
+
+class TestCheckpointStore(unittest.TestCase):
+    """CheckpointStore tests"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "state.db")
+
+    def tearDown(self):
+        ReposStats.store = None
+        self.tmp_dir.cleanup()
+
+    def test_repos_stats(self):
+        """Test whether the stats of the repositories are restored"""
+
+        ReposStats.set_store(CheckpointStore(self.db_path))
+        ReposStats.record("git", "collection", "checkpoint_repo", 10, 15, items=0)
+        ReposStats.adapt_interval("git", "collection", "checkpoint_repo", 60, 3600)
+
+        stats = CheckpointStore(self.db_path).load_repos_stats()
+        self.assertEqual(stats[("git", "collection", "checkpoint_repo")],
+                         {"last_run": 15, "duration": 5, "items": 0, "interval": 120})
+
+        ReposStats.forget("git", "checkpoint_repo")
+        stats = CheckpointStore(self.db_path).load_repos_stats()
+        self.assertNotIn(("git", "collection", "checkpoint_repo"), stats)
+
+    def test_resume_cycle(self):
+        """Test whether a cycle killed partway through is resumed with the remaining repos"""
+
+        repos = ["cycle_repo%i" % i for i in range(5)]
+        ReposStats.set_store(CheckpointStore(self.db_path))
+        self.assertEqual(ReposStats.start_cycle("git", ("collection",), repos), repos)
+        for repo in repos[:3]:
+            now = time.time()
+            ReposStats.record("git", "collection", repo, now, now)
+        # killed before the end of the cycle, and restarted
+        ReposStats.set_store(CheckpointStore(self.db_path))
+
+        self.assertEqual(ReposStats.start_cycle("git", ("collection",), repos), repos[3:])
+        # the cycle is resumed only once
+        self.assertEqual(ReposStats.start_cycle("git", ("collection",), repos), repos)
+
+        # a repository is done only when it was done in all the phases
+        ReposStats.set_store(CheckpointStore(self.db_path))
+        phases = ("collection", "enrichment")
+        self.assertEqual(ReposStats.start_cycle("github", phases, repos), repos)
+        now = time.time()
+        ReposStats.record("github", "collection", repos[0], now, now)
+        ReposStats.record("github", "collection", repos[1], now, now)
+        ReposStats.record("github", "enrichment", repos[0], now, now)
+        ReposStats.set_store(CheckpointStore(self.db_path))
+        self.assertEqual(ReposStats.start_cycle("github", phases, repos), repos[1:])
+
+        # the finished cycles are not resumed
+        ReposStats.end_cycle("git", ("collection",))
+        ReposStats.end_cycle("github", phases)
+        ReposStats.set_store(CheckpointStore(self.db_path))
+        self.assertEqual(ReposStats.start_cycle("git", ("collection",), repos), repos)
+        self.assertEqual(ReposStats.start_cycle("github", phases, repos), repos)
+
+    def test_autorefresh(self):
+        """Test whether the pending autorefresh work is restored"""
+
+        state = AutorefreshState()
+        state.init_backends(["git", "github"])
+        state.set_store(CheckpointStore(self.db_path))
+        state.add_uuids(["uuid1", "uuid2"])
+        state.mark_all_dirty()
+
+        # git autorefresh is done, github autorefresh is interrupted
+        self.assertTrue(state.pop_dirty("git"))
+        state.autorefresh_done("git", state.drain_uuids("git"))
+        self.assertTrue(state.pop_dirty("github"))
+        state.drain_uuids("github")
+
+        restarted = AutorefreshState()
+        restarted.set_store(CheckpointStore(self.db_path))
+        self.assertFalse(restarted.pop_dirty("git"))
+        self.assertEqual(restarted.drain_uuids("git"), [])
+        self.assertTrue(restarted.pop_dirty("github"))
+        self.assertEqual(sorted(restarted.drain_uuids("github")), ["uuid1", "uuid2"])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import pickle
+import sys
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.config import Config
+
+
+CONF_FILE = 'test.cfg'
+
+
+class TestConfig(unittest.TestCase):
+    """Compiled config tests"""
+
+    def test_read(self):
+        """Test whether the params are read as items and as attributes"""
+
+        conf = Config(CONF_FILE).get_conf()
+
+        self.assertEqual(conf.general.short_name, "MordredTest")
+        self.assertEqual(conf['general']['short_name'], "MordredTest")
+        self.assertEqual(conf.sortinghat.matching, ("email",))
+        self.assertEqual(conf.stackexchange.fetch_cache, True)
+        self.assertEqual(conf['*askbot']['from-date'], "2016-10-01")
+
+    def test_read_only(self):
+        """Test whether the compiled config can not be changed"""
+
+        conf = Config(CONF_FILE).get_conf()
+
+        with self.assertRaises(AttributeError):
+            conf.general.debug = False
+        with self.assertRaises(TypeError):
+            conf['general']['debug'] = False
+        with self.assertRaises(TypeError):
+            conf['new_section'] = {}
+
+    def test_set_param(self):
+        """Test whether a param change compiles a new config"""
+
+        config = Config(CONF_FILE)
+        conf = config.get_conf()
+        config.set_param('general', 'debug', False)
+
+        self.assertFalse(config.get_conf().general.debug)
+        self.assertTrue(conf.general.debug)
+
+    def test_perceval_args(self):
+        """Test whether the perceval arguments are compiled for the backend sections"""
+
+        conf = Config(CONF_FILE).get_conf()
+
+        self.assertEqual(conf.stackexchange.perceval_args, ('--fetch-cache',))
+        self.assertEqual(conf.stackexchange.api_token_args, ('--api-token', 'token'))
+        self.assertEqual(conf.general.perceval_args, ())
+
+    def test_pickle(self):
+        """Test whether the compiled config is sent to other processes"""
+
+        conf = Config(CONF_FILE).get_conf()
+        copy = pickle.loads(pickle.dumps(conf))
+
+        self.assertEqual(copy, conf)
+        self.assertEqual(copy.stackexchange.api_token_args, ('--api-token', 'token'))
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.lease import LeaseStore
+
+
+REPOS = ["https://github.com/grimoirelab/repo" + str(i) for i in range(10)]
+
+
+class TestLeaseStore(unittest.TestCase):
+    """LeaseStore tests"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "leases.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_share(self):
+        """Test whether the repositories are shared between the nodes"""
+
+        node1 = LeaseStore(self.db_path, "node1")
+        self.assertEqual(node1.acquire("git", REPOS), REPOS)
+
+        node2 = LeaseStore(self.db_path, "node2")
+        # node1 leases are not expired, nothing free yet
+        self.assertEqual(node2.acquire("git", REPOS), [])
+        # node1 gives up the repositories over its share
+        leased1 = node1.acquire("git", REPOS)
+        self.assertEqual(len(leased1), 5)
+        leased2 = node2.acquire("git", REPOS)
+        self.assertEqual(sorted(leased1 + leased2), sorted(REPOS))
+
+        # the leases are kept between cycles
+        self.assertEqual(node1.acquire("git", REPOS), leased1)
+        # other sections are leased independently
+        self.assertEqual(len(node1.acquire("github", REPOS)), 5)
+
+    def test_reclaim(self):
+        """Test whether the leases of dead nodes are reclaimed"""
+
+        node1 = LeaseStore(self.db_path, "node1", ttl=0.5)
+        node2 = LeaseStore(self.db_path, "node2", ttl=0.5)
+        node1.acquire("git", REPOS)
+        self.assertEqual(node2.acquire("git", REPOS), [])
+
+        time.sleep(0.6)
+        self.assertEqual(node2.acquire("git", REPOS), REPOS)
+
+    def test_restart(self):
+        """Test whether a restarted node gets back its leases and a released one frees them"""
+
+        node1 = LeaseStore(self.db_path, "node1")
+        self.assertEqual(node1.acquire("git", REPOS), REPOS)
+
+        # the node has the same id after a restart
+        restarted = LeaseStore(self.db_path, "node1")
+        self.assertEqual(restarted.acquire("git", REPOS), REPOS)
+
+        # the repositories of a released node are taken right away
+        restarted.release()
+        node2 = LeaseStore(self.db_path, "node2")
+        self.assertEqual(node2.acquire("git", REPOS), REPOS)
+
+    def test_node_id(self):
+        """Test whether the nodes must have a name"""
+
+        with self.assertRaises(ValueError):
+            LeaseStore(self.db_path, None)
+
+    def test_leader(self):
+        """Test whether only one node is the leader"""
+
+        node1 = LeaseStore(self.db_path, "node1")
+        node2 = LeaseStore(self.db_path, "node2")
+        self.assertTrue(node1.is_leader())
+        self.assertFalse(node2.is_leader())
+        self.assertTrue(node1.is_leader())
+
+        node1.release()
+        self.assertTrue(node2.is_leader())
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import unittest
+import urllib.request
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.metrics import Counter, Histogram, start_metrics_server
+
+
+class TestMetrics(unittest.TestCase):
+    """Metrics tests"""
+
+    def test_expose(self):
+        """Test whether the metrics are exposed in Prometheus text format"""
+
+        counter = Counter("test_items_total", "Test items", ["repo"])
+        counter.inc(2, repo='https://github.com/grimoirelab/"mordred"')
+        counter.inc(repo='https://github.com/grimoirelab/"mordred"')
+        histogram = Histogram("test_duration_seconds", "Test durations", ["section"],
+                              buckets=(1, 10))
+        histogram.observe(5, section="git")
+
+        self.assertEqual(counter.expose(),
+                         '# HELP test_items_total Test items\n'
+                         '# TYPE test_items_total counter\n'
+                         'test_items_total{repo="https://github.com/grimoirelab/\\"mordred\\""} 3.0')
+        self.assertEqual(histogram.expose(),
+                         '# HELP test_duration_seconds Test durations\n'
+                         '# TYPE test_duration_seconds histogram\n'
+                         'test_duration_seconds_bucket{section="git",le="1.0"} 0.0\n'
+                         'test_duration_seconds_bucket{section="git",le="10.0"} 1.0\n'
+                         'test_duration_seconds_bucket{section="git",le="+Inf"} 1.0\n'
+                         'test_duration_seconds_sum{section="git"} 5.0\n'
+                         'test_duration_seconds_count{section="git"} 1.0')
+
+    def test_server(self):
+        """Test whether the metrics are served over HTTP"""
+
+        counter = Counter("test_served_total", "Test served")
+        counter.inc()
+        server = start_metrics_server(0, "localhost")
+        try:
+            url = "http://localhost:%i/metrics" % server.server_address[1]
+            body = urllib.request.urlopen(url).read().decode("utf-8")
+        finally:
+            server.shutdown()
+
+        self.assertIn("test_served_total 1.0\n", body)
+        self.assertIn("# TYPE mordred_repo_duration_seconds histogram\n", body)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import threading
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.pool import WorkerPool
+
+
+class TestWorkerPool(unittest.TestCase):
+    """WorkerPool tests"""
+
+    def test_get_host(self):
+        """Test whether the host is extracted from the repositories"""
+
+        self.assertEqual(WorkerPool.get_host("https://github.com/grimoirelab/perceval"),
+                         "github.com")
+        self.assertEqual(WorkerPool.get_host("https://github.com/grimoirelab/perceval --filter-raw a:b"),
+                         "github.com")
+        self.assertEqual(WorkerPool.get_host("metrics-grimoire /home/bitergia/mbox"),
+                         "metrics-grimoire")
+
+    def test_run(self):
+        """Test whether all the work units are executed"""
+
+        done = []
+        pool = WorkerPool(max_workers=4)
+        for i in range(10):
+            pool.submit("https://host%i.org/repo" % i, done.append, i)
+        failed = pool.wait()
+        pool.shutdown()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(done), list(range(10)))
+
+    def test_failed(self):
+        """Test whether failed work units are returned"""
+
+        def fail(repo):
+            if repo.endswith('bad'):
+                raise RuntimeError(repo)
+
+        pool = WorkerPool(max_workers=2)
+        for repo in ["https://a.org/good", "https://a.org/bad"]:
+            pool.submit(repo, fail, repo)
+        failed = pool.wait()
+        pool.shutdown()
+
+        self.assertEqual(len(failed), 1)
+        self.assertEqual(failed[0][0], "https://a.org/bad")
+        self.assertIsInstance(failed[0][1], RuntimeError)
+
+    def test_max_workers_host(self):
+        """Test whether the parallel work units for a host are limited"""
+
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def work():
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.05)
+            with lock:
+                running['now'] -= 1
+
+        pool = WorkerPool(max_workers=8, max_workers_host=2)
+        for i in range(8):
+            pool.submit("https://github.com/repo%i" % i, work)
+        pool.wait()
+        pool.shutdown()
+
+        self.assertEqual(running['max'], 2)
+
+    def test_host_throttled(self):
+        """Test whether a host at its limit does not block the other hosts"""
+
+        release = threading.Event()
+        self.addCleanup(release.set)
+        done = []
+
+        def work(repo):
+            if repo.startswith("https://slow.org"):
+                release.wait()
+            done.append(repo)
+
+        slow_repos = ["https://slow.org/repo%i" % i for i in range(4)]
+        free_repos = ["https://free.org/repo%i" % i for i in range(4)]
+        pool = WorkerPool(max_workers=2, max_workers_host=1)
+        for repo in slow_repos + free_repos:
+            pool.submit(repo, work, repo)
+
+        # the slow host takes one worker, the free host goes on with the other one
+        for _ in range(100):
+            if len(done) == len(free_repos):
+                break
+            time.sleep(0.01)
+        self.assertEqual(done, free_repos)
+
+        release.set()
+        failed = pool.wait()
+        pool.shutdown()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(sorted(done), sorted(slow_repos + free_repos))
+
+    def test_timeout(self):
+        """Test whether the work units exceeding the timeout are abandoned"""
+
+        release = threading.Event()
+        done = []
+        daemons = []
+
+        def work(repo):
+            # a hung work unit must not block the exit
+            daemons.append(threading.current_thread().daemon)
+            if repo.endswith('hung'):
+                release.wait()
+            done.append(repo)
+
+        # the hung repo must not block the other repo of its host
+        pool = WorkerPool(max_workers=1, max_workers_host=1, timeout=0.2, name="git:collection")
+        for repo in ["https://a.org/hung", "https://a.org/good"]:
+            pool.submit(repo, work, repo)
+        failed = pool.wait()
+        pool.shutdown()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(pool.abandoned, ["https://a.org/hung"])
+        self.assertEqual(done, ["https://a.org/good"])
+        self.assertEqual(daemons, [True, True])
+        self.assertTrue(WorkerPool.is_abandoned("git:collection", "https://a.org/hung"))
+        self.assertFalse(WorkerPool.is_abandoned("git:enrichment", "https://a.org/hung"))
+
+        # the abandoned work finishes later
+        release.set()
+        for _ in range(50):
+            if not WorkerPool.is_abandoned("git:collection", "https://a.org/hung"):
+                break
+            time.sleep(0.01)
+        self.assertFalse(WorkerPool.is_abandoned("git:collection", "https://a.org/hung"))
+        self.assertEqual(done, ["https://a.org/good", "https://a.org/hung"])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.profiler import Profiler
+
+
+def collect_repo():
+    sum(range(10000))
+
+
+class TestProfiler(unittest.TestCase):
+    """Profiler tests"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        Profiler.configure("logs")
+        self.tmp_dir.cleanup()
+
+    def test_disabled(self):
+        """Test whether nothing is profiled when profiling is disabled"""
+
+        Profiler.configure(self.tmp_dir.name)
+        with Profiler.profile("git", "TaskRawDataCollection"):
+            collect_repo()
+
+        self.assertFalse(os.path.exists(os.path.join(self.tmp_dir.name, "profiles")))
+
+    def test_profile(self):
+        """Test whether the threads of a task are merged in a profile per cycle"""
+
+        Profiler.configure(self.tmp_dir.name, enabled=True, sections=["git"])
+
+        def worker():
+            with Profiler.profile("git", "TaskRawDataCollection"):
+                collect_repo()
+
+        for cycle in range(2):
+            with Profiler.profile("git", "TaskRawDataCollection"):
+                # nested blocks in the same thread are part of the outer one
+                with Profiler.profile("git", "TaskRawDataCollection"):
+                    collect_repo()
+                threads = [threading.Thread(target=worker) for _ in range(2)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+        # sections not selected are not profiled
+        with Profiler.profile("github", "TaskRawDataCollection"):
+            collect_repo()
+
+        profiles_dir = os.path.join(self.tmp_dir.name, "profiles")
+        profiles = sorted(os.listdir(profiles_dir))
+        self.assertEqual(len(profiles), 2)
+        self.assertTrue(profiles[0].startswith("git_TaskRawDataCollection_0001_"))
+        self.assertTrue(profiles[1].startswith("git_TaskRawDataCollection_0002_"))
+
+        stats = pstats.Stats(os.path.join(profiles_dir, profiles[0]))
+        calls = [stats.stats[func][1] for func in stats.stats if func[2] == "collect_repo"]
+        self.assertEqual(calls, [3])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.projects_loader import (compact, get_files_digest, get_projects_files,
+                                     iter_projects, load_projects, normalize_repo)
+
+
+PROJECTS_FILE = 'test-projects.json'
+
+
+class TestProjectsLoader(unittest.TestCase):
+    """Projects loader tests"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write_projects(self, fname, projects, indent=None):
+        projects_file = os.path.join(self.tmp_dir.name, fname)
+        with open(projects_file, 'w') as fprojects:
+            json.dump(projects, fprojects, indent=indent)
+        return projects_file
+
+    def test_load(self):
+        """Test whether the projects are the same read in chunks of any size"""
+
+        with open(PROJECTS_FILE) as fprojects:
+            expected = json.load(fprojects)
+
+        for chunk_size in [1, 7, 4096]:
+            projects = load_projects(PROJECTS_FILE, chunk_size)
+            self.assertEqual(projects, compact(expected))
+
+        projects = {
+            "p%i" % i: {
+                "meta": {"title": "Project ñ %i" % i, "weight": 1.5e3, "active": True},
+                "git": ["https://example.org/repo%i" % j for j in range(i % 5)]
+            } for i in range(50)
+        }
+        projects_file = self.write_projects('projects.json', projects, indent=2)
+        self.assertEqual(load_projects(projects_file, 3), compact(projects))
+        self.assertEqual([name for (name, _) in iter_projects(projects_file)], list(projects))
+
+    def test_compact(self):
+        """Test whether the repositories are interned tuples"""
+
+        projects = {
+            "p1": {"git": ["https://example.org/" + "repo"]},
+            "p2": {"git": ["https://example.org/" + "repo"]}
+        }
+        projects = load_projects(self.write_projects('projects.json', projects))
+
+        self.assertIsInstance(projects["p1"]["git"], tuple)
+        self.assertIs(projects["p1"]["git"][0], projects["p2"]["git"][0])
+        with self.assertRaises(TypeError):
+            projects["p1"]["git"] = ()
+        self.assertIs(compact(projects["p1"]), projects["p1"])
+
+    def test_normalize_repo(self):
+        """Test whether the same repository written in different ways is found"""
+
+        repo = normalize_repo("https://github.com/chaoss/grimoirelab")
+        self.assertEqual(normalize_repo("HTTPS://GitHub.com/chaoss/grimoirelab/"), repo)
+        self.assertNotEqual(normalize_repo("https://github.com/Chaoss/grimoirelab"), repo)
+        self.assertEqual(normalize_repo(" https://example.org/  --filter-raw=data.product:A"),
+                         "https://example.org --filter-raw=data.product:A")
+        self.assertEqual(normalize_repo("sisu-dev /home/mboxes/sisu-dev.mbox"),
+                         "sisu-dev /home/mboxes/sisu-dev.mbox")
+
+    def test_shards(self):
+        """Test whether the projects are loaded from a directory of files"""
+
+        self.write_projects('b.json', {"p2": {"git": ["b"]}, "p3": {"git": ["c"]}})
+        self.write_projects('a.json', {"p1": {"git": ["a"]}, "p3": {"git": ["x"]}})
+        self.write_projects('notes.txt', {"p4": {}})
+
+        files = get_projects_files(self.tmp_dir.name)
+        self.assertEqual([os.path.basename(fname) for fname in files], ['a.json', 'b.json'])
+        projects = load_projects(self.tmp_dir.name)
+        self.assertEqual(sorted(projects), ["p1", "p2", "p3"])
+        # the last definition of a project is used
+        self.assertEqual(projects["p3"]["git"], ("c",))
+
+        digest = get_files_digest(files)
+        self.assertEqual(get_files_digest(files), digest)
+        self.write_projects('b.json', {"p2": {"git": ["b"]}})
+        self.assertNotEqual(get_files_digest(files), digest)
+
+    def test_wrong_file(self):
+        """Test whether wrong projects files raise an error"""
+
+        for content in ['[]', '{"p1": {}', '{"p1": {}} {}', '{"p1" {}}', '{1: {}}', '']:
+            projects_file = os.path.join(self.tmp_dir.name, 'projects.json')
+            with open(projects_file, 'w') as fprojects:
+                fprojects.write(content)
+            with self.assertRaises(ValueError):
+                load_projects(projects_file, 2)
+
+        projects_file = self.write_projects('empty.json', {})
+        self.assertEqual(load_projects(projects_file), {})
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
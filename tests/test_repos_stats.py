@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.repos_stats import ReposStats
+
+BACKEND_SECTION = 'test_repos_stats'
+
+
+class TestReposStats(unittest.TestCase):
+    """ReposStats tests"""
+
+    def test_record(self):
+        """Test whether the stats of a repository are recorded"""
+
+        ReposStats.record(BACKEND_SECTION, 'collection', 'repo', 10, 15)
+        stats = ReposStats.get(BACKEND_SECTION, 'collection', 'repo')
+        self.assertEqual(stats, {'last_run': 15, 'duration': 5, 'items': None})
+        self.assertIsNone(ReposStats.get(BACKEND_SECTION, 'enrichment', 'repo'))
+
+    def test_sort_repos(self):
+        """Test whether new, stale and long repositories go first"""
+
+        now = time.time()
+        # same last run, different durations
+        ReposStats.record(BACKEND_SECTION, 'enrichment', 'short', now - 101, now - 100)
+        ReposStats.record(BACKEND_SECTION, 'enrichment', 'long', now - 150, now - 100)
+        # shortest but the most outdated
+        ReposStats.record(BACKEND_SECTION, 'enrichment', 'stale', now - 1001, now - 1000)
+
+        repos = ['short', 'long', 'new', 'stale']
+        sorted_repos = ReposStats.sort_repos(BACKEND_SECTION, 'enrichment', repos)
+        self.assertEqual(sorted_repos, ['new', 'stale', 'long', 'short'])
+
+    def test_adapt_interval(self):
+        """Test whether the interval grows for quiet repos and shrinks for busy ones"""
+
+        now = time.time()
+        ReposStats.record(BACKEND_SECTION, 'collection', 'quiet', now - 1, now, 0)
+        ReposStats.adapt_interval(BACKEND_SECTION, 'collection', 'quiet', 60, 200)
+        self.assertEqual(ReposStats.get(BACKEND_SECTION, 'collection', 'quiet')['interval'], 120)
+        ReposStats.adapt_interval(BACKEND_SECTION, 'collection', 'quiet', 60, 200)
+        self.assertEqual(ReposStats.get(BACKEND_SECTION, 'collection', 'quiet')['interval'], 200)
+        self.assertFalse(ReposStats.is_due(BACKEND_SECTION, 'collection', 'quiet', now + 100))
+        self.assertTrue(ReposStats.is_due(BACKEND_SECTION, 'collection', 'quiet', now + 200))
+
+        ReposStats.record(BACKEND_SECTION, 'collection', 'quiet', now - 1, now, 10)
+        ReposStats.adapt_interval(BACKEND_SECTION, 'collection', 'quiet', 60, 200)
+        self.assertEqual(ReposStats.get(BACKEND_SECTION, 'collection', 'quiet')['interval'], 100)
+
+        # Unknown number of items: the interval is not changed
+        ReposStats.record(BACKEND_SECTION, 'collection', 'unknown', now - 1, now)
+        ReposStats.adapt_interval(BACKEND_SECTION, 'collection', 'unknown', 60, 200)
+        self.assertTrue(ReposStats.is_due(BACKEND_SECTION, 'collection', 'unknown', now))
+
+    def test_forget(self):
+        """Test whether a forgotten repository is processed as a new one"""
+
+        now = time.time()
+        ReposStats.record(BACKEND_SECTION, 'collection', 'moved', now - 1, now)
+        ReposStats.record(BACKEND_SECTION, 'enrichment', 'moved', now - 1, now)
+        ReposStats.forget(BACKEND_SECTION, 'moved', ['enrichment'])
+        self.assertIsNotNone(ReposStats.get(BACKEND_SECTION, 'collection', 'moved'))
+        self.assertIsNone(ReposStats.get(BACKEND_SECTION, 'enrichment', 'moved'))
+
+        ReposStats.record_timeout(BACKEND_SECTION, 'collection', 'moved', 60, 200)
+        ReposStats.forget(BACKEND_SECTION, 'moved')
+        self.assertIsNone(ReposStats.get(BACKEND_SECTION, 'collection', 'moved'))
+        self.assertFalse(ReposStats.is_straggler(BACKEND_SECTION, 'collection', 'moved'))
+
+    def test_record_timeout(self):
+        """Test whether the retries of the stragglers are delayed with backoff"""
+
+        self.assertFalse(ReposStats.is_straggler(BACKEND_SECTION, 'collection', 'hung'))
+        self.assertEqual(ReposStats.record_timeout(BACKEND_SECTION, 'collection', 'hung', 60, 200), 60)
+        self.assertEqual(ReposStats.record_timeout(BACKEND_SECTION, 'collection', 'hung', 60, 200), 120)
+        self.assertEqual(ReposStats.record_timeout(BACKEND_SECTION, 'collection', 'hung', 60, 200), 200)
+        self.assertTrue(ReposStats.is_straggler(BACKEND_SECTION, 'collection', 'hung'))
+        self.assertFalse(ReposStats.is_straggler(BACKEND_SECTION, 'enrichment', 'hung'))
+
+        now = time.time()
+        self.assertTrue(ReposStats.is_backed_off(BACKEND_SECTION, 'collection', 'hung', now))
+        self.assertFalse(ReposStats.is_backed_off(BACKEND_SECTION, 'collection', 'hung', now + 201))
+
+        ReposStats.clear_straggler(BACKEND_SECTION, 'collection', 'hung')
+        self.assertFalse(ReposStats.is_straggler(BACKEND_SECTION, 'collection', 'hung'))
+        self.assertFalse(ReposStats.is_backed_off(BACKEND_SECTION, 'collection', 'hung'))
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import threading
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.backpressure import Watermark
+from mordred.scheduler import MAX_FAILED_UNITS, Scheduler
+
+
+class TestScheduler(unittest.TestCase):
+    """Scheduler tests"""
+
+    def test_dependencies(self):
+        """Test whether work units are executed after their dependencies"""
+
+        done = []
+        scheduler = Scheduler(max_workers=4)
+        projects = scheduler.add("projects", done.append, "projects")
+        collect = [scheduler.add("collect", done.append, "collect" + str(i),
+                                 deps=[projects]) for i in range(3)]
+        scheduler.add("enrich", done.append, "enrich", deps=collect)
+        failed = scheduler.run()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(done[0], "projects")
+        self.assertEqual(sorted(done[1:4]), ["collect0", "collect1", "collect2"])
+        self.assertEqual(done[4], "enrich")
+
+    def test_failed(self):
+        """Test whether failed units are returned and dependents still run"""
+
+        def fail():
+            raise RuntimeError("fail")
+
+        done = []
+        scheduler = Scheduler(max_workers=2)
+        unit = scheduler.add("fail", fail)
+        scheduler.add("after", done.append, "after", deps=[unit])
+        failed = scheduler.run()
+
+        self.assertEqual(failed, [unit])
+        self.assertIsInstance(unit.exception, RuntimeError)
+        self.assertEqual(done, ["after"])
+
+    def test_not_before(self):
+        """Test whether units are not executed before its time and don't block"""
+
+        done = []
+        scheduler = Scheduler(max_workers=2)
+        later = scheduler.add("later", done.append, "later", not_before=time.time() + 0.5)
+        scheduler.add("now", done.append, "now", deps=[later])
+        scheduler.run()
+
+        self.assertEqual(done, ["now", "later"])
+
+    def test_order(self):
+        """Test whether due units are executed by due time and then in order"""
+
+        done = []
+        scheduler = Scheduler(max_workers=1)
+        now = time.time()
+        block = scheduler.add("block", time.sleep, 0.1)
+        for (name, not_before) in [("b", now - 1), ("c", now - 1), ("a", now - 2)]:
+            scheduler.add(name, done.append, name, deps=[block], not_before=not_before)
+        failed = scheduler.run()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(done, ["a", "b", "c"])
+
+    def test_failed_capped(self):
+        """Test whether the failed units kept are capped when running forever"""
+
+        def fail():
+            raise RuntimeError("fail")
+
+        scheduler = Scheduler(max_workers=2)
+        units = [scheduler.add("fail", fail) for _ in range(MAX_FAILED_UNITS + 5)]
+        failed = scheduler.run()
+
+        self.assertEqual(len(failed), MAX_FAILED_UNITS)
+        self.assertTrue(all(unit.done for unit in units))
+
+    def test_add_running(self):
+        """Test whether units can be added from other units"""
+
+        done = []
+        scheduler = Scheduler(max_workers=2)
+
+        def round(n):
+            done.append(n)
+            if n < 3:
+                scheduler.add("round", round, n + 1)
+
+        scheduler.add("round", round, 0)
+        scheduler.run()
+
+        self.assertEqual(done, [0, 1, 2, 3])
+
+    def test_stop(self):
+        """Test whether the scheduler ends when it is stopped"""
+
+        scheduler = Scheduler(max_workers=1)
+        scheduler.add("forever", lambda: None, not_before=time.time() + 3600)
+        threading.Timer(0.2, scheduler.stop).start()
+        scheduler.run()
+
+        self.assertEqual(len(scheduler.pending), 1)
+
+    def test_wakeup(self):
+        """Test whether waiting units are executed when woken up"""
+
+        done = []
+        scheduler = Scheduler(max_workers=1)
+        scheduler.add("backend", done.append, "backend", not_before=time.time() + 3600)
+        scheduler.add("global", done.append, "global", not_before=time.time() + 3600,
+                      global_task=True)
+        threading.Timer(0.2, scheduler.wakeup, args=("test",)).start()
+        threading.Timer(0.4, scheduler.stop).start()
+        scheduler.run()
+
+        self.assertEqual(done, ["backend"])
+
+    def test_wakeup_autorefresh(self):
+        """Test whether only the autorefresh of the units is executed when woken up for it"""
+
+        done = []
+        scheduler = Scheduler(max_workers=1)
+        scheduler.add("post enrich", done.append, "post enrich", not_before=time.time() + 3600,
+                      autorefresh=lambda: done.append("autorefresh"))
+        scheduler.add("collect", done.append, "collect", not_before=time.time() + 3600)
+        threading.Timer(0.2, scheduler.wakeup, args=("test", False, None, True)).start()
+        threading.Timer(0.4, scheduler.stop).start()
+        scheduler.run()
+
+        self.assertEqual(done, ["autorefresh"])
+        self.assertEqual(len(scheduler.pending), 2)
+
+    def test_repos_diff(self):
+        """Test whether the units of removed repos are cancelled and new ones added"""
+
+        class ReposDiff():
+            def get_removed(self, backend_section):
+                return ('old',) if backend_section == 'git' else ()
+
+        done = []
+        scheduler = Scheduler(max_workers=1)
+        scheduler.repos_listener = lambda diff: scheduler.add("new", done.append, "new",
+                                                              repo='new', section='git')
+        not_before = time.time() + 3600
+        old = scheduler.add("old", done.append, "old", repo='old', section='git',
+                            not_before=not_before)
+        scheduler.add("other", done.append, "other", repo='old', section='gerrit',
+                      not_before=not_before)
+        scheduler.add("after old", done.append, "after old", deps=[old])
+        threading.Timer(0.2, scheduler.wakeup, args=("test", False, ReposDiff())).start()
+        threading.Timer(0.4, scheduler.stop).start()
+        scheduler.run()
+
+        self.assertEqual(done, ["after old", "new"])
+        self.assertEqual([unit.name for unit in scheduler.pending], ["other"])
+
+    def test_repos_diff_backlog(self):
+        """Test whether a cancelled enrichment releases the backlog of its collection"""
+
+        class ReposDiff():
+            def get_removed(self, backend_section):
+                return ('old',)
+
+        done = []
+        backlog = Watermark(1)
+        scheduler = Scheduler(max_workers=1)
+
+        def release():
+            if collect.dispatched:
+                backlog.add(-1)
+
+        collect = scheduler.add("collect old", done.append, "collect old", gate=backlog,
+                                repo='old', section='git')
+        scheduler.add("enrich old", done.append, "enrich old", deps=[collect], repo='old',
+                      section='git', not_before=time.time() + 3600, on_cancel=release)
+        # it waits for the backlog taken by the collection of old
+        scheduler.add("collect new", done.append, "collect new", gate=backlog,
+                      deps=[collect], repo='new', section='git')
+        threading.Timer(0.2, scheduler.wakeup, args=("test", False, ReposDiff())).start()
+        threading.Timer(0.4, scheduler.stop).start()
+        scheduler.run()
+
+        self.assertEqual(done, ["collect old", "collect new"])
+        self.assertEqual(backlog.level, 1)
+
+    def test_gate(self):
+        """Test whether the units wait while their gate is closed"""
+
+        lock = threading.Lock()
+        backlog = Watermark(2, 1)
+        pending = {'now': 0, 'max': 0}
+
+        def collect():
+            with lock:
+                pending['now'] += 1
+                pending['max'] = max(pending['max'], pending['now'])
+
+        def enrich():
+            time.sleep(0.01)
+            with lock:
+                pending['now'] -= 1
+            backlog.add(-1)
+
+        scheduler = Scheduler(max_workers=4)
+        for i in range(6):
+            unit = scheduler.add("collect", collect, gate=backlog)
+            scheduler.add("enrich", enrich, deps=[unit])
+        failed = scheduler.run()
+
+        self.assertEqual(failed, [])
+        self.assertEqual(pending, {'now': 0, 'max': 2})
+        self.assertEqual(backlog.level, 0)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
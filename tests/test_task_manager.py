@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import threading
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.task_manager import AutorefreshState, TasksManager
+
+
+class CountTask():
+    """Task counting its executions"""
+
+    executions = 0
+
+    def __init__(self, config):
+        self.config = config
+
+    def set_backend_section(self, backend_section):
+        self.backend_section = backend_section
+
+    def execute(self):
+        CountTask.executions += 1
+
+
+class AutorefreshTask(CountTask):
+    """Task counting its autorefresh executions"""
+
+    autorefreshes = 0
+
+    def autorefresh(self):
+        AutorefreshTask.autorefreshes += 1
+
+
+class HungTask(CountTask):
+    """Task which does not finish until it is released"""
+
+    release = threading.Event()
+
+    def execute(self):
+        HungTask.release.wait()
+
+
+class TestTasksManager(unittest.TestCase):
+    """TasksManager tests"""
+
+    def test_notify(self):
+        """Test whether a sleeping manager is woken up"""
+
+        CountTask.executions = 0
+        stopper = threading.Event()
+        manager = TasksManager([CountTask], 'git', stopper, None, timer=3600)
+        manager.start()
+
+        # Wait for the manager to be sleeping
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 0)
+
+        TasksManager.notify("test")
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 1)
+
+        stopper.set()
+        TasksManager.notify("stop")
+        manager.join()
+        self.assertNotIn(manager, TasksManager.listeners)
+
+    def test_notify_global(self):
+        """Test whether global managers are woken up only if requested"""
+
+        CountTask.executions = 0
+        stopper = threading.Event()
+        manager = TasksManager([CountTask], None, stopper, None, timer=3600)
+        manager.start()
+        time.sleep(0.2)
+
+        TasksManager.notify("test")
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 0)
+
+        stopper.set()
+        TasksManager.notify("test", global_tasks=True)
+        manager.join()
+        self.assertEqual(CountTask.executions, 1)
+
+    def test_notify_repos_diff(self):
+        """Test whether only the managers with changed repositories are woken up"""
+
+        class ReposDiff():
+            def is_changed(self, backend_section):
+                return backend_section == 'git'
+
+        CountTask.executions = 0
+        stopper = threading.Event()
+        managers = [TasksManager([CountTask], section, stopper, None, timer=3600)
+                    for section in ['git', 'gerrit']]
+        for manager in managers:
+            manager.start()
+        time.sleep(0.2)
+
+        TasksManager.notify("test", repos_diff=ReposDiff())
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 1)
+
+        stopper.set()
+        TasksManager.notify("stop")
+        for manager in managers:
+            manager.join()
+
+    def test_notify_autorefresh(self):
+        """Test whether only the autorefresh is executed when identities are merged"""
+
+        CountTask.executions = 0
+        AutorefreshTask.autorefreshes = 0
+        stopper = threading.Event()
+        managers = [TasksManager([AutorefreshTask], 'git', stopper, None, timer=3600),
+                    TasksManager([AutorefreshTask], None, stopper, None, timer=3600)]
+        for manager in managers:
+            manager.start()
+        time.sleep(0.2)
+
+        TasksManager.notify("test", autorefresh=True)
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 0)
+        self.assertEqual(AutorefreshTask.autorefreshes, 1)
+
+        # the full execution is still done when woken up
+        TasksManager.notify("test")
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 1)
+
+        stopper.set()
+        TasksManager.notify("stop", global_tasks=True)
+        for manager in managers:
+            manager.join()
+
+    def test_task_timeout(self):
+        """Test whether a hung task is abandoned and the next ones are executed"""
+
+        CountTask.executions = 0
+        stopper = threading.Event()
+        manager = TasksManager([HungTask, CountTask], 'git', stopper, None, timer=3600,
+                               task_timeout=0.2)
+        manager.start()
+        time.sleep(0.2)
+
+        TasksManager.notify("test")
+        time.sleep(0.4)
+        self.assertEqual(CountTask.executions, 1)
+        self.assertEqual(len(manager.abandoned_tasks), 1)
+
+        # the hung task is not executed again while it is still running
+        TasksManager.notify("test")
+        time.sleep(0.2)
+        self.assertEqual(CountTask.executions, 2)
+
+        HungTask.release.set()
+        stopper.set()
+        TasksManager.notify("stop")
+        manager.join()
+
+
+class TestAutorefreshState(unittest.TestCase):
+    """AutorefreshState tests"""
+
+    def test_autorefresh(self):
+        """Test whether autorefresh flags and uuids are drained per backend"""
+
+        state = AutorefreshState()
+        self.assertFalse(state.is_active())
+        state.add_uuids(["uuid1"])
+
+        state.init_backends(["git", "github"])
+        self.assertTrue(state.is_active())
+        self.assertFalse(state.pop_dirty("git"))
+
+        state.add_uuids(["uuid1", "uuid2"])
+        state.mark_all_dirty()
+        self.assertTrue(state.pop_dirty("git"))
+        self.assertFalse(state.pop_dirty("git"))
+        self.assertTrue(state.is_dirty("github"))
+        self.assertEqual(sorted(state.drain_uuids("git")), ["uuid1", "uuid2"])
+        self.assertEqual(state.drain_uuids("git"), [])
+
+        # Pending work is kept when the backends are registered again
+        state.init_backends(["git", "github"])
+        self.assertTrue(state.pop_dirty("github"))
+        self.assertEqual(sorted(state.drain_uuids("github")), ["uuid1", "uuid2"])
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -22,7 +22,9 @@
 
 import json
 import logging
+import os
 import sys
+import tempfile
 import unittest
 
 import httpretty
@@ -34,7 +36,7 @@ from os import remove
 sys.path.insert(0, '..')
 
 from mordred.config import Config
-from mordred.task_projects import TaskProjects
+from mordred.task_projects import ECLIPSE_CACHE_SUFFIX, TaskProjects
 
 
 CONF_FILE = 'test.cfg'
@@ -88,6 +90,99 @@ class TestTaskProjects(unittest.TestCase):
         self.assertEqual(task.execute(), None)
         self.assertEqual(len(task.get_projects().keys()), 1)
 
+    def test_snapshot(self):
+        """Test whether the projects are shared read only and versioned"""
+        config = Config(CONF_FILE)
+        task = TaskProjects(config)
+        task.execute()
+
+        snapshot = TaskProjects.get_snapshot()
+        projects = task.get_projects()
+        self.assertIs(projects, snapshot.projects)
+        self.assertIs(task.get_projects(), projects)
+        self.assertIsInstance(projects['grimoire']['git'], tuple)
+        with self.assertRaises(TypeError):
+            projects['new_project'] = {}
+        with self.assertRaises(TypeError):
+            projects['grimoire']['git'] = []
+
+        # A new load creates a new snapshot, the old one is not changed
+        TaskProjects.set_projects({})
+        self.assertEqual(TaskProjects.get_snapshot().version, snapshot.version + 1)
+        self.assertIsNot(task.get_projects(), projects)
+        self.assertEqual(len(projects['grimoire']['git']), 2)
+
+    def test_repos_index(self):
+        """Test the index of the repositories by backend"""
+        projects = {
+            TaskProjects.GLOBAL_PROJECT: {
+                "gerrit": ["review.example.org"]
+            },
+            "p1": {
+                "meta": {"title": "P1"},
+                "git": ["https://example.org/a", "https://example.org/b"],
+                "gerrit": ["review.example.org"]
+            },
+            "p2": {
+                "git": ["https://Example.org/b/", "https://example.org/c"]
+            }
+        }
+        TaskProjects.set_projects(projects)
+
+        # the repositories written in a different way are not merged, they
+        # are matched as written with the projects of the enriched items
+        self.assertEqual(TaskProjects.get_repos_by_backend_section("git"),
+                         ("https://example.org/a", "https://example.org/b",
+                          "https://Example.org/b/", "https://example.org/c"))
+        self.assertEqual(TaskProjects.get_repos_by_backend_section("gerrit"),
+                         ("review.example.org",))
+        self.assertEqual(TaskProjects.get_repos_by_backend_section("jira"), ())
+        # the projects of the repositories, to find the ones moved
+        repo_projects = TaskProjects.get_snapshot().repo_projects
+        self.assertEqual(repo_projects["git"]["https://example.org/b"], {"p1"})
+        self.assertEqual(repo_projects["git"]["https://Example.org/b/"], {"p2"})
+        self.assertEqual(repo_projects["gerrit"]["review.example.org"],
+                         {TaskProjects.GLOBAL_PROJECT, "p1"})
+
+    def test_reload(self):
+        """Test whether the projects are reloaded only if the file changed"""
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            projects_file = os.path.join(tmp_dir, 'projects.json')
+            projects = {
+                "p1": {"git": ["https://example.org/a", "https://example.org/b"]},
+                "p2": {"git": ["https://example.org/c"]}
+            }
+            with open(projects_file, 'w') as fprojects:
+                json.dump(projects, fprojects)
+
+            config = Config(CONF_FILE)
+            config.set_param('projects', 'projects_file', projects_file)
+            task = TaskProjects(config)
+            task.execute()
+            version = TaskProjects.get_snapshot().version
+
+            # Not modified or touched without changes: not reloaded
+            task.execute()
+            os.utime(projects_file, (0, 0))
+            task.execute()
+            self.assertEqual(TaskProjects.get_snapshot().version, version)
+
+            projects["p1"]["git"] = ["https://example.org/a", "https://example.org/d"]
+            projects["p2"]["git"].append("https://example.org/b")
+            with open(projects_file, 'w') as fprojects:
+                json.dump(projects, fprojects)
+            os.utime(projects_file, (1, 1))
+            task.execute()
+            self.assertEqual(TaskProjects.get_snapshot().version, version + 1)
+
+            diff = TaskProjects.get_repos_last_diff()
+            self.assertEqual(diff.get_added("git"), ("https://example.org/d",))
+            self.assertEqual(diff.get_removed("git"), ())
+            self.assertEqual(diff.get_moved("git"), ("https://example.org/b",))
+            self.assertTrue(diff.is_changed("git"))
+            self.assertFalse(diff.is_changed("gerrit"))
+
     @httpretty.activate
     def test_run_eclipse(self):
         """Test whether the Task could be run getting projects from Eclipse"""
@@ -116,6 +211,7 @@ class TestTaskProjects(unittest.TestCase):
                              [add_project, remove_project].sort())
 
         remove(projects_file)
+        remove(projects_file + ECLIPSE_CACHE_SUFFIX)
 
     @httpretty.activate
     def test_convert_from_eclipse(self):
@@ -133,6 +229,49 @@ class TestTaskProjects(unittest.TestCase):
         self.assertTrue(TaskProjects.GLOBAL_PROJECT in projects)
 
         remove(projects_file)
+        remove(projects_file + ECLIPSE_CACHE_SUFFIX)
+
+    @httpretty.activate
+    def test_eclipse_cache(self):
+        """Test whether the Eclipse projects are downloaded and written only if changed"""
+
+        eclipse_projects = read_file(ECLIPSE_PROJECTS_FILE)
+        etag = '"v1"'
+        http_requests = []
+
+        def request_callback(method, uri, headers):
+            http_requests.append(httpretty.last_request())
+            if httpretty.last_request().headers.get('If-None-Match') == etag:
+                return (304, headers, "")
+            headers['ETag'] = etag
+            return (200, headers, eclipse_projects)
+
+        httpretty.register_uri(httpretty.GET, ECLIPSE_PROJECTS_URL,
+                               responses=[httpretty.Response(body=request_callback)])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            projects_file = os.path.join(tmp_dir, 'projects.json')
+            config = Config(CONF_FILE)
+            config.set_param('projects', 'load_eclipse', True)
+            config.set_param('projects', 'projects_file', projects_file)
+            task = TaskProjects(config)
+            task.execute()
+            self.assertTrue(os.path.isfile(projects_file + ECLIPSE_CACHE_SUFFIX))
+            os.utime(projects_file, (0, 0))
+
+            # Not modified: the projects file is not written again
+            task.execute()
+            self.assertEqual(len(http_requests), 2)
+            self.assertEqual(http_requests[1].headers.get('If-None-Match'), etag)
+            self.assertEqual(os.path.getmtime(projects_file), 0)
+
+            # Modified but converted to the same projects: not written again
+            etag = '"v2"'
+            task.execute()
+            self.assertEqual(os.path.getmtime(projects_file), 0)
+
+            with open(projects_file) as fprojects:
+                self.assertEqual(len(json.load(fprojects)), 302)
 
 
 if __name__ == "__main__":
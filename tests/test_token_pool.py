@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import sys
+import time
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.metrics import GITHUB_TOKEN_REMAINING
+from mordred.token_pool import TokenPool
+
+
+class FakeTokenPool(TokenPool):
+    """TokenPool with the quotas of the tokens in a dict"""
+
+    def __init__(self, tokens, quotas):
+        super().__init__(tokens)
+        self.quotas = quotas
+        self.checks = 0
+
+    def fetch_rate_limit(self, token):
+        self.checks += 1
+        (remaining, reset) = self.quotas[token]
+        if reset <= time.time():
+            # the quota is restored
+            self.quotas[token] = (5000, time.time() + 3600)
+        return self.quotas[token]
+
+
+class TestTokenPool(unittest.TestCase):
+    """TokenPool tests"""
+
+    def test_get_pool(self):
+        """Test whether the pools are shared by the users of the same tokens"""
+
+        pool = TokenPool.get_pool(['a', 'b'])
+        self.assertIs(TokenPool.get_pool(['b', 'a']), pool)
+        self.assertIsNot(TokenPool.get_pool(['a']), pool)
+
+    def test_metrics(self):
+        """Test whether the quotas are exposed by backend section and token fingerprint"""
+
+        reset = time.time() + 3600
+        pool = TokenPool.get_pool(['token1', 'token2'], 'github')
+        TokenPool.get_pool(['token2', 'token1'], 'github:issues')
+        other = TokenPool.get_pool(['token1'], 'github:prs')
+        pool.update('token1', 3000, reset)
+        other.update('token1', 2000, reset)
+
+        fingerprint = TokenPool.get_fingerprint('token1')
+        self.assertEqual(fingerprint, TokenPool.get_fingerprint('token1'))
+        self.assertNotEqual(fingerprint, TokenPool.get_fingerprint('token2'))
+        self.assertNotIn('token1', fingerprint)
+        self.assertEqual(GITHUB_TOKEN_REMAINING.values[('github', fingerprint)], 3000)
+        self.assertEqual(GITHUB_TOKEN_REMAINING.values[('github:issues', fingerprint)], 3000)
+        self.assertEqual(GITHUB_TOKEN_REMAINING.values[('github:prs', fingerprint)], 2000)
+
+    def test_acquire(self):
+        """Test whether the work is spread between the tokens by their budget"""
+
+        reset = time.time() + 3600
+        pool = FakeTokenPool(['a', 'b', 'c'], {'a': (3000, reset), 'b': (1000, reset),
+                                               'c': (0, reset)})
+
+        tokens = [pool.acquire() for _ in range(4)]
+        self.assertEqual(tokens, ['a', 'a', 'a', 'b'])
+        self.assertEqual(pool.checks, 3)
+
+        for token in tokens:
+            pool.release(token)
+        with pool.token() as token:
+            self.assertEqual(token, 'a')
+        self.assertEqual(pool.best_token(), 'a')
+
+        # The quotas are not checked again until they are reset
+        self.assertEqual(pool.checks, 3)
+
+    def test_exhausted(self):
+        """Test whether the work waits for the reset when all the tokens are exhausted"""
+
+        pool = FakeTokenPool(['a', 'b'], {'a': (0, time.time() + 3600),
+                                          'b': (0, time.time() + 1)})
+        token = pool.acquire()
+        pool.release(token)
+        self.assertEqual(token, 'b')
+        self.assertEqual(pool.checks, 3)
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2017 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, 51 Franklin Street, Fifth Floor, Boston, MA 02110-1335, USA.
+#
+# Authors:
+#     Alvaro del Castillo <acs@bitergia.com>
+
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+
+# Hack to make sure that tests import the right packages
+# due to setuptools behaviour
+sys.path.insert(0, '..')
+
+from mordred.pool import WorkerPool
+from mordred.trace import Tracer
+
+
+def collect_repo(repo):
+    with Tracer.span("collect", repo=repo):
+        if repo == "fail":
+            raise RuntimeError("fail")
+
+
+class TestTracer(unittest.TestCase):
+    """Tracer tests"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.trace_file = os.path.join(self.tmp_dir.name, "trace.json")
+
+    def tearDown(self):
+        Tracer.configure(None)
+        self.tmp_dir.cleanup()
+
+    def read_spans(self):
+        spans = {}
+        with open(self.trace_file) as trace_file:
+            for line in trace_file:
+                request = json.loads(line)
+                for span in request["resourceSpans"][0]["scopeSpans"][0]["spans"]:
+                    spans.setdefault(span["name"], []).append(span)
+        return spans
+
+    def test_disabled(self):
+        """Test whether no spans are written when tracing is disabled"""
+
+        with Tracer.span("cycle"):
+            self.assertIsNone(Tracer.current())
+
+        self.assertFalse(os.path.exists(self.trace_file))
+
+    def test_spans(self):
+        """Test whether the spans are nested also in the pool of workers"""
+
+        Tracer.configure(self.trace_file)
+        with Tracer.span("cycle") as cycle:
+            with Tracer.span("TaskRawDataCollection", section="git") as task:
+                pool = WorkerPool(max_workers=2)
+                for repo in ["repo1", "repo2", "fail"]:
+                    pool.submit(repo, collect_repo, repo)
+                pool.wait()
+                pool.shutdown()
+        self.assertIsNone(Tracer.current())
+
+        spans = self.read_spans()
+        self.assertNotIn("parentSpanId", spans["cycle"][0])
+        self.assertEqual(spans["TaskRawDataCollection"][0]["parentSpanId"], cycle.span_id)
+        self.assertEqual(spans["TaskRawDataCollection"][0]["attributes"],
+                         [{"key": "section", "value": {"stringValue": "git"}}])
+        self.assertEqual(len(spans["collect"]), 3)
+        for span in spans["collect"]:
+            self.assertEqual(span["traceId"], cycle.trace_id)
+            self.assertEqual(span["parentSpanId"], task.span_id)
+            if span["attributes"][0]["value"]["stringValue"] == "fail":
+                self.assertEqual(span["status"], {"code": 2, "message": "RuntimeError: fail"})
+            else:
+                self.assertEqual(span["status"], {})
+
+
+if __name__ == "__main__":
+    unittest.main(warnings='ignore')